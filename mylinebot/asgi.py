@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mylinebot.settings')
 
 application = get_asgi_application()
+
+# 設定 PREFETCH_THREAD=True 時在 web process 內預先更新熱門資料集
+from urlbot.prefetch import start_prefetch_thread  # noqa: E402
+
+start_prefetch_thread()
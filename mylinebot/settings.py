@@ -23,6 +23,122 @@ WEATHER_API_TOKEN=os.getenv('WEATHER_API_TOKEN')
 GET_NEWS_API_TOKEN=os.getenv('GET_NEWS_API_TOKEN')
 DJANGO_SECRET_KEY=os.getenv('DJANGO_SECRET_KEY')
 
+# 對外 API 的共用連線池設定 (urlbot/http_client.py)
+HTTP_CLIENT = {
+    'POOL_SIZE': int(os.getenv('HTTP_POOL_SIZE', 10)),                 # 每個 host 保留的連線數
+    'KEEP_ALIVE': os.getenv('HTTP_KEEP_ALIVE', 'True') == 'True',
+    'TIMEOUT': float(os.getenv('HTTP_TIMEOUT', 5)),                    # 預設逾時秒數
+    'HOST_TIMEOUTS': {
+        'openapi.twse.com.tw': 10,  # 全市場資料量大 給較長的逾時
+    },
+    'RETRIES': int(os.getenv('HTTP_RETRIES', 2)),
+    'BACKOFF_FACTOR': float(os.getenv('HTTP_BACKOFF_FACTOR', 0.3)),
+    'ASYNC_POOL_SIZE': int(os.getenv('HTTP_ASYNC_POOL_SIZE', 100)),    # 非同步模式每個 host 的同時連線數
+    'ASYNC_TOTAL_LIMIT': int(os.getenv('HTTP_ASYNC_TOTAL_LIMIT', 200)),
+    'COALESCE': os.getenv('HTTP_COALESCE', 'True') == 'True',          # 合併同時進行的相同 GET 請求
+}
+
+# Webhook 處理模式: sync 處理完才回 200 / background 立即回 200 由背景處理池回覆
+LINEBOT_WEBHOOK_MODE = os.getenv('LINEBOT_WEBHOOK_MODE', 'sync')
+LINEBOT_BACKGROUND = {
+    'WORKERS': int(os.getenv('LINEBOT_WORKERS', 4)),                    # 背景執行緒數量
+    'QUEUE_SIZE': int(os.getenv('LINEBOT_QUEUE_SIZE', 100)),            # 佇列上限
+    'OVERFLOW_POLICY': os.getenv('LINEBOT_OVERFLOW_POLICY', 'inline'),  # inline / block / drop
+    'PUT_TIMEOUT': 0.5,                                                 # block 策略等待秒數
+    'DRAIN_TIMEOUT': 10,                                                # 關閉時等待佇列清空秒數
+}
+
+# sync 模式下同一個 webhook 內多個事件的並行上限
+LINEBOT_EVENT_CONCURRENCY = int(os.getenv('LINEBOT_EVENT_CONCURRENCY', 4))
+
+# 使用非同步 webhook (需以 ASGI 啟動: gunicorn mylinebot.asgi -k uvicorn.workers.UvicornWorker)
+LINEBOT_ASYNC_WEBHOOK = os.getenv('LINEBOT_ASYNC_WEBHOOK', 'False') == 'True'
+
+# 對外資料集快取 (urlbot/cache.py)
+# SHARED_BACKEND 指定 CACHES 內的別名 讓多個 worker 共用快取 留空則只在 process 內快取
+DATASET_CACHE = {
+    'SHARED_BACKEND': os.getenv('DATASET_CACHE_BACKEND') or None,
+    'MAX_ENTRIES': {
+        'twse': 16,
+        'cwa': 4,
+        'currency': 2,
+        'shorturl': 1024,
+        'shortlink': 1024,
+        'redirect': int(os.getenv('SHORT_LINK_CACHE_MAX_ENTRIES', 4096)),  # 自架短網址的轉址目標
+        'news': int(os.getenv('NEWS_CACHE_MAX_ENTRIES', 256)),
+    },
+}
+
+# 證交所資料快取時間 (台北時間) 收盤後的發布時段內縮短快取時間
+TWSE_CACHE = {
+    'REFRESH_TIMES': ['14:00', '16:30'],  # 證交所更新資料的時間點
+    'WEEKDAYS': [0, 1, 2, 3, 4],          # 週一至週五
+    'PUBLISH_WINDOW': ('13:30', '18:00'),
+    'WINDOW_TTL': 15 * 60,
+    'MAX_TTL': 12 * 60 * 60,
+    'FETCH_DEADLINE': 8,                  # 同時下載多個資料集的共同截止秒數
+    'PARTIAL_TTL': 60,                    # 只拿到部分資料時的快取秒數
+    'STREAM_CHUNK_SIZE': 64 * 1024,       # 串流解析全市場資料時每次讀取的位元組數
+}
+
+# 中央氣象署資料快取時間 (台北時間) 觀測資料每小時更新 預報約每 6 小時發布
+CWA_CACHE = {
+    'OBSERVATION_TIMES': [f'{hour:02d}:10' for hour in range(24)],  # 整點觀測約 10 分鐘後發布
+    'FORECAST_TIMES': ['05:15', '11:15', '17:15', '23:15'],
+    'MAX_TTL': 6 * 60 * 60,
+    'FETCH_DEADLINE': 6,  # 預報與即時觀測同時查詢的共同截止秒數
+}
+
+# 匯率表快取秒數 過期後 STALE_TTL 秒內先回傳舊匯率並在背景更新
+CURRENCY_CACHE = {
+    'TTL': int(os.getenv('CURRENCY_CACHE_TTL', 5 * 60)),
+    'STALE_TTL': int(os.getenv('CURRENCY_CACHE_STALE_TTL', 30 * 60)),
+}
+
+# 新聞搜尋結果快取秒數 依正規化後的關鍵字快取 過期後 STALE_TTL 秒內先回傳舊結果並在背景更新
+NEWS_CACHE = {
+    'TTL': int(os.getenv('NEWS_CACHE_TTL', 10 * 60)),
+    'STALE_TTL': int(os.getenv('NEWS_CACHE_STALE_TTL', 50 * 60)),
+}
+
+# 短網址對應的快取秒數 資料庫 (ShortUrl) 為永久保存 快取只是避免重複查詢
+SHORT_URL_CACHE = {
+    'TTL': 24 * 60 * 60,
+}
+
+# 縮網址後端: bitly 呼叫 Bitly API / local 使用自架短網址 (urlbot/shortlink.py) 由本站 /s/<短碼> 轉址
+# BASE_URL 為對外的短網址前綴 例如 https://roylinebot.duckdns.org/s/
+URL_SHORTENER = {
+    'BACKEND': os.getenv('URL_SHORTENER_BACKEND', 'bitly'),
+    'BASE_URL': os.getenv('SHORT_URL_BASE_URL', ''),
+    'REDIRECT_CACHE_TTL': 24 * 60 * 60,  # 短碼與目標網址的對應不會改變 只受 LRU 容量限制
+    'HIT_FLUSH_SIZE': int(os.getenv('SHORT_LINK_HIT_FLUSH_SIZE', 100)),          # 累積多少次點擊寫入資料庫
+    'HIT_FLUSH_INTERVAL': int(os.getenv('SHORT_LINK_HIT_FLUSH_INTERVAL', 30)),   # 最久多少秒寫入一次
+}
+
+# 熱門資料集的預先更新排程 (urlbot/prefetch.py) 在快取到期時主動重新下載
+# THREAD=True 時在 web process 內以背景執行緒執行 (只適用於 process 內快取 每個 worker 各自更新)
+# 設定共享快取 (DATASET_CACHE_BACKEND) 時只由 python manage.py prefetch 執行 避免每個 worker 重複下載
+# 各工作以 TTL (快取時間函式 twse/cwa_observation/cwa_forecast 在到期前 MARGIN 秒更新)、
+# TIMES (每日時間點 可搭配 WEEKDAYS) 或 INTERVAL (秒) 設定排程 沒有列出的工作不執行
+PREFETCH = {
+    'THREAD': os.getenv('PREFETCH_THREAD', 'False') == 'True',
+    'RUN_ON_START': True,
+    'JOBS': {
+        # 證交所資料在發布時段內只快取 WINDOW_TTL 依快取本身的到期時間重新下載 整個時段都不會過期
+        'twse_stock_index': {'TTL': 'twse', 'MARGIN': 60},
+        'twse_MI_QFIIS': {'TTL': 'twse', 'MARGIN': 60},
+        'cwa_observation': {'TIMES': CWA_CACHE['OBSERVATION_TIMES']},
+        'cwa_forecast': {'TIMES': CWA_CACHE['FORECAST_TIMES']},
+        'currency': {'INTERVAL': CURRENCY_CACHE['TTL'] * 0.8},  # 在匯率表過期前更新
+    },
+}
+
+# 同時下載多個資料集用的執行緒池大小 (urlbot/concurrency.py)
+IO_CONCURRENCY = int(os.getenv('IO_CONCURRENCY', 16))
+# 背景工作 (快取背景更新、短網址點擊次數寫入) 用的執行緒池大小 與上面的請求並行分開
+BACKGROUND_CONCURRENCY = int(os.getenv('BACKGROUND_CONCURRENCY', 2))
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -99,9 +215,24 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # 批次操作的 transaction 會先查詢再寫入 以 IMMEDIATE 開始才會等待寫入鎖 而不是直接回報 database is locked
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
     }
 }
 
+# 快取
+# shared: 多個 gunicorn worker 共用的快取 (設定 DATASET_CACHE_BACKEND=shared 啟用)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'dataset_cache',
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
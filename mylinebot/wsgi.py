@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mylinebot.settings')
 
 application = get_wsgi_application()
+
+# 設定 PREFETCH_THREAD=True 時在 web process 內預先更新熱門資料集
+from urlbot.prefetch import start_prefetch_thread  # noqa: E402
+
+start_prefetch_thread()
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Todolist
+from .models import ShortLink, ShortUrl, StockWatchlist, Todolist
 # Register your models here.
 
-admin.site.register(Todolist)
\ No newline at end of file
+admin.site.register(Todolist)
+admin.site.register(ShortUrl)
+admin.site.register(ShortLink)
+admin.site.register(StockWatchlist)
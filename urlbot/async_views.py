@@ -0,0 +1,516 @@
+import asyncio
+import logging
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
+from linebot.models import MessageEvent
+from .cache import get_dataset_cache
+from .concurrency import run_parallel_async
+from .http_client import get_async_http_client
+from .json_stream import iter_json_array, read_columns
+from .models import ShortLink, ShortUrl
+from .schedules import cwa_forecast_ttl, cwa_observation_ttl, twse_ttl
+from .registry import get_async_registry
+from .views import (
+    LineBotCallbackAPI, URLShortener, LocalURLShortener, get_url_shortener_class, CurrencyTransformAPI, WeatherAPI, WeatherForecastAPI,
+    StockAPI, NewsAPI, WeatherIntegratedAPI, _is_complete_dataset, _is_complete_index, normalize_url, error_message,
+)
+from .replies import REPLIES
+from .rendering import as_messages
+
+logger = logging.getLogger(__name__)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncLineBotCallbackView(View):
+    """非同步 LINE Bot webhook (ASGI)
+
+    與 LineBotCallbackAPI 支援相同的指令，但對外請求全部透過共用的 aiohttp session，
+    單一 uvicorn worker 可以同時處理大量進行中的查詢。
+    設定 LINEBOT_ASYNC_WEBHOOK=True 並以 ASGI 啟動時使用。
+    """
+    router = LineBotCallbackAPI.router  # 處理方法名稱相同 共用同一份路由
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        registry = get_async_registry()
+        self.line_bot_api = registry.line_bot_api
+        self.parser = registry.parser
+        self.shortener = registry.shortener
+        self.currency_transform = registry.currency_transform
+        self.news = registry.news
+        self.stock = registry.stock
+        self.weather = registry.weather
+        self.todolist = registry.todolist
+        self.stock_tracker = registry.stock_tracker
+
+    async def get(self, request, *args, **kwargs):
+        """測試API是否成功"""
+        return JsonResponse({"success": True, "message": "連接成功"})
+
+    async def post(self, request, *args, **kwargs):
+        """處理 Line webhook 請求"""
+        body = request.body.decode('utf-8')
+        signature = request.META.get('HTTP_X_LINE_SIGNATURE', '')
+
+        try:
+            events = self.parser.parse(body, signature)
+        except InvalidSignatureError:
+            return JsonResponse({'error': 'Invalid signature'}, status=403)
+
+        except LineBotApiError:
+            return JsonResponse({'error': 'LineBotApi error'}, status=400)
+
+        # 同一批次的事件並行處理 上限與同步模式相同
+        semaphore = asyncio.Semaphore(settings.LINEBOT_EVENT_CONCURRENCY)
+        message_events = [event for event in events if isinstance(event, MessageEvent)]
+        await asyncio.gather(
+            *(self._process_event(event, semaphore) for event in message_events),
+            return_exceptions=True,
+        )
+
+        return JsonResponse({'result': 'ok'})
+
+    async def _process_event(self, event, semaphore):
+        """處理單一訊息事件並回覆使用者"""
+        async with semaphore:
+            try:
+                response = await self._handle_message(event)
+                await self.line_bot_api.reply_message(event.reply_token, as_messages(response))
+            except Exception:
+                logger.exception("處理事件失敗")
+
+    async def _handle_message(self, event):
+        """處理用戶發送的消息 與 LineBotCallbackAPI._handle_message 相同"""
+        match = self.router.resolve(event.message.text)
+
+        #找不到指令
+        if match is None:
+            return REPLIES.message('help')
+
+        route, args = match
+        try:
+            return await route.invoke(self, args, event.source.user_id)
+        except Exception as error:
+            return error_message(error)
+
+    async def _handle_url_shortener(self, args):
+        """處理縮網址指令"""
+        if not args:
+            return REPLIES.message('url_shortener_usage')
+
+        response = await self.shortener.get_shorten_url(args[0])
+        return response if isinstance(response, str) else f"對應的縮網址：{response}"
+
+    async def _handle_currency(self, args):
+        """處理匯率指令"""
+        if len(args) < 2:
+            return REPLIES.message('currency_usage')
+        currency1, currency2 = args[0], args[1]
+        response = await self.currency_transform.get_result(currency1, currency2)
+        return response if isinstance(response, str) else f"當前 1 {currency1} 可以兌換 {response} {currency2}"
+
+    async def _handle_stock(self, args):
+        """處理股票指令"""
+        if not args:
+            return REPLIES.message('stock_usage')
+
+        if len(args) > 1:
+            return await self.stock.get_stocks_summary(args)
+
+        return await self.stock.get_stock_full_info(args[0])
+
+    async def _handle_foreign_holdings(self, args):
+        return await self.stock.get_foreign_holdings_info()
+
+    async def _handle_daily_trading(self, args):
+        return await self.stock.get_MI_INDEX20()
+
+    async def _handle_stock_ranking(self, name, args):
+        n = int(args[0]) if args and args[0].isdigit() else 5
+        return await self.stock.get_ranking(name, n)
+
+    async def _handle_stock_tracker(self, command, codes, user_id):
+        """股票追蹤清單 行情由非同步的 stock 服務取得 指令處理與資料庫操作交給同步執行緒"""
+        tracker = self.stock_tracker
+        index = await self.stock.get_stock_index() if tracker.needs_index(command, codes) else None
+        return await sync_to_async(tracker.handle_command_with_index)(command, codes, user_id, index)
+
+    async def _handle_weather(self, args):
+        """處理天氣指令"""
+        if not args:
+            return REPLIES.message('weather_usage')
+
+        return await self.weather.get_weather_info(args[0])
+
+    async def _handle_news(self, args):
+        """處理新聞指令"""
+        if not args:
+            return REPLIES.message('news_usage')
+        return await self.news.get_new_article(args[0])
+
+    async def _handle_todolist(self, command, args, user_id):
+        """處理待辦事項指令 資料庫操作交給同步執行緒"""
+        if command is None:
+            return REPLIES.message('todo_usage')
+
+        return await sync_to_async(self.todolist.handle_command)(command, args, user_id)
+
+
+class AsyncURLShortener(URLShortener):
+    """URLShortener 的非同步版本"""
+
+    async def _make_request(self, url):
+        """處理發送請求 返回一個respose 物件"""
+        try:
+            response = await get_async_http_client().post(
+                self.api_url,
+                headers=self.headers,
+                json={'long_url': url}
+            )
+            response.raise_for_status()
+            return response
+
+        except requests.exceptions.Timeout:
+            return "請求超時"
+
+        except requests.exceptions.ConnectionError:
+            return "網路連接錯誤"
+
+        except requests.exceptions.HTTPError as e:
+            status_code = e.response.status_code
+            error_mapping = {
+                400: "無效的請求",
+                401: "認證失敗",
+                403: "沒有權限",
+            }
+            return f"代碼錯誤-{status_code}-{error_mapping.get(status_code)}-HTTPError"
+
+    async def _get_or_create_short_url(self, long_url, normalized_url, url_hash):
+        """先查資料庫 沒有才呼叫 bitly 並保存結果 返回 ShortUrl 或錯誤訊息"""
+        short_url = await ShortUrl.objects.filter(url_hash=url_hash).afirst()
+        if short_url is not None:
+            return short_url
+
+        response = await self._make_request(long_url)
+        if isinstance(response, str):
+            return response
+
+        link = self._handle_response(response)
+        if self._validate_url(link) is not True:
+            return link
+
+        short_url, _ = await ShortUrl.objects.aget_or_create(
+            url_hash=url_hash, defaults={'long_url': normalized_url, 'short_url': link},
+        )
+        return short_url
+
+    async def get_shorten_url(self, long_url: str) -> str:
+        """縮短指定的 URL 與同步版本共用 shorturl 快取與資料表"""
+        try:
+            validation_result = self._validate_url(long_url)
+            if validation_result is not True:
+                return validation_result
+
+            normalized_url = normalize_url(long_url)
+            url_hash = ShortUrl.hash_url(normalized_url)
+            result = await get_dataset_cache(self.cache_name).aget_or_fetch(
+                url_hash,
+                lambda: self._get_or_create_short_url(long_url, normalized_url, url_hash),
+                ttl=settings.SHORT_URL_CACHE['TTL'],
+            )
+            return result if isinstance(result, str) else result.short_url
+        except Exception as e:
+            return f"未預期的錯誤: {str(e)}"
+
+
+class AsyncLocalURLShortener(AsyncURLShortener, LocalURLShortener):
+    """LocalURLShortener 的非同步版本 與同步版本共用 shortlink 快取與資料表"""
+
+    async def _get_or_create_short_url(self, long_url, normalized_url, url_hash):
+        short_link, _ = await ShortLink.objects.aget_or_create(url_hash=url_hash, defaults={'long_url': normalized_url})
+        return short_link
+
+
+def get_async_url_shortener_class(backend=None):
+    """get_url_shortener_class 的非同步版本"""
+    shorteners = {URLShortener: AsyncURLShortener, LocalURLShortener: AsyncLocalURLShortener}
+    return shorteners[get_url_shortener_class(backend)]
+
+
+class AsyncCurrencyTransformAPI(CurrencyTransformAPI):
+    """CurrencyTransformAPI 的非同步版本"""
+
+    async def _make_request(self):
+        """返回一個 AsyncResponse 物件"""
+        try:
+            return await get_async_http_client().get(self.url)
+
+        except requests.exceptions.ConnectionError:
+            return "網路出現錯誤"
+
+        except requests.exceptions.Timeout:
+            return "請求超時"
+
+    async def _get_rate_matrix(self):
+        """取得交叉匯率表 與同步版本共用 currency 快取"""
+        async def fetch():
+            return self._handle_response(await self._make_request())
+
+        config = settings.CURRENCY_CACHE
+        return await get_dataset_cache('currency').aget_or_fetch(
+            'capi', fetch, ttl=config['TTL'], stale_ttl=config['STALE_TTL'],
+        )
+
+    async def get_result(self, currency1, currency2):
+        try:
+            validate_result = self._validate_input(currency1, currency2)
+            if validate_result is not True:
+                return validate_result
+
+            return self._lookup_rate(await self._get_rate_matrix(), currency1, currency2)
+        except Exception as e:
+            return f"未預期錯誤{str(e)}"
+
+
+class AsyncNewsAPI(NewsAPI):
+    """NewsAPI 的非同步版本"""
+
+    async def _make_request(self, query):
+        """返回一個 AsyncResponse 物件"""
+        try:
+            params = {
+                'q': query,
+                'language': 'zh',
+                'apiKey': self.api_key
+            }
+            response = await get_async_http_client().get(self.url, params=params)
+            response.raise_for_status()
+            return response
+
+        except requests.exceptions.Timeout:
+            return "請求超時"
+
+        except requests.RequestException as e:
+            return f"請求錯誤{str(e)}"
+
+    async def _get_articles(self, query):
+        """取得新聞 與同步版本共用 news 快取"""
+        async def fetch():
+            return self._handle_response(await self._make_request(query))
+
+        config = settings.NEWS_CACHE
+        return await get_dataset_cache('news').aget_or_fetch(
+            query, fetch, ttl=config['TTL'], stale_ttl=config['STALE_TTL'],
+        )
+
+    async def get_new_article(self, keyword):
+        """搜尋新聞 回傳前三則的整理結果"""
+        try:
+            return self._format_articles(await self._get_articles(self._query_key(keyword)))
+        except Exception as e:
+            return f"發生錯誤 {str(e)}"
+
+
+class AsyncStockAPI(StockAPI):
+    """StockAPI 的非同步版本"""
+
+    async def _make_request(self, url):
+        """檢查request請求"""
+        try:
+            response = await get_async_http_client().get(url)
+            response.raise_for_status()
+            return response
+
+        except requests.exceptions.Timeout:
+            return "請求超時"
+
+        except requests.exceptions.RequestException as e:
+            return f"請求錯誤:{str(e)}"
+
+    async def get_dataset(self, url):
+        """取得證交所資料集 與同步版本共用 twse 快取"""
+        async def fetch():
+            return self._handle_response(await self._make_request(url))
+
+        return await get_dataset_cache('twse').aget_or_fetch(
+            self._dataset_key(url), fetch, ttl=twse_ttl, cacheable=_is_complete_dataset,
+        )
+
+    async def get_foreign_holdings_info(self):
+        """獲取外資持股前5名資訊"""
+        return self._format_foreign_holdings(await self.get_dataset(self.url_fund_MI_QFIIS_sort_20))
+
+    async def get_MI_INDEX20(self):
+        """集中市場每日成交量前五名證券 由快取的全市場資料計算"""
+        index = await self.get_stock_index()
+        if not self._has_daily_data(index):
+            return self._format_MI_INDEX20(await self.get_dataset(self.url_MI_INDEX20))
+        return self._format_ranking(index, '成交量', 5)
+
+    async def get_stocks_summary(self, stock_codes):
+        """多檔股票摘要"""
+        return self.format_stocks_summary(await self.get_stock_index(), stock_codes)
+
+    async def get_ranking(self, name, n=5):
+        """依排行名稱取得前 n 名"""
+        return self._format_ranking(await self.get_stock_index(), name, n)
+
+    async def _download(self, url, fields):
+        """下載單一資料集 aiohttp 回應已整份讀入 仍以逐筆解析只保留 fields 欄位
+
+        全市場資料上萬筆 解析交給執行緒 不阻塞 event loop 上其他進行中的請求。
+        """
+        response = await self._make_request(url)
+        if isinstance(response, str):
+            return response
+
+        try:
+            return await asyncio.to_thread(self._parse_columns, response.content, fields)
+
+        except (ValueError, AttributeError) as e:
+            return f"解析資料錯誤:{str(e)}"
+
+    def _parse_columns(self, content, fields):
+        size = settings.TWSE_CACHE['STREAM_CHUNK_SIZE']
+        content = memoryview(content)
+        chunks = (content[start:start + size] for start in range(0, len(content), size))
+        return read_columns(iter_json_array(chunks), fields)
+
+    async def _fetch_datasets(self, datasets):
+        """同時下載多個證交所資料集 共用 FETCH_DEADLINE 截止時間"""
+        return await run_parallel_async(
+            {name: self._download(url, fields) for name, (url, fields) in datasets.items()},
+            timeout=settings.TWSE_CACHE['FETCH_DEADLINE'],
+        )
+
+    async def get_stock_index(self):
+        """取得股票代碼索引 兩個資料集同時下載"""
+        async def fetch():
+            datasets = await self._fetch_datasets({
+                'BWIBBU_ALL': (self.url_BWIBBU_ALL, self.basic_fields),
+                'STOCK_DAY_ALL': (self.url_STOCK_DAY_ALL, self.daily_fields),
+            })
+            return self._store_partial_index(
+                self._build_stock_index(datasets['BWIBBU_ALL'], datasets['STOCK_DAY_ALL'])
+            )
+
+        return await get_dataset_cache('twse').aget_or_fetch(
+            'STOCK_INDEX', fetch, ttl=twse_ttl, cacheable=_is_complete_index,
+        )
+
+    async def get_stock_full_info(self, stock_code):
+        """獲取完整的股票資訊"""
+        return self._format_stock_full_info(await self.get_stock_index(), stock_code)
+
+
+class AsyncWeatherAPI(WeatherAPI):
+    """WeatherAPI 的非同步版本"""
+
+    async def _make_request(self):
+        try:
+            response = await get_async_http_client().get(self.url, params=self.params)
+            response.raise_for_status()
+            return response
+
+        except requests.exceptions.Timeout:
+            return "請求超時"
+
+        except requests.exceptions.HTTPError as e:
+            return f"請求錯誤{str(e)}"
+
+    async def _get_snapshot(self):
+        """取得全國觀測資料快照 與同步版本共用 cwa 快取"""
+        async def fetch():
+            return self._build_snapshot(self._handle_response(await self._make_request()))
+
+        return await get_dataset_cache('cwa').aget_or_fetch('O-A0003-001', fetch, ttl=cwa_observation_ttl)
+
+    async def get_current_weather(self, location_name):
+        try:
+            snapshot = await self._get_snapshot()
+            if isinstance(snapshot, str):
+                return snapshot
+
+            return self._format_current_weather(snapshot, location_name)
+
+        except Exception as e:
+            return f"非預期錯誤{str(e)}"
+
+    async def get_county_stations(self, county):
+        snapshot = await self._get_snapshot()
+        if isinstance(snapshot, str):
+            return []
+        return snapshot.counties.get(county, [])
+
+
+class AsyncWeatherForecastAPI(WeatherForecastAPI):
+    """WeatherForecastAPI 的非同步版本"""
+
+    async def _make_request(self):
+        """發送請求"""
+        try:
+            response = await get_async_http_client().get(self.url, params=self.params)
+            response.raise_for_status()
+            return response
+
+        except requests.exceptions.Timeout:
+            return "請求超時"
+
+        except requests.exceptions.HTTPError as e:
+            return f"請求錯誤: {str(e)}"
+
+    async def _get_forecast_index(self):
+        """取得預報索引 與同步版本共用 cwa 快取"""
+        async def fetch():
+            return self._handle_response(await self._make_request())
+
+        return await get_dataset_cache('cwa').aget_or_fetch('F-C0032-001', fetch, ttl=cwa_forecast_ttl)
+
+    async def get_weather_forecast(self, location_name):
+        """獲取天氣預報資訊"""
+        if not location_name:
+            return "請輸入要查詢的縣市地點"
+
+        try:
+            return self._lookup_forecast(await self._get_forecast_index(), location_name)
+        except Exception as e:
+            return f"非預期錯誤: {str(e)}"
+
+
+class AsyncWeatherIntegratedAPI(WeatherIntegratedAPI):
+    """WeatherIntegratedAPI 的非同步版本 預報與即時觀測同時查詢"""
+
+    def __init__(self):
+        super().__init__()
+        self.current_weather_api = AsyncWeatherAPI()
+        self.forecast_api = AsyncWeatherForecastAPI()
+
+    async def get_weather_info(self, location_name: str) -> str:
+        """獲取整合的天氣資訊"""
+        if not location_name:
+            return "請輸入要查詢的縣市名稱\n範例：天氣 臺北市"
+
+        results = await run_parallel_async(
+            {
+                'forecast': self.forecast_api.get_weather_forecast(location_name),
+                'current': self._get_current_weather(location_name),
+            },
+            timeout=settings.CWA_CACHE['FETCH_DEADLINE'],
+        )
+
+        # 即時觀測逾時或失敗時 只回覆預報
+        station_name, current_weather = results['current'] if isinstance(results['current'], tuple) else (None, None)
+        return self._combine_weather_info(location_name, station_name, results['forecast'], current_weather)
+
+    async def _get_current_weather(self, location_name):
+        station_name = self.station_mapping.get(location_name) or next(
+            iter(await self.current_weather_api.get_county_stations(location_name)), None)
+        if not station_name:
+            return None, None
+        return station_name, await self.current_weather_api.get_current_weather(station_name)
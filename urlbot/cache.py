@@ -0,0 +1,434 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+import requests
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from .concurrency import get_background_executor
+
+logger = logging.getLogger(__name__)
+
+
+def _is_cacheable(value):
+    """服務類以字串回傳錯誤訊息 錯誤結果不快取"""
+    return value is not None and not isinstance(value, str)
+
+
+class DatasetCache:
+    """對外資料集的共用快取
+
+    以 process 內的 LRU 為主，可選擇再疊一層 Django cache (例如 FileBasedCache、Redis)
+    讓多個 gunicorn worker 共用同一份資料。
+    同一個 key 同時 miss 時只會有一個執行緒向上游下載，其他執行緒等待並共用結果。
+    有共享層時再以跨 process 的鎖讓同一個 key 只有一個 worker 下載；
+    FileBasedCache 的 add() 不是原子操作，改以 O_EXCL 建立鎖檔，其他 backend 使用 add()。
+    設定 stale_ttl 時，過期後的 stale_ttl 秒內仍先回傳舊資料，並在背景重新下載 (stale-while-revalidate)。
+
+    Attributes:
+        name: 快取名稱 也是共享層 key 的前綴
+        max_entries: process 內最多保留的項目數 超過時淘汰最久未使用的項目
+        shared: 共享層的 Django cache 未設定時為 None
+
+    使用範例:
+        cache = get_dataset_cache('twse')
+        data = cache.get_or_fetch('STOCK_DAY_ALL', fetch, ttl=twse_ttl)
+        cache.stats()
+    """
+
+    def __init__(self, name, max_entries=32, shared_alias=None, lock_timeout=30):
+        self.name = name
+        self.max_entries = max_entries
+        self.shared = caches[shared_alias] if shared_alias else None
+        self.lock_timeout = lock_timeout
+
+        self._entries = OrderedDict()  # key -> (expires_at, stale_until, value)
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Future 下載完成後移除
+        self._async_inflight = {}
+        self._refreshing = {}  # key -> 共享鎖的 token
+        self._background_tasks = set()
+        self._stats = Counter()
+
+    def _shared_key(self, key):
+        return f"dataset:{self.name}:{key}"
+
+    def _lookup(self, key):
+        """回傳 (值, 是否未過期) 找不到或已超過 stale 期限時回傳 (None, False)"""
+        found = self._lookup_local(key)
+        if found is not None or self.shared is None:
+            return found or (None, False)
+        return self._lookup_shared(key)
+
+    async def _alookup(self, key):
+        """_lookup 的非同步版本 process 內沒有時才在執行緒中讀取共享層"""
+        found = self._lookup_local(key)
+        if found is not None or self.shared is None:
+            return found or (None, False)
+        return await asyncio.to_thread(self._lookup_shared, key)
+
+    def _lookup_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, stale_until, value = entry
+                now = time.monotonic()
+                if stale_until > now:
+                    self._entries.move_to_end(key)
+                    return value, expires_at > now
+                del self._entries[key]
+        return None
+
+    def _lookup_shared(self, key):
+        entry = self.shared.get(self._shared_key(key))
+        if entry is not None:
+            expires_at, stale_until, value = entry  # 共享層存的是 wall clock 時間
+            now = time.time()
+            if stale_until > now:
+                self._set_local(key, value, expires_at - now, stale_until - expires_at)
+                return value, expires_at > now
+        return None, False
+
+    def get(self, key):
+        """取得未過期的值 找不到時回傳 None"""
+        value, fresh = self._lookup(key)
+        return value if fresh else None
+
+    def _set_local(self, key, value, ttl, stale_ttl=0):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now + ttl, now + ttl + stale_ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        """寫入快取 ttl 可以是秒數或回傳秒數的函式 stale_ttl 為過期後仍可回傳舊資料的秒數"""
+        ttl = ttl() if callable(ttl) else ttl
+        if ttl <= 0:
+            return
+        self._set_local(key, value, ttl, stale_ttl)
+        if self.shared is not None:
+            expires_at = time.time() + ttl
+            self.shared.set(
+                self._shared_key(key), (expires_at, expires_at + stale_ttl, value),
+                timeout=int(ttl + stale_ttl) + 1,
+            )
+
+    async def _run_shared_io(self, func, *args):
+        """有共享層時 (檔案或網路 I/O) 在執行緒中執行 不阻塞 event loop"""
+        if self.shared is None:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(self._shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lock_file(self, key):
+        """FileBasedCache 的鎖檔路徑 其他 backend 回傳 None
+
+        副檔名不是 .djcache 不會被 FileBasedCache 的 cull/clear 刪除。
+        """
+        if not isinstance(self.shared, FileBasedCache):
+            return None
+        digest = hashlib.md5(self._shared_key(key).encode(), usedforsecurity=False).hexdigest()
+        return os.path.join(self.shared._dir, digest + '.lock')
+
+    def _lock_expired(self, path):
+        try:
+            return time.time() - os.path.getmtime(path) > self.lock_timeout
+        except FileNotFoundError:
+            return True
+
+    def _create_lock_file(self, path, token):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(token)
+        return True
+
+    def _acquire_shared_lock(self, key):
+        """取得跨 process 的鎖 成功時回傳釋放用的 token 已被其他 worker 持有時回傳 None"""
+        token = uuid.uuid4().hex
+        path = self._lock_file(key)
+        if path is None:
+            return token if self.shared.add(self._shared_key(key) + ':lock', token, timeout=self.lock_timeout) else None
+
+        os.makedirs(self.shared._dir, exist_ok=True)
+        if self._create_lock_file(path, token):
+            return token
+        if not self._lock_expired(path):
+            return None
+        # 持有者超過 lock_timeout 仍未釋放 (例如 worker 被中止) 視為失效 移除後重試一次
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return token if self._create_lock_file(path, token) else None
+
+    def _release_shared_lock(self, key, token):
+        """釋放自己持有的鎖 逾時後已被其他 worker 取得的鎖不會被刪除"""
+        path = self._lock_file(key)
+        if path is None:
+            lock_key = self._shared_key(key) + ':lock'
+            if self.shared.get(lock_key) == token:
+                self.shared.delete(lock_key)
+            return
+        try:
+            with open(path) as f:
+                if f.read() != token:
+                    return
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _shared_lock_held(self, key):
+        path = self._lock_file(key)
+        if path is None:
+            return self.shared.get(self._shared_key(key) + ':lock') is not None
+        return os.path.exists(path) and not self._lock_expired(path)
+
+    def _fetch_and_set(self, key, fetch, ttl, cacheable, stale_ttl, force):
+        """下載並寫入快取 有共享層時先取得跨 process 的鎖
+
+        其他 worker 正在下載時等待共享層的結果，對方逾時或失敗時才自己下載。
+        寫入共享層後才釋放鎖，取得鎖之後再確認一次快取 不會重複下載剛寫入的資料。
+        """
+        if self.shared is not None:
+            token = self._acquire_shared_lock(key)
+            if token is None:
+                deadline = time.monotonic() + self.lock_timeout
+                while time.monotonic() < deadline:
+                    time.sleep(0.1)
+                    value = self.get(key)
+                    if value is not None:
+                        return value
+                    if not self._shared_lock_held(key):
+                        break
+        else:
+            token = None
+
+        try:
+            value = None if force else self.get(key)
+            if value is None:
+                value = fetch()
+                if cacheable(value):
+                    self.set(key, value, ttl, stale_ttl)
+            return value
+        finally:
+            if token is not None:
+                self._release_shared_lock(key, token)
+
+    def _fetch_once(self, key, fetch, ttl, cacheable, stale_ttl, force=False):
+        """process 內的 per-key single-flight 同一個 key 同時只有一個執行緒下載
+
+        其他執行緒等待並取得同一個結果或同一個例外，不同的 key 互不等待。
+        force 為 False 時 取得下載權後先確認其他執行緒 (或 worker) 是否剛寫入快取。
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            value = self._fetch_and_set(key, fetch, ttl, cacheable, stale_ttl, force)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _record_lookup(self, value, fresh):
+        self._count('hits' if fresh else 'stale_hits' if value is not None else 'misses')
+
+    def stats(self) -> dict:
+        """回傳命中統計 hits: 未過期命中 stale_hits: 回傳舊資料 misses: 需要下載 refreshes: 背景更新次數"""
+        with self._lock:
+            result = {name: self._stats[name] for name in ('hits', 'stale_hits', 'misses', 'refreshes', 'refresh_errors')}
+            result['entries'] = len(self._entries)
+            result['max_entries'] = self.max_entries
+        lookups = result['hits'] + result['stale_hits'] + result['misses']
+        result['hit_rate'] = round((result['hits'] + result['stale_hits']) / lookups, 4) if lookups else 0.0
+        return result
+
+    def _start_refresh(self, key):
+        """標記 key 正在背景更新 已有其他執行緒 (或其他 worker) 在更新時回傳 False"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing[key] = None
+            self._stats['refreshes'] += 1
+        if self.shared is not None:
+            token = self._acquire_shared_lock(key)
+            if token is None:
+                self._finish_refresh(key)
+                return False
+            with self._lock:
+                self._refreshing[key] = token
+        return True
+
+    def _finish_refresh(self, key):
+        with self._lock:
+            token = self._refreshing.pop(key, None)
+        if token is not None:
+            self._release_shared_lock(key, token)
+
+    def _refresh(self, key, fetch, ttl, cacheable, stale_ttl):
+        """背景重新下載 失敗時保留舊資料 等下一次請求再試"""
+        try:
+            value = fetch()
+            if cacheable(value):
+                self.set(key, value, ttl, stale_ttl)
+            else:
+                self._count('refresh_errors')
+                logger.warning("背景更新 %s:%s 失敗: %s", self.name, key, value)
+        except Exception:
+            self._count('refresh_errors')
+            logger.exception("背景更新 %s:%s 失敗", self.name, key)
+        finally:
+            self._finish_refresh(key)
+
+    def get_or_fetch(self, key, fetch, ttl, cacheable=_is_cacheable, stale_ttl=0):
+        """取得快取 沒有時呼叫 fetch() 下載並寫入
+
+        Args:
+            key: 快取 key
+            fetch: 無參數函式 回傳要快取的資料 (錯誤時回傳字串)
+            ttl: 秒數或回傳秒數的函式
+            cacheable: 判斷結果是否可以快取
+            stale_ttl: 過期後仍先回傳舊資料並在背景更新的秒數
+        """
+        value, fresh = self._lookup(key)
+        self._record_lookup(value, fresh)
+        if fresh:
+            return value
+        if value is not None:
+            if self._start_refresh(key):
+                get_background_executor().submit(self._refresh, key, fetch, ttl, cacheable, stale_ttl)
+            return value
+
+        return self._fetch_once(key, fetch, ttl, cacheable, stale_ttl)
+
+    def refresh(self, key, fetch, ttl, cacheable=_is_cacheable, stale_ttl=0):
+        """不論快取是否過期都重新下載並寫入 (預先更新用) 下載失敗時保留原本的快取
+
+        與 get_or_fetch 共用 per-key single-flight 更新期間 miss 的請求會等待並共用這次的結果。
+        有共享層時也取得跨 process 的鎖，其他 worker 正在下載時等待並使用對方的結果 不重複下載。
+        參數與 get_or_fetch 相同 回傳 fetch() (或其他 worker 下載) 的結果。
+        """
+        self._count('refreshes')
+        return self._fetch_once(key, fetch, ttl, cacheable, stale_ttl, force=True)
+
+    async def _arefresh(self, key, fetch, ttl, cacheable, stale_ttl):
+        try:
+            value = await fetch()
+            if cacheable(value):
+                await self._run_shared_io(self.set, key, value, ttl, stale_ttl)
+            else:
+                self._count('refresh_errors')
+                logger.warning("背景更新 %s:%s 失敗: %s", self.name, key, value)
+        except Exception:
+            self._count('refresh_errors')
+            logger.exception("背景更新 %s:%s 失敗", self.name, key)
+        finally:
+            await self._run_shared_io(self._finish_refresh, key)
+
+    async def aget_or_fetch(self, key, fetch, ttl, cacheable=_is_cacheable, stale_ttl=0):
+        """get_or_fetch 的非同步版本 fetch 為回傳 coroutine 的函式
+
+        共享層的讀寫與跨 process 的鎖在執行緒中進行 event loop 上只做 process 內的查詢。
+        """
+        value, fresh = await self._alookup(key)
+        self._record_lookup(value, fresh)
+        if fresh:
+            return value
+        if value is not None:
+            if await self._run_shared_io(self._start_refresh, key):
+                task = asyncio.get_running_loop().create_task(self._arefresh(key, fetch, ttl, cacheable, stale_ttl))
+                self._background_tasks.add(task)  # 保留參照 避免背景工作被回收
+                task.add_done_callback(self._background_tasks.discard)
+            return value
+
+        inflight_key = (id(asyncio.get_running_loop()), key)
+        future = self._async_inflight.get(inflight_key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._async_inflight[inflight_key] = future
+        try:
+            value = await fetch()
+            if cacheable(value):
+                await self._run_shared_io(self.set, key, value, ttl, stale_ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # 發起的協程被取消 (例如超過共同截止時間) 等待中的呼叫端視為逾時 不跟著被取消
+            future.set_exception(requests.exceptions.Timeout("請求超時"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 沒有其他等待者時避免 "exception was never retrieved"
+            raise
+        finally:
+            self._async_inflight.pop(inflight_key, None)
+
+
+_dataset_caches = {}
+_dataset_caches_lock = threading.Lock()
+
+
+def get_dataset_cache(name) -> DatasetCache:
+    """取得指定名稱的共用快取 設定來自 settings.DATASET_CACHE"""
+    cache = _dataset_caches.get(name)
+    if cache is None:
+        with _dataset_caches_lock:
+            cache = _dataset_caches.get(name)
+            if cache is None:
+                config = getattr(settings, 'DATASET_CACHE', {})
+                cache = DatasetCache(
+                    name,
+                    max_entries=config.get('MAX_ENTRIES', {}).get(name, 32),
+                    shared_alias=config.get('SHARED_BACKEND'),
+                )
+                _dataset_caches[name] = cache
+    return cache
+
+
+def reset_dataset_caches():
+    """清除所有共用快取 (測試用)"""
+    with _dataset_caches_lock:
+        _dataset_caches.clear()
+
+
+def dataset_cache_stats() -> dict:
+    """回傳所有共用快取的命中統計 {快取名稱: stats}"""
+    with _dataset_caches_lock:
+        caches_snapshot = dict(_dataset_caches)
+    return {name: cache.stats() for name, cache in caches_snapshot.items()}
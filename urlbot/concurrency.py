@@ -0,0 +1,74 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.conf import settings
+from .singleton import LazySingleton
+
+TIMEOUT_MESSAGE = "請求超時"
+
+_io_executor = LazySingleton(lambda: ThreadPoolExecutor(
+    max_workers=getattr(settings, 'IO_CONCURRENCY', 16),
+    thread_name_prefix="linebot-io",
+))
+_background_executor = LazySingleton(lambda: ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BACKGROUND_CONCURRENCY', 2),
+    thread_name_prefix="linebot-background",
+))
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """取得對外請求並行用的執行緒池 上限為 settings.IO_CONCURRENCY"""
+    return _io_executor.get()
+
+
+def get_background_executor() -> ThreadPoolExecutor:
+    """取得背景工作 (快取的 stale-while-revalidate 更新、點擊次數寫入) 用的執行緒池
+
+    與 get_io_executor 分開，背景工作不會佔用請求並行的執行緒，
+    大量背景更新排隊時也不會讓使用者的請求等到超過截止時間。上限為 settings.BACKGROUND_CONCURRENCY。
+    """
+    return _background_executor.get()
+
+
+def run_parallel(tasks, timeout):
+    """同時執行多個無參數函式 全部共用同一個截止時間
+
+    Args:
+        tasks: {名稱: 函式}
+        timeout: 整體截止秒數
+
+    Returns:
+        dict: {名稱: 結果} 超過截止時間的項目為 "請求超時"，拋出例外的項目為錯誤訊息字串，
+              與服務類以字串回傳錯誤的慣例相同。
+    """
+    executor = get_io_executor()
+    futures = {name: executor.submit(task) for name, task in tasks.items()}
+    done, _ = wait(futures.values(), timeout=timeout)
+
+    results = {}
+    for name, future in futures.items():
+        if future not in done:
+            future.cancel()  # 尚未開始的直接取消 已在執行的結果會被忽略
+            results[name] = TIMEOUT_MESSAGE
+        elif future.exception() is not None:
+            results[name] = f"請求錯誤:{str(future.exception())}"
+        else:
+            results[name] = future.result()
+    return results
+
+
+async def run_parallel_async(tasks, timeout):
+    """run_parallel 的非同步版本 tasks 的值為 coroutine 逾時的項目會被取消"""
+    pending_tasks = {name: asyncio.ensure_future(coro) for name, coro in tasks.items()}
+    done, pending = await asyncio.wait(pending_tasks.values(), timeout=timeout)
+    for task in pending:
+        task.cancel()
+
+    results = {}
+    for name, task in pending_tasks.items():
+        if task not in done:
+            results[name] = TIMEOUT_MESSAGE
+        elif task.exception() is not None:
+            results[name] = f"請求錯誤:{str(task.exception())}"
+        else:
+            results[name] = task.result()
+    return results
@@ -0,0 +1,58 @@
+import logging
+from collections import defaultdict
+from linebot.exceptions import LineBotApiError
+from .models import StockWatchlist
+from .rendering import as_messages
+
+logger = logging.getLogger(__name__)
+
+# LINE multicast 每次最多 500 位收件者
+MULTICAST_LIMIT = 500
+
+
+def group_watchlists():
+    """讀取所有追蹤清單 依股票組合分組 {(代碼...): [user_id...]}
+
+    相同組合的使用者會收到相同的摘要 可以用同一個 multicast 送出。
+    """
+    codes_by_user = defaultdict(list)
+    rows = StockWatchlist.objects.order_by('user_id', 'created_at').values_list('user_id', 'stock_code')
+    for user_id, stock_code in rows.iterator():
+        codes_by_user[user_id].append(stock_code)
+
+    users_by_codes = defaultdict(list)
+    for user_id, codes in codes_by_user.items():
+        users_by_codes[tuple(codes)].append(user_id)
+    return users_by_codes
+
+
+def push_stock_digest(line_bot_api, stock_api, dry_run=False) -> dict:
+    """收盤後推播追蹤股票摘要
+
+    全市場資料只取得一次 (共用 twse 快取)，每種股票組合只組一次訊息，
+    再以 multicast 每批最多 500 人送出，不會依使用者數量增加對外請求。
+
+    Returns:
+        dict: users 推播人數 / messages 不同摘要數 / requests multicast 次數 / failed 失敗人數
+              行情資料無法取得時為 {'error': 錯誤訊息}
+    """
+    index = stock_api.get_stock_index()
+    if isinstance(index, str):
+        return {'error': index}
+
+    stats = {'users': 0, 'messages': 0, 'requests': 0, 'failed': 0}
+    for codes, user_ids in group_watchlists().items():
+        messages = as_messages("今日收盤追蹤摘要\n" + stock_api.format_stocks_summary(index, codes))
+        stats['messages'] += 1
+        for start in range(0, len(user_ids), MULTICAST_LIMIT):
+            batch = user_ids[start:start + MULTICAST_LIMIT]
+            stats['requests'] += 1
+            stats['users'] += len(batch)
+            if dry_run:
+                continue
+            try:
+                line_bot_api.multicast(batch, messages)
+            except LineBotApiError as e:
+                stats['failed'] += len(batch)
+                logger.error("推播追蹤摘要失敗 (%s 人): %s", len(batch), e)
+    return stats
@@ -0,0 +1,199 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from .singleton import LazySingleton
+
+logger = logging.getLogger(__name__)
+
+
+def run_task(func, *args):
+    """執行單一事件工作 例外只記錄 不影響其他事件"""
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("處理事件失敗")
+
+
+def run_worker_task(func, *args):
+    """在背景執行緒執行工作 背景執行緒不會經過 request 生命週期 需要自行釋放 DB 連線"""
+    try:
+        run_task(func, *args)
+    finally:
+        close_old_connections()
+
+
+class EventDispatcher:
+    """背景事件處理池
+
+    webhook 驗證簽章後把事件放進有上限的佇列並立即回傳 200，
+    由固定數量的背景執行緒處理指令並回覆使用者，避免 LINE 等待逾時而重送。
+
+    佇列滿時的處理策略 (overflow_policy)：
+        - inline: 直接在請求執行緒處理 (退化為同步模式)
+        - block: 最多等待 put_timeout 秒 仍然滿載才改為 inline
+        - drop: 丟棄事件並記錄 log
+
+    Attributes:
+        workers: 背景執行緒數量
+        queue_size: 佇列上限
+        overflow_policy: 佇列滿時的處理策略
+        put_timeout: block 策略的等待秒數
+        drain_timeout: 關閉時等待佇列清空的秒數
+
+    使用範例:
+        get_dispatcher().submit(view._process_event, event)
+    """
+    policies = ('inline', 'block', 'drop')
+
+    def __init__(self, workers=4, queue_size=100, overflow_policy='inline', put_timeout=0.5, drain_timeout=10):
+        if overflow_policy not in self.policies:
+            raise ValueError(f"不支援的 overflow_policy: {overflow_policy}")
+
+        self.workers = workers
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.put_timeout = put_timeout
+        self.drain_timeout = drain_timeout
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._accepting = True
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        """依照 settings.LINEBOT_BACKGROUND 建立處理池"""
+        config = getattr(settings, 'LINEBOT_BACKGROUND', {})
+        return cls(
+            workers=config.get('WORKERS', 4),
+            queue_size=config.get('QUEUE_SIZE', 100),
+            overflow_policy=config.get('OVERFLOW_POLICY', 'inline'),
+            put_timeout=config.get('PUT_TIMEOUT', 0.5),
+            drain_timeout=config.get('DRAIN_TIMEOUT', 10),
+        )
+
+    def start(self):
+        """啟動背景執行緒 (只會執行一次) 已呼叫 shutdown() 後不再啟動"""
+        with self._lock:
+            self._start_workers()
+
+    def _start_workers(self):
+        # 呼叫端需持有 _lock
+        if self._threads or not self._accepting:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"linebot-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:  # 關閉訊號
+                    return
+                func, args = task
+                run_worker_task(func, *args)
+            finally:
+                self._queue.task_done()
+
+    def _enqueue(self, task):
+        """確認仍在接收並放入佇列 回傳 None (已停止接收)、True (已放入) 或 False (佇列已滿)
+
+        確認與放入都在 _lock 內，shutdown() 送出結束訊號之後不會再有工作排進佇列。
+        block 策略等待鎖與佇列空位的時間合計不超過 put_timeout。
+        """
+        if self.overflow_policy == 'block':
+            deadline = time.monotonic() + self.put_timeout
+            if not self._lock.acquire(timeout=self.put_timeout):
+                return False
+        else:
+            self._lock.acquire()
+        try:
+            if not self._accepting:
+                return None
+            self._start_workers()
+            if self.overflow_policy == 'block':
+                self._queue.put(task, timeout=max(deadline - time.monotonic(), 0))
+            else:
+                self._queue.put_nowait(task)
+            return True
+        except queue.Full:
+            return False
+        finally:
+            self._lock.release()
+
+    def submit(self, func, *args) -> bool:
+        """提交一個工作 回傳是否有被處理 (drop 時為 False) 關閉後提交的工作直接在目前執行緒處理"""
+        queued = self._enqueue((func, args))
+        if queued:
+            return True
+        if queued is False and self.overflow_policy == 'drop':
+            logger.warning("事件佇列已滿 (%s) 丟棄事件", self.queue_size)
+            return False
+
+        run_task(func, *args)
+        return True
+
+    def pending(self) -> int:
+        """目前佇列中等待處理的數量"""
+        return self._queue.qsize()
+
+    def shutdown(self, timeout=None):
+        """停止接收新工作 等待佇列清空後結束背景執行緒"""
+        timeout = self.drain_timeout if timeout is None else timeout
+        with self._lock:
+            self._accepting = False
+            threads, self._threads = self._threads, []
+
+        deadline = time.monotonic() + timeout
+        for _ in threads:
+            try:
+                self._queue.put(None, timeout=max(deadline - time.monotonic(), 0))
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+            if thread.is_alive():
+                logger.warning("背景執行緒 %s 未在 %s 秒內結束", thread.name, timeout)
+
+
+_dispatcher = LazySingleton(EventDispatcher.from_settings, close='shutdown', at_exit=True)
+_batch_executor = LazySingleton(lambda: ThreadPoolExecutor(
+    max_workers=getattr(settings, 'LINEBOT_EVENT_CONCURRENCY', 4),
+    thread_name_prefix="linebot-batch",
+))
+
+
+def get_dispatcher() -> EventDispatcher:
+    """取得當前 process 共用的背景處理池 並註冊關閉時清空佇列"""
+    return _dispatcher.get()
+
+
+def reset_dispatcher():
+    """關閉並清除共用的背景處理池 (測試用)"""
+    _dispatcher.reset()
+
+
+def get_batch_executor() -> ThreadPoolExecutor:
+    """取得同一批次事件並行處理用的執行緒池 上限為 settings.LINEBOT_EVENT_CONCURRENCY"""
+    return _batch_executor.get()
+
+
+def process_batch(func, items):
+    """並行處理同一個 webhook 內的多個事件
+
+    每個事件完成後由 func 自行回覆 不需等待整批結束；
+    單一事件失敗只會被記錄 其他事件照常處理。只有一個事件時直接在目前執行緒處理。
+    """
+    if len(items) <= 1:
+        for item in items:
+            run_task(func, item)
+        return
+
+    executor = get_batch_executor()
+    wait([executor.submit(run_worker_task, func, item) for item in items])
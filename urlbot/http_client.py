@@ -0,0 +1,478 @@
+import asyncio
+import json
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from django.conf import settings
+from linebot import AsyncHttpClient as LineAsyncHttpClientBase, AsyncHttpResponse as LineAsyncHttpResponseBase
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .singleton import LazySingleton
+
+
+# 只有這些參數的 GET 才會合併 (其他參數代表請求內容不同或回應無法共用)
+COALESCE_KWARGS = frozenset(['params', 'headers', 'timeout', 'stream'])
+
+
+def coalesce_key(url, kwargs):
+    """相同 GET 請求的合併 key (完整網址含查詢參數 + 標頭) 不能合併時回傳 None"""
+    if kwargs.get('stream') or not COALESCE_KWARGS.issuperset(kwargs):
+        return None
+    prepared_url = requests.Request('GET', url, params=kwargs.get('params')).prepare().url
+    return prepared_url, frozenset((kwargs.get('headers') or {}).items())
+
+
+class _InflightCall:
+    """進行中的請求 其他相同請求的執行緒等待它完成後共用結果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class HttpClient:
+    """共用的對外 HTTP 客戶端
+
+    每個 host 各自持有一個 requests.Session 與連線池，
+    讓 bitly、rter.info、中央氣象署、證交所、newsapi 的請求都能重用 keep-alive 連線，
+    不必每次指令都重新做 TCP 與 TLS 交握。
+
+    Attributes:
+        pool_size: 每個 host 連線池可保留的連線數
+        keep_alive: 是否保持連線
+        timeout: 預設逾時秒數
+        host_timeouts: 個別 host 的逾時秒數
+        retries: 連線失敗或 5xx 時的重試次數
+        backoff_factor: 重試間隔的指數退避係數
+        coalesce: 是否合併同時進行的相同 GET 請求 (single-flight)
+
+    同一時間有多個相同的 GET (網址、查詢參數、標頭都相同) 時只會送出一個請求，
+    其他呼叫端等待並拿到同一個 response 或同一個例外。
+
+    使用範例:
+        response = get_http_client().get("https://tw.rter.info/capi.php")
+        get_http_client().stats()
+    """
+    retry_status_forcelist = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_size=10, keep_alive=True, timeout=5, host_timeouts=None,
+                 retries=2, backoff_factor=0.3, coalesce=True):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.host_timeouts = host_timeouts or {}
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.coalesce = coalesce
+
+        self._sessions = {}
+        self._stats = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        """依照 settings.HTTP_CLIENT 建立客戶端"""
+        config = getattr(settings, 'HTTP_CLIENT', {})
+        return cls(
+            pool_size=config.get('POOL_SIZE', 10),
+            keep_alive=config.get('KEEP_ALIVE', True),
+            timeout=config.get('TIMEOUT', 5),
+            host_timeouts=config.get('HOST_TIMEOUTS', {}),
+            retries=config.get('RETRIES', 2),
+            backoff_factor=config.get('BACKOFF_FACTOR', 0.3),
+            coalesce=config.get('COALESCE', True),
+        )
+
+    def _build_session(self):
+        """建立帶有連線池與重試策略的 Session"""
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.retry_status_forcelist,
+            allowed_methods=frozenset(['GET']),  # POST 不是冪等 只在連線失敗時重試
+            raise_on_status=False,  # 重試用完時交回最後一個 response 讓呼叫端 raise_for_status
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def _get_session(self, host):
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = self._build_session()
+                    self._sessions[host] = session
+                    self._stats[host] = {'requests': 0, 'errors': 0, 'total_time': 0.0, 'coalesced': 0}
+        return session
+
+    def _record(self, host, elapsed, error):
+        with self._lock:
+            host_stats = self._stats[host]
+            host_stats['requests'] += 1
+            host_stats['total_time'] += elapsed
+            if error:
+                host_stats['errors'] += 1
+
+    def request(self, method, url, timeout=None, **kwargs) -> requests.Response:
+        """發送請求 逾時未指定時使用該 host 的設定
+
+        例外與 requests 相同 (Timeout、ConnectionError...)，呼叫端的錯誤處理不需要改變。
+        """
+        host = urlsplit(url).hostname
+        session = self._get_session(host)
+        if timeout is None:
+            timeout = self.host_timeouts.get(host, self.timeout)
+
+        start = time.monotonic()
+        error = True
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+            error = response.status_code >= 400
+            return response
+        finally:
+            self._record(host, time.monotonic() - start, error)
+
+    def get(self, url, **kwargs) -> requests.Response:
+        key = coalesce_key(url, kwargs) if self.coalesce else None
+        if key is None:
+            return self.request('GET', url, **kwargs)
+
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InflightCall()
+
+        if not leader:
+            call.done.wait()
+            with self._lock:
+                host_stats = self._stats.get(urlsplit(url).hostname)
+                if host_stats is not None:
+                    host_stats['coalesced'] += 1
+            if call.error is not None:
+                raise call.error
+            return call.response
+
+        try:
+            call.response = self.request('GET', url, **kwargs)
+            return call.response
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def stats(self) -> dict:
+        """回傳每個 host 的請求統計與連線池狀態"""
+        result = {}
+        with self._lock:
+            for host, session in self._sessions.items():
+                host_stats = dict(self._stats[host])
+                host_stats['avg_ms'] = (
+                    round(host_stats['total_time'] / host_stats['requests'] * 1000, 2)
+                    if host_stats['requests'] else 0.0
+                )
+                pools = session.get_adapter(f'https://{host}').poolmanager.pools
+                host_stats['pools'] = [
+                    {
+                        'scheme': pool.scheme,
+                        'connections_opened': pool.num_connections,
+                        'connections_idle': sum(1 for conn in pool.pool.queue if conn is not None) if pool.pool else 0,
+                        'pool_maxsize': self.pool_size,
+                    }
+                    for pool in (pools[key] for key in pools.keys())
+                ]
+                result[host] = host_stats
+        return result
+
+    def close(self):
+        """關閉所有連線池"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._stats.clear()
+
+
+class LineHttpClient(RequestsHttpClient):
+    """讓 LINE SDK 的 reply/push 也走共用連線池"""
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        response = get_http_client().get(
+            url, headers=headers, params=params, stream=stream, timeout=timeout or self.timeout
+        )
+        return RequestsHttpResponse(response)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        response = get_http_client().post(
+            url, headers=headers, data=data, timeout=timeout or self.timeout
+        )
+        return RequestsHttpResponse(response)
+
+
+class AsyncResponse:
+    """非同步請求的回應 介面與 requests.Response 相同 讓服務類的解析邏輯可以共用"""
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class AsyncHttpClient:
+    """共用的非同步 HTTP 客戶端 (aiohttp)
+
+    每個 event loop 共用一個 ClientSession，單一 worker 可以同時保持大量進行中的對外請求。
+    設定與 HttpClient 相同，例外會轉換成 requests 的例外類型，
+    讓服務類的錯誤處理不需要改變。
+
+    使用範例:
+        response = await get_async_http_client().get("https://tw.rter.info/capi.php")
+    """
+    retry_status_forcelist = HttpClient.retry_status_forcelist
+
+    def __init__(self, pool_size=100, total_limit=200, keep_alive=True, timeout=5, host_timeouts=None,
+                 retries=2, backoff_factor=0.3, coalesce=True):
+        self.pool_size = pool_size
+        self.total_limit = total_limit
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.host_timeouts = host_timeouts or {}
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.coalesce = coalesce
+
+        # ClientSession 綁定在建立它的 event loop 上
+        self._sessions = weakref.WeakKeyDictionary()
+        self._stats = {}
+        self._inflight = {}
+
+    @classmethod
+    def from_settings(cls):
+        """依照 settings.HTTP_CLIENT 建立客戶端"""
+        config = getattr(settings, 'HTTP_CLIENT', {})
+        return cls(
+            pool_size=config.get('ASYNC_POOL_SIZE', 100),
+            total_limit=config.get('ASYNC_TOTAL_LIMIT', 200),
+            keep_alive=config.get('KEEP_ALIVE', True),
+            timeout=config.get('TIMEOUT', 5),
+            host_timeouts=config.get('HOST_TIMEOUTS', {}),
+            retries=config.get('RETRIES', 2),
+            backoff_factor=config.get('BACKOFF_FACTOR', 0.3),
+            coalesce=config.get('COALESCE', True),
+        )
+
+    def session(self) -> aiohttp.ClientSession:
+        """取得目前 event loop 的 ClientSession"""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.total_limit,
+                limit_per_host=self.pool_size,
+                force_close=not self.keep_alive,
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[loop] = session
+        return session
+
+    def _host_stats(self, host):
+        return self._stats.setdefault(host, {'requests': 0, 'errors': 0, 'total_time': 0.0, 'coalesced': 0})
+
+    def _record(self, host, elapsed, error):
+        host_stats = self._host_stats(host)
+        host_stats['requests'] += 1
+        host_stats['total_time'] += elapsed
+        if error:
+            host_stats['errors'] += 1
+
+    async def _send(self, method, url, timeout, **kwargs):
+        async with self.session().request(method, url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as response:
+            content = await response.read()
+            return AsyncResponse(str(response.url), response.status, response.headers, content)
+
+    async def request(self, method, url, timeout=None, **kwargs) -> AsyncResponse:
+        """發送請求 GET 在連線失敗或 5xx 時以指數退避重試"""
+        host = urlsplit(url).hostname
+        if timeout is None:
+            timeout = self.host_timeouts.get(host, self.timeout)
+        attempts = self.retries + 1 if method == 'GET' else 1
+
+        for attempt in range(attempts):
+            start = time.monotonic()
+            last_attempt = attempt == attempts - 1
+            try:
+                response = await self._send(method, url, timeout, **kwargs)
+                error = response.status_code >= 400
+                self._record(host, time.monotonic() - start, error)
+                if response.status_code not in self.retry_status_forcelist or last_attempt:
+                    return response
+
+            except asyncio.TimeoutError as e:
+                self._record(host, time.monotonic() - start, True)
+                if last_attempt:
+                    raise requests.exceptions.Timeout(str(e) or "請求超時") from e
+
+            except aiohttp.ClientConnectionError as e:
+                self._record(host, time.monotonic() - start, True)
+                if last_attempt:
+                    raise requests.exceptions.ConnectionError(str(e)) from e
+
+            except aiohttp.ClientError as e:
+                self._record(host, time.monotonic() - start, True)
+                raise requests.exceptions.RequestException(str(e)) from e
+
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+
+    async def get(self, url, **kwargs) -> AsyncResponse:
+        """GET 請求 同一個 event loop 內相同的請求只會送出一次 與 HttpClient.get 相同"""
+        key = coalesce_key(url, kwargs) if self.coalesce else None
+        if key is None:
+            return await self.request('GET', url, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        inflight_key = (id(loop), key)
+        future = self._inflight.get(inflight_key)
+        if future is not None:
+            self._host_stats(urlsplit(url).hostname)['coalesced'] += 1
+            return await asyncio.shield(future)
+
+        future = loop.create_future()
+        self._inflight[inflight_key] = future
+        try:
+            response = await self.request('GET', url, **kwargs)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            # 發起的協程被取消 (例如超過共同截止時間) 等待中的呼叫端視為逾時 不跟著被取消
+            future.set_exception(requests.exceptions.Timeout("請求超時"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 沒有其他等待者時避免 "exception was never retrieved"
+            raise
+        finally:
+            self._inflight.pop(inflight_key, None)
+
+    async def post(self, url, **kwargs) -> AsyncResponse:
+        return await self.request('POST', url, **kwargs)
+
+    def stats(self) -> dict:
+        """回傳每個 host 的請求統計"""
+        result = {}
+        for host, host_stats in self._stats.items():
+            host_stats = dict(host_stats)
+            host_stats['avg_ms'] = (
+                round(host_stats['total_time'] / host_stats['requests'] * 1000, 2)
+                if host_stats['requests'] else 0.0
+            )
+            result[host] = host_stats
+        return result
+
+    async def close(self):
+        """關閉目前 event loop 的 ClientSession"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+
+class LineAsyncHttpResponse(LineAsyncHttpResponseBase):
+    """把 AsyncResponse 包裝成 LINE SDK 預期的非同步回應介面"""
+
+    def __init__(self, response):
+        self.response = response
+
+    @property
+    def status_code(self):
+        return self.response.status_code
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    @property
+    async def text(self):
+        return self.response.text
+
+    @property
+    async def content(self):
+        return self.response.content
+
+    @property
+    async def json(self):
+        return self.response.json()
+
+    def iter_content(self, chunk_size=1024):
+        content = self.response.content
+        return (content[i:i + chunk_size] for i in range(0, len(content), chunk_size))
+
+
+class LineAsyncHttpClient(LineAsyncHttpClientBase):
+    """讓 AsyncLineBotApi 的 reply/push 也走共用的 aiohttp session"""
+
+    async def get(self, url, headers=None, params=None, timeout=None):
+        response = await get_async_http_client().get(url, headers=headers, params=params, timeout=timeout or self.timeout)
+        return LineAsyncHttpResponse(response)
+
+    async def post(self, url, headers=None, data=None, timeout=None):
+        response = await get_async_http_client().post(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return LineAsyncHttpResponse(response)
+
+    async def delete(self, url, headers=None, data=None, timeout=None):
+        response = await get_async_http_client().request('DELETE', url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return LineAsyncHttpResponse(response)
+
+    async def put(self, url, headers=None, data=None, timeout=None):
+        response = await get_async_http_client().request('PUT', url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return LineAsyncHttpResponse(response)
+
+
+_http_client = LazySingleton(HttpClient.from_settings, close='close')
+_async_http_client = LazySingleton(AsyncHttpClient.from_settings)
+
+
+def get_http_client() -> HttpClient:
+    """取得當前 process 共用的 HttpClient"""
+    return _http_client.get()
+
+
+def reset_http_client():
+    """關閉並清除共用的 HttpClient (測試用)"""
+    _http_client.reset()
+
+
+def get_async_http_client() -> AsyncHttpClient:
+    """取得當前 process 共用的 AsyncHttpClient"""
+    return _async_http_client.get()
@@ -0,0 +1,118 @@
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(chunks):
+    """逐步解析最外層為陣列的 JSON 每次產生一個元素
+
+    不需要先把整份回應讀進記憶體，也不會一次建立整個 list，
+    適合證交所全市場資料這類上萬筆的大型陣列。
+
+    Args:
+        chunks: 依序產生 bytes 的可迭代物件 例如 response.iter_content()
+
+    Raises:
+        ValueError: 格式不是 JSON 陣列或內容不完整
+    """
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    chunks = iter(chunks)
+    buffer, pos, exhausted = '', 0, False
+    # 下一個位置預期的內容 start: '[' / first: 元素或 ']' / separator: ',' 或 ']' / item: 逗號後的元素
+    expect = 'start'
+
+    def fill():
+        # 只在讀取新資料時丟掉已解析的部分 避免每個元素都複製一次緩衝區
+        nonlocal buffer, pos, exhausted
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[pos:] + text_decoder.decode(chunk)
+                pos = 0
+                return True
+        buffer = buffer[pos:] + text_decoder.decode(b'', final=True)
+        pos = 0
+        exhausted = True
+        return False
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos >= len(buffer):
+            if exhausted:
+                raise ValueError("JSON 陣列不完整")
+            fill()
+            continue
+
+        char = buffer[pos]
+        if expect == 'start':
+            if char != '[':
+                raise ValueError("回應不是 JSON 陣列")
+            expect = 'first'
+            pos += 1
+            continue
+
+        if expect == 'separator':
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError("JSON 陣列元素之間缺少逗號")
+            expect = 'item'
+            pos += 1
+            continue
+
+        if char == ']' and expect == 'first':
+            return
+        if char in ',]':
+            raise ValueError("JSON 陣列有多餘的逗號")
+
+        try:
+            item, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # 元素被切在兩個 chunk 之間 讀入更多資料後重試
+            if exhausted:
+                raise
+            fill()
+            continue
+
+        if end == len(buffer) and not exhausted:
+            # 數字等純量可能還沒讀完 補資料後重新解析
+            fill()
+            continue
+
+        pos = end
+        expect = 'separator'
+        yield item
+
+
+class Columns(dict):
+    """欄位式資料 {欄位名稱: [值...]} 每一列以同一個位置對應
+
+    只保留需要的欄位，避免為每一筆資料保留完整的 dict。
+
+    Attributes:
+        rows: 資料筆數
+    """
+
+    def __init__(self, fields, rows=0):
+        super().__init__((field, []) for field in fields)
+        self.rows = rows
+
+    def value(self, field, row):
+        """取得指定列的欄位值 欄位不存在或 row 為 None 時回傳 None"""
+        values = self.get(field)
+        if values is None or row is None:
+            return None
+        return values[row]
+
+
+def read_columns(items, fields) -> Columns:
+    """從逐筆產生的 dict 取出指定欄位 存成欄位式資料"""
+    columns = Columns(fields)
+    lists = [columns[field] for field in fields]
+    for item in items:
+        for field, values in zip(fields, lists):
+            values.append(item.get(field))
+        columns.rows += 1
+    return columns
@@ -0,0 +1,37 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from urlbot.prefetch import get_prefetch_scheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "依 settings.PREFETCH 排程預先更新證交所、中央氣象署與匯率資料的快取。"
+        "獨立執行時需設定 DATASET_CACHE_BACKEND=shared 讓 web worker 共用快取"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="執行一次後結束 (搭配 cron 使用)")
+        parser.add_argument('--job', action='append', dest='jobs', help="只執行指定的工作 可重複指定")
+
+    def handle(self, *args, **options):
+        scheduler = get_prefetch_scheduler()
+        names = {job.name for job in scheduler.jobs}
+        unknown = set(options['jobs'] or []) - names
+        if unknown:
+            raise CommandError(f"未設定的工作: {', '.join(sorted(unknown))} 可用的工作: {', '.join(sorted(names))}")
+
+        if options['once']:
+            results = scheduler.run_once(options['jobs'])
+            self.stdout.write(json.dumps(scheduler.stats(), ensure_ascii=False, indent=2))
+            if not all(results.values()):
+                raise CommandError("部分工作更新失敗")
+            return
+
+        if options['jobs']:
+            scheduler.jobs = [job for job in scheduler.jobs if job.name in options['jobs']]
+        self.stdout.write(f"預先更新排程啟動: {', '.join(job.name for job in scheduler.jobs)}")
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            scheduler.stop()
+        self.stdout.write(json.dumps(scheduler.stats(), ensure_ascii=False, indent=2))
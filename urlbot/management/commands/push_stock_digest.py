@@ -0,0 +1,25 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from urlbot.digest import push_stock_digest
+from urlbot.registry import get_registry
+from urlbot.schedules import taipei_now
+
+
+class Command(BaseCommand):
+    help = "收盤後推播使用者追蹤的股票摘要 建議以 cron 在交易日收盤後執行 例如 30 14 * * 1-5"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="只計算推播對象與次數 不實際送出")
+        parser.add_argument('--force', action='store_true', help="非交易日也執行")
+
+    def handle(self, *args, **options):
+        if not options['force'] and taipei_now().weekday() not in settings.TWSE_CACHE['WEEKDAYS']:
+            self.stdout.write("今天不是交易日 略過推播 (使用 --force 強制執行)")
+            return
+
+        registry = get_registry()
+        stats = push_stock_digest(registry.line_bot_api, registry.stock, dry_run=options['dry_run'])
+        self.stdout.write(json.dumps(stats, ensure_ascii=False))
+        if 'error' in stats:
+            raise CommandError(f"行情資料取得失敗: {stats['error']}")
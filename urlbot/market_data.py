@@ -0,0 +1,136 @@
+import heapq
+import math
+import sys
+from array import array
+from collections import namedtuple
+
+#單一個股的資料 由 MarketDataStore 依需要組出 數值欄位沒有資料時為 None
+StockRecord = namedtuple('StockRecord', [
+    'code', 'name', 'closing_price', 'change', 'change_percent', 'highest_price', 'lowest_price',
+    'trade_volume', 'trade_value', 'transaction', 'pe_ratio', 'pb_ratio', 'dividend_yield',
+])
+
+#數值欄位 {欄位名稱: (資料集, 原始欄位)} basic 為 BWIBBU_ALL daily 為 STOCK_DAY_ALL
+NUMERIC_FIELDS = {
+    'closing_price': ('daily', 'ClosingPrice'),
+    'change': ('daily', 'Change'),
+    'highest_price': ('daily', 'HighestPrice'),
+    'lowest_price': ('daily', 'LowestPrice'),
+    'trade_volume': ('daily', 'TradeVolume'),
+    'trade_value': ('daily', 'TradeValue'),
+    'transaction': ('daily', 'Transaction'),
+    'pe_ratio': ('basic', 'PEratio'),
+    'pb_ratio': ('basic', 'PBratio'),
+    'dividend_yield': ('basic', 'DividendYield'),
+}
+
+_MISSING = math.nan
+
+
+def parse_number(value):
+    """把證交所的字串數值轉成 float 空字串、"--" 等無法解析的值為 NaN"""
+    if value is None:
+        return _MISSING
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return _MISSING
+
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+
+class MarketDataStore:
+    """全市場個股資料的欄位式儲存
+
+    每個數值欄位是一個 array('d') (缺值為 NaN)，股票代碼經過 intern 並建立 {代碼: 列} 索引，
+    不會為每檔股票保留一個 dict，也不會重複保存欄位名稱與字串數值。
+    查詢單一個股時才組出 StockRecord。
+
+    Attributes:
+        codes: 股票代碼列表 (依資料順序)
+        names: 股票名稱列表
+        columns: {欄位名稱: array('d')}
+        missing: 下載失敗的資料集名稱
+        partial: 是否只有部分資料
+
+    使用範例:
+        store = MarketDataStore.from_columns(basic_columns, daily_columns)
+        store.get('2330')
+        store.top('trade_volume', 5)
+    """
+
+    def __init__(self, missing=()):
+        self.codes = []
+        self.names = []
+        self.columns = {field: array('d') for field in NUMERIC_FIELDS}
+        self.columns['change_percent'] = array('d')
+        self.missing = tuple(missing)
+        self._row_by_code = {}
+
+    @classmethod
+    def from_columns(cls, basic, daily, missing=()):
+        """以 STOCK_DAY_ALL 的代碼為主 合併 BWIBBU_ALL 的本益比等欄位
+
+        Args:
+            basic: BWIBBU_ALL 的 Columns
+            daily: STOCK_DAY_ALL 的 Columns
+            missing: 下載失敗的資料集名稱
+        """
+        store = cls(missing)
+        sources = {'basic': basic, 'daily': daily}
+        basic_row_by_code = {code: row for row, code in enumerate(basic['Code'])}
+
+        for row, code in enumerate(daily['Code']):
+            code = sys.intern(code)
+            basic_row = basic_row_by_code.get(code)
+            source_rows = {'basic': basic_row, 'daily': row}
+
+            store._row_by_code[code] = len(store.codes)
+            store.codes.append(code)
+            store.names.append(daily.value('Name', row) or basic.value('Name', basic_row))
+            for field, (source, raw_field) in NUMERIC_FIELDS.items():
+                store.columns[field].append(parse_number(sources[source].value(raw_field, source_rows[source])))
+
+            # 漲跌幅 = 漲跌 / 前一日收盤價
+            closing_price, change = store.columns['closing_price'][-1], store.columns['change'][-1]
+            previous_close = closing_price - change
+            store.columns['change_percent'].append(
+                round(change / previous_close * 100, 2) if previous_close > 0 else _MISSING
+            )
+        return store
+
+    @property
+    def partial(self):
+        return bool(self.missing)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self._row_by_code
+
+    def _record(self, row):
+        return StockRecord(
+            code=self.codes[row],
+            name=self.names[row],
+            **{field: _optional(values[row]) for field, values in self.columns.items()},
+        )
+
+    def get(self, code):
+        """取得單一個股 找不到時回傳 None"""
+        row = self._row_by_code.get(code)
+        return None if row is None else self._record(row)
+
+    def top(self, field, n=5, ascending=False, sign=0):
+        """依數值欄位取前 n 名 (預設由大到小) 沒有資料的個股不列入
+
+        sign 為 1 時只取大於 0 的值 -1 時只取小於 0 的值 (例如漲幅 / 跌幅)，符合的個股不足 n 檔時回傳較短的 list。
+        """
+        values = self.columns[field]
+        rows = (row for row in range(len(values)) if not math.isnan(values[row]))
+        if sign:
+            rows = (row for row in rows if values[row] * sign > 0)
+        pick = heapq.nsmallest if ascending else heapq.nlargest
+        return [self._record(row) for row in pick(n, rows, key=values.__getitem__)]
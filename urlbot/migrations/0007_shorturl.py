@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:47
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urlbot', '0006_alter_todolist_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortUrl',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_hash', models.CharField(max_length=64, unique=True, verbose_name='正規化網址的 SHA-256')),
+                ('long_url', models.TextField(verbose_name='正規化後的長網址')),
+                ('short_url', models.URLField(max_length=255, verbose_name='短網址')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='創建時間')),
+            ],
+            options={
+                'verbose_name': '短網址',
+                'verbose_name_plural': '短網址列表',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:55
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urlbot', '0007_shorturl'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockWatchlist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(db_index=True, max_length=255, verbose_name='Line用戶ID')),
+                ('stock_code', models.CharField(max_length=10, verbose_name='股票代碼')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='創建時間')),
+            ],
+            options={
+                'verbose_name': '股票追蹤',
+                'verbose_name_plural': '股票追蹤清單',
+                'ordering': ['created_at'],
+                'constraints': [models.UniqueConstraint(fields=('user_id', 'stock_code'), name='unique_user_stock')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urlbot', '0008_stockwatchlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_hash', models.CharField(max_length=64, unique=True, verbose_name='正規化網址的 SHA-256')),
+                ('long_url', models.TextField(verbose_name='轉址目標網址')),
+                ('hits', models.PositiveBigIntegerField(default=0, verbose_name='點擊次數')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='創建時間')),
+            ],
+            options={
+                'verbose_name': '自架短網址',
+                'verbose_name_plural': '自架短網址列表',
+            },
+        ),
+    ]
@@ -1,3 +1,4 @@
+import hashlib
 from django.db import models
 from django.utils import timezone
 
@@ -39,3 +40,113 @@ class Todolist(models.Model):
 
     def __str__(self):
         return self.title
+
+
+class ShortUrl(models.Model):
+    """長網址與短網址的對應 相同網址重複縮短時直接回傳 不再呼叫 bitly"""
+
+    url_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name="正規化網址的 SHA-256"
+    )
+
+    long_url = models.TextField(
+        verbose_name="正規化後的長網址"
+    )
+
+    short_url = models.URLField(
+        max_length=255,
+        verbose_name="短網址"
+    )
+
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="創建時間"
+    )
+
+    class Meta:
+        verbose_name = '短網址'
+        verbose_name_plural = '短網址列表'
+
+    @staticmethod
+    def hash_url(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def __str__(self):
+        return self.short_url
+
+
+class StockWatchlist(models.Model):
+    """使用者追蹤的股票 收盤後推播摘要"""
+
+    user_id = models.CharField(
+        max_length=255,
+        db_index=True,
+        verbose_name="Line用戶ID"
+    )
+
+    stock_code = models.CharField(
+        max_length=10,
+        verbose_name="股票代碼"
+    )
+
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="創建時間"
+    )
+
+    class Meta:
+        verbose_name = '股票追蹤'
+        verbose_name_plural = '股票追蹤清單'
+        ordering = ['created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'stock_code'], name='unique_user_stock'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.stock_code}"
+
+
+class ShortLink(models.Model):
+    """自架短網址 以主鍵的 base62 編碼作為短碼 (urlbot/shortlink.py)
+
+    轉址時以短碼解出主鍵直接查詢 點擊次數由 HitCounter 批次寫入。
+    """
+
+    url_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name="正規化網址的 SHA-256"
+    )
+
+    long_url = models.TextField(
+        verbose_name="轉址目標網址"
+    )
+
+    hits = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name="點擊次數"
+    )
+
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="創建時間"
+    )
+
+    class Meta:
+        verbose_name = '自架短網址'
+        verbose_name_plural = '自架短網址列表'
+
+    @property
+    def code(self):
+        from .shortlink import encode_id
+        return encode_id(self.pk)
+
+    @property
+    def short_url(self):
+        from .shortlink import build_short_url
+        return build_short_url(self.code)
+
+    def __str__(self):
+        return self.code
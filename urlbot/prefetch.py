@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from functools import partial
+from django.conf import settings
+from django.db import close_old_connections
+from .cache import _is_cacheable
+from .schedules import cwa_forecast_ttl, cwa_observation_ttl, seconds_until_next, taipei_now, twse_ttl
+from .singleton import LazySingleton
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchJob:
+    """預先更新的單一工作
+
+    Attributes:
+        name: 工作名稱
+        run: 無參數函式 強制重新下載並寫入快取 回傳下載結果
+        schedule: 無參數函式 回傳距離下一次執行的秒數
+        ok: 判斷下載結果是否成功 預設與快取相同 (錯誤訊息字串視為失敗)
+    """
+
+    def __init__(self, name, run, schedule, ok=_is_cacheable):
+        self.name = name
+        self.run = run
+        self.schedule = schedule
+        self.ok = ok
+
+        self.next_run = None
+        self.runs = 0
+        self.failures = 0
+        self.total_time = 0.0
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+
+    def stats(self) -> dict:
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'avg_ms': round(self.total_time / self.runs * 1000, 2) if self.runs else 0.0,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_ms': round(self.last_duration * 1000, 2) if self.last_duration is not None else None,
+            'last_error': self.last_error,
+            'next_run': self.next_run.isoformat() if self.next_run else None,
+        }
+
+
+#PREFETCH['JOBS'] 的 TTL 設定可使用的快取時間函式
+TTL_SCHEDULES = {
+    'twse': twse_ttl,
+    'cwa_observation': cwa_observation_ttl,
+    'cwa_forecast': cwa_forecast_ttl,
+}
+
+
+def ttl_schedule(ttl, margin=60, min_gap=1):
+    """依快取項目本身的到期時間排程 在到期前 margin 秒重新下載
+
+    快取時間比 margin 還短時 (例如證交所發布時段內接近更新時間點) 在到期當下重新下載。
+    """
+    def schedule():
+        seconds = ttl()
+        return max(seconds - margin if seconds > margin else seconds, min_gap)
+    return schedule
+
+
+def build_schedule(config):
+    """依設定建立排程函式
+
+    TTL: 快取時間函式名稱 (TTL_SCHEDULES) 在快取到期前更新 可搭配 MARGIN
+    TIMES: 每日時間點 (可搭配 WEEKDAYS) / INTERVAL: 固定間隔秒數
+    """
+    if 'TTL' in config:
+        return ttl_schedule(TTL_SCHEDULES[config['TTL']], config.get('MARGIN', 60))
+    if 'INTERVAL' in config:
+        interval = config['INTERVAL']
+        return lambda: interval
+    return partial(seconds_until_next, config['TIMES'], config.get('WEEKDAYS'))
+
+
+def default_jobs():
+    """依 settings.PREFETCH['JOBS'] 建立工作 沒有列在設定內的資料集不預先更新"""
+    from .views import CurrencyTransformAPI, StockAPI, WeatherIntegratedAPI, _is_complete_dataset, _is_complete_index
+
+    # 快取為 process 共用 這裡的服務實例只用來觸發下載 不需要 LINE 客戶端
+    stock = StockAPI()
+    weather = WeatherIntegratedAPI()
+    currency = CurrencyTransformAPI()
+    available = {
+        'twse_stock_index': (partial(stock.get_stock_index, refresh=True), _is_complete_index),
+        'twse_MI_INDEX20': (partial(stock.get_dataset, stock.url_MI_INDEX20, refresh=True), _is_complete_dataset),
+        'twse_MI_QFIIS': (partial(stock.get_dataset, stock.url_fund_MI_QFIIS_sort_20, refresh=True), _is_complete_dataset),
+        'cwa_observation': (partial(weather.current_weather_api._get_snapshot, refresh=True), _is_cacheable),
+        'cwa_forecast': (partial(weather.forecast_api._get_forecast_index, refresh=True), _is_cacheable),
+        'currency': (partial(currency._get_rate_matrix, refresh=True), _is_cacheable),
+    }
+
+    jobs = []
+    for name, config in getattr(settings, 'PREFETCH', {}).get('JOBS', {}).items():
+        if name not in available:
+            raise ValueError(f"不支援的預先更新工作: {name}")
+        run, ok = available[name]
+        jobs.append(PrefetchJob(name, run, build_schedule(config), ok))
+    return jobs
+
+
+class PrefetchScheduler:
+    """熱門資料集的預先更新排程
+
+    在快取到期的時間點主動重新下載證交所、中央氣象署與匯率資料並寫入共用快取，
+    使用者的查詢一律命中快取，不需要由過期後的第一個使用者等待下載。
+    可以在 web process 內以背景執行緒執行 (PREFETCH['THREAD'])，
+    或以 `python manage.py prefetch` 獨立執行 (需設定 DATASET_CACHE_BACKEND=shared 讓 web worker 共用快取)。
+
+    Attributes:
+        jobs: PrefetchJob 列表
+        run_on_start: 啟動時是否先執行一次所有工作
+
+    使用範例:
+        scheduler = get_prefetch_scheduler()
+        scheduler.start()
+        scheduler.stats()
+    """
+
+    def __init__(self, jobs, run_on_start=True):
+        self.jobs = jobs
+        self.run_on_start = run_on_start
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        """依照 settings.PREFETCH 建立排程"""
+        config = getattr(settings, 'PREFETCH', {})
+        return cls(default_jobs(), run_on_start=config.get('RUN_ON_START', True))
+
+    def run_job(self, job) -> bool:
+        """執行單一工作並記錄耗時與失敗 回傳是否成功"""
+        start = time.monotonic()
+        try:
+            result = job.run()
+            error = None if job.ok(result) else str(result)
+        except Exception as e:
+            logger.exception("預先更新 %s 失敗", job.name)
+            error = f"未預期錯誤{str(e)}"
+        finally:
+            close_old_connections()
+
+        elapsed = time.monotonic() - start
+        with self._lock:
+            job.runs += 1
+            job.total_time += elapsed
+            job.last_run = taipei_now()
+            job.last_duration = elapsed
+            job.last_error = error
+            if error is not None:
+                job.failures += 1
+
+        if error is None:
+            logger.info("預先更新 %s 完成 %.0fms", job.name, elapsed * 1000)
+        else:
+            logger.warning("預先更新 %s 失敗 %.0fms: %s", job.name, elapsed * 1000, error)
+        return error is None
+
+    def run_once(self, names=None) -> dict:
+        """立即執行全部 (或指定名稱的) 工作 回傳 {工作名稱: 是否成功}"""
+        return {job.name: self.run_job(job) for job in self.jobs if names is None or job.name in names}
+
+    def _plan(self, job):
+        job.next_run = taipei_now() + timedelta(seconds=job.schedule())
+
+    def run_forever(self):
+        """依排程持續執行 直到呼叫 stop()"""
+        if self.run_on_start:
+            self.run_once()
+        for job in self.jobs:
+            self._plan(job)
+
+        while self.jobs and not self._stop.is_set():
+            next_job = min(self.jobs, key=lambda job: job.next_run)
+            delay = (next_job.next_run - taipei_now()).total_seconds()
+            if delay > 0 and self._stop.wait(delay):
+                break
+            self.run_job(next_job)
+            self._plan(next_job)
+
+    def start(self):
+        """以背景執行緒執行排程 (只會執行一次)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run_forever, name="linebot-prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        """回傳每個工作的執行次數、失敗次數、耗時與下一次執行時間"""
+        with self._lock:
+            return {job.name: job.stats() for job in self.jobs}
+
+
+_scheduler = LazySingleton(PrefetchScheduler.from_settings, close='stop')
+
+
+def get_prefetch_scheduler() -> PrefetchScheduler:
+    """取得當前 process 共用的預先更新排程"""
+    return _scheduler.get()
+
+
+def start_prefetch_thread():
+    """settings.PREFETCH['THREAD'] 為 True 時在 web process 內啟動預先更新 由 wsgi/asgi 入口呼叫
+
+    設定共享快取時每個 worker 都會載入 wsgi/asgi，在 web process 內執行會讓每個 worker 重複下載，
+    這時不啟動 改由 `python manage.py prefetch` 單獨執行。
+    """
+    if not getattr(settings, 'PREFETCH', {}).get('THREAD'):
+        return False
+    if getattr(settings, 'DATASET_CACHE', {}).get('SHARED_BACKEND'):
+        logger.warning("已設定共享快取 PREFETCH_THREAD 不會在 web process 內執行 請改用 python manage.py prefetch")
+        return False
+    get_prefetch_scheduler().start()
+    return True
+
+
+def reset_prefetch_scheduler():
+    """停止並清除共用的預先更新排程 (測試用)"""
+    _scheduler.reset()
@@ -0,0 +1,86 @@
+from django.conf import settings
+from linebot import AsyncLineBotApi, LineBotApi, WebhookParser
+from .http_client import LineAsyncHttpClient, LineHttpClient
+from .singleton import LazySingleton
+
+
+class ServiceRegistry:
+    """服務註冊表
+
+    集中保存 LINE 客戶端與各項功能服務的實例。
+    每個 gunicorn worker 只會建立一次，之後所有 webhook 請求共用同一組實例，
+    避免每次請求都重新建立客戶端與對照表。
+
+    Attributes:
+        line_bot_api: LINE Bot API 客戶端實例
+        parser: LINE Webhook 解析器
+        shortener: 網址縮短服務實例 (依 URL_SHORTENER['BACKEND'] 使用 bitly 或自架短網址)
+        currency_transform: 匯率轉換服務實例
+        news: 新聞搜尋服務實例
+        stock: 股票查詢服務實例
+        weather: 整合天氣查詢服務實例
+        todolist: 待辦事項管理實例
+        stock_tracker: 股票追蹤清單實例
+    """
+
+    def __init__(self):
+        # 避免與 views 互相 import
+        from .views import (
+            CurrencyTransformAPI, NewsAPI, StockAPI, StockTracker,
+            WeatherIntegratedAPI, TodoList, get_url_shortener_class,
+        )
+
+        self.line_bot_api = LineBotApi(settings.LINE_CHANNEL_ACCESS_TOKEN, http_client=LineHttpClient)
+        self.parser = WebhookParser(settings.LINE_CHANNEL_SECRET)
+        self.shortener = get_url_shortener_class()()
+        self.currency_transform = CurrencyTransformAPI()
+        self.news = NewsAPI()
+        self.stock = StockAPI()
+        self.weather = WeatherIntegratedAPI()
+        self.todolist = TodoList()
+        self.stock_tracker = StockTracker(self.stock)
+
+
+class AsyncServiceRegistry:
+    """非同步 webhook 使用的服務註冊表
+
+    服務類為 async_views 內的非同步版本，對外請求共用 aiohttp session。
+    屬性與 ServiceRegistry 相同。
+    """
+
+    def __init__(self):
+        from .async_views import (
+            AsyncCurrencyTransformAPI, AsyncNewsAPI, AsyncStockAPI,
+            AsyncWeatherIntegratedAPI, get_async_url_shortener_class,
+        )
+        from .views import StockTracker, TodoList
+
+        self.line_bot_api = AsyncLineBotApi(settings.LINE_CHANNEL_ACCESS_TOKEN, LineAsyncHttpClient())
+        self.parser = WebhookParser(settings.LINE_CHANNEL_SECRET)
+        self.shortener = get_async_url_shortener_class()()
+        self.currency_transform = AsyncCurrencyTransformAPI()
+        self.news = AsyncNewsAPI()
+        self.stock = AsyncStockAPI()
+        self.weather = AsyncWeatherIntegratedAPI()
+        self.todolist = TodoList()  # 資料庫操作 由 view 以 sync_to_async 呼叫
+        self.stock_tracker = StockTracker(self.stock)  # 同上 摘要與代碼檢查由 view 以非同步方式取得索引
+
+
+_registry = LazySingleton(ServiceRegistry)
+_async_registry = LazySingleton(AsyncServiceRegistry)
+
+
+def get_registry() -> ServiceRegistry:
+    """取得當前 process 的服務註冊表 第一次呼叫時才建立 (thread-safe)"""
+    return _registry.get()
+
+
+def get_async_registry() -> AsyncServiceRegistry:
+    """取得當前 process 的非同步服務註冊表"""
+    return _async_registry.get()
+
+
+def reset_registry():
+    """清除已建立的註冊表 下次呼叫 get_registry() 會重新建立 (測試用)"""
+    _registry.reset()
+    _async_registry.reset()
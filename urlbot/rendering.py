@@ -0,0 +1,112 @@
+from string import Formatter
+from linebot.models import SendMessage, TextSendMessage
+
+# LINE 單則文字訊息最多 5000 字 (以 UTF-16 計算) 一次回覆最多 5 則訊息
+LINE_TEXT_LIMIT = 5000
+LINE_MESSAGES_PER_REPLY = 5
+TRUNCATED_NOTICE = "\n(內容過長 已省略其餘部分)"
+
+
+class Template:
+    """預先建立的回覆範本
+
+    範本字串在 import 時解析一次確認格式正確，之後以 str.format_map 套用欄位。
+
+    使用範例:
+        row = Template("名次: {rank}\\n股票: {name}({code})\\n")
+        row(rank=1, name="台積電", code="2330")
+    """
+    __slots__ = ('source',)
+
+    def __init__(self, source):
+        # 格式錯誤 (例如少了右括號) 時在 import 就拋出 ValueError
+        list(Formatter().parse(source))
+        self.source = source
+
+    def __call__(self, **fields) -> str:
+        return self.source.format_map(fields)
+
+
+class ReplyBuilder:
+    """以 list 收集片段 最後一次 join 避免在迴圈內重複複製字串
+
+    使用範例:
+        builder = ReplyBuilder("您的待辦清單如下\\n")
+        builder.add(f"1. {title}\\n")
+        builder.build()
+    """
+    __slots__ = ('_parts',)
+
+    def __init__(self, *parts):
+        self._parts = list(parts)
+
+    def add(self, *parts):
+        self._parts.extend(parts)
+        return self
+
+    def add_line(self, line=""):
+        self._parts.append(line)
+        self._parts.append("\n")
+        return self
+
+    def __bool__(self):
+        return any(self._parts)
+
+    def build(self) -> str:
+        return "".join(self._parts)
+
+
+def _utf16_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def split_text(text, limit=LINE_TEXT_LIMIT):
+    """把過長的文字依行切成多段 每段不超過 limit (UTF-16) 單行過長時才從中間切開"""
+    # 每個字最多佔 2 個 UTF-16 單位 大部分回覆不需要逐行計算
+    if len(text) * 2 <= limit or _utf16_length(text) <= limit:
+        return [text]
+
+    chunks, current, size = [], [], 0
+    for line in text.splitlines(keepends=True):
+        length = _utf16_length(line)
+        if size + length > limit and current:
+            chunks.append("".join(current))
+            current, size = [], 0
+        while length > limit:
+            head, line = _cut(line, limit)
+            chunks.append(head)
+            length = _utf16_length(line)
+        current.append(line)
+        size += length
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def _cut(text, limit):
+    """從開頭切出不超過 limit (UTF-16) 的一段"""
+    size = 0
+    for index, char in enumerate(text):
+        size += 2 if ord(char) > 0xFFFF else 1
+        if size > limit:
+            return text[:index], text[index:]
+    return text, ""
+
+
+def as_messages(reply, limit=LINE_TEXT_LIMIT, max_messages=LINE_MESSAGES_PER_REPLY):
+    """把處理方法的回傳值轉成要送出的訊息 list
+
+    文字超過 limit 時自動切成多則 TextSendMessage，超過 max_messages 則時最後一則截斷並加上說明；
+    預先建立的訊息物件 (SendMessage 或其 list) 直接使用。
+    """
+    if isinstance(reply, SendMessage):
+        return [reply]
+    if isinstance(reply, (list, tuple)):
+        return list(reply)[:max_messages]
+
+    chunks = split_text(reply, limit)
+    if len(chunks) > max_messages:
+        notice_length = _utf16_length(TRUNCATED_NOTICE)
+        last, _ = _cut(chunks[max_messages - 1], limit - notice_length)
+        chunks = chunks[:max_messages - 1] + [last + TRUNCATED_NOTICE]
+    return [TextSendMessage(text=chunk) for chunk in chunks]
@@ -0,0 +1,214 @@
+from types import MappingProxyType
+from linebot.models import SendMessage, TextSendMessage
+from .rendering import ReplyBuilder
+
+#支援查詢天氣的縣市 使用說明與查無縣市時共用
+SUPPORTED_COUNTIES = (
+    "支援查詢的縣市：\n"
+    "北部：臺北市、新北市、基隆市、桃園市、新竹市、新竹縣\n"
+    "中部：臺中市、南投縣、彰化縣\n"
+    "南部：嘉義市、嘉義縣、臺南市、高雄市、屏東縣\n"
+    "東部：宜蘭縣、花蓮縣、臺東縣\n"
+    "外島：澎湖縣、金門縣、連江縣"
+)
+
+#資料集下載不完整時接在回覆最後
+PARTIAL_DATA_NOTICE = "(部分資料暫時無法取得 顯示為 N/A)"
+
+#各指令缺少參數時的使用說明 同步與非同步 view 共用
+URL_SHORTENER_USAGE = (
+    "請輸入正確的縮網址格式\n"
+    "   說明: 將長網址轉換為短網址\n"
+    "   格式: 縮網址 [URL]\n"
+    "   範例: 縮網址 https://www.google.com.tw/"
+)
+CURRENCY_USAGE = (
+    "說明: 查詢即時匯率轉換\n"
+    "格式: 匯率 [原幣別] [目標幣別]\n"
+    "範例: 匯率 美金 台幣"
+)
+STOCK_USAGE = (
+    "說明: 查詢股票即時資訊\n"
+    "格式: 股票 [股票代碼]\n"
+    "範例: 股票 2330\n"
+    "多檔: 股票 2330 2317 2454 (一次最多 10 檔)\n"
+    "追蹤: 股票 追蹤 [新增/刪除] [股票代碼...] 收盤後推播摘要\n"
+    "排行: 股票 [成交量/成交值/漲幅/跌幅] [名次數量]\n"
+    "範例: 股票 漲幅 10\n"
+)
+STOCK_TRACKER_USAGE = (
+    "說明: 股票追蹤清單 收盤後推播摘要\n"
+    "子指令\n"
+    "股票 追蹤: 查看追蹤股票摘要\n"
+    "新增: 股票 追蹤 新增 [股票代碼...]\n"
+    "刪除: 股票 追蹤 刪除 [股票代碼...]/全部\n"
+)
+WEATHER_USAGE = (
+    "請輸入要查詢的縣市名稱\n"
+    "範例：天氣 臺北市\n"
+    + SUPPORTED_COUNTIES
+)
+#查無縣市時接在「找不到 xx 的天氣資訊」之後
+WEATHER_NOT_FOUND_HINT = (
+    "請輸入完整的縣市名稱，例如：\n"
+    "- 臺北市（而不是 臺北）\n"
+    "- 嘉義市 或 嘉義縣\n"
+    + SUPPORTED_COUNTIES
+)
+NEWS_USAGE = (
+    "說明: 搜尋相關新聞\n"
+    "格式: 新聞 [關鍵字]\n"
+    "範例: 新聞 財金\n"
+)
+TODO_USAGE = (
+    "請輸入正確的待辦事項指令\n"
+    "支援的指令：\n"
+    "todo 列表\n"
+    "todo 新增 [事項名稱...]\n"
+    "todo 刪除 [事項名稱...]\n"
+    "todo 完成 [事項名稱...]\n"
+    "todo 修改 [事項名稱...] [狀態]"
+)
+TODO_COMMAND_USAGE = (
+    "說明: 待辦事項管理\n"
+    "子指令\n"
+    "列表: 查看所有待辦事項\n"
+    "新增: 新增待辦事項 (todo 新增 [事項名稱...])\n"
+    "刪除: 刪除待辦事項 (todo 刪除 [事項名稱...]/全部)\n"
+    "完成: 標記為完成 (todo 完成 [事項名稱...])\n"
+    "修改: 更改待辦狀態 (todo 修改 [事項名稱...] completed/pending)\n"
+    "一次最多 20 項\n"
+)
+
+#指令說明的內容 收到無法辨識的訊息時回覆
+COMMAND_HELP = {
+    "縮網址": {
+        "說明": "將長網址轉換為短網址",
+        "格式": "縮網址 [URL]",
+        "範例": "縮網址 https://www.google.com.tw/",
+    },
+    "匯率": {
+        "說明": "查詢即時匯率轉換",
+        "格式": "匯率 [原幣別] [目標幣別]",
+        "範例": "匯率 美金 台幣",
+    },
+    "股票": {
+        "說明": "查詢股票即時資訊",
+        "格式": "股票 [股票代碼]",
+        "子指令": {
+            "外資持股": "外資及陸資持股前五名",
+            "每日成交": "每日成交量前五名",
+            "成交量/成交值": "成交量或成交金額排行 (股票 成交值 [名次數量])",
+            "漲幅/跌幅": "漲跌幅排行 (股票 漲幅 [名次數量])",
+            "追蹤": "追蹤清單 收盤後推播摘要 (股票 追蹤 新增/刪除 [股票代碼...])",
+        },
+        "範例": [
+            "股票 2330",
+            "股票 2330 2317 2454",
+            "股票 追蹤 新增 2330 2317",
+            "股票 漲幅 10",
+        ],
+    },
+    "天氣": {
+        "說明": "查詢36小時天氣預報",
+        "格式": "天氣 [縣市名]",
+        "範例": "天氣 嘉義",
+    },
+    "新聞": {
+        "說明": "搜尋相關新聞",
+        "格式": "新聞 [關鍵字]",
+        "範例": "新聞 財金",
+    },
+    "todo": {
+        "說明": "待辦事項管理",
+        "子指令": {
+            "列表": "查看所有待辦事項",
+            "新增": "新增待辦事項 (todo 新增 [事項名稱...])",
+            "刪除": "刪除待辦事項 (todo 刪除 [事項名稱...])",
+            "完成": "標記為完成 (todo 完成 [事項名稱...])",
+            "修改": "更改待辦狀態 (todo 修改 [事項名稱...] completed/pending)",
+        },
+        "範例": [
+            "todo 列表",
+            "todo 新增 運動 讀書",
+            "todo 完成 運動",
+            "todo 刪除 運動",
+            "todo 修改 運動 completed",
+        ],
+    },
+}
+
+
+def render_command_help(commands) -> str:
+    """把指令說明組成一則訊息"""
+    builder = ReplyBuilder().add_line("📝 指令使用說明").add_line("=" * 30).add_line()
+    for cmd, info in commands.items():
+        builder.add_line(f"🔸 {cmd}")
+        builder.add_line(f"  說明：{info['說明']}")
+
+        if "格式" in info:
+            builder.add_line(f"  格式：{info['格式']}")
+
+        if "子指令" in info:
+            builder.add_line("  子指令：")
+            for subcmd, desc in info['子指令'].items():
+                builder.add_line(f"    - {subcmd}: {desc}")
+
+        builder.add_line("  範例：")
+        examples = info.get('範例')
+        for example in (examples if isinstance(examples, list) else [examples]):
+            builder.add_line(f"    {example}")
+        builder.add_line()
+
+    return builder.build()
+
+
+class ReplyCatalog:
+    """固定回覆的目錄
+
+    所有不會隨使用者輸入改變的回覆在 import 時組好一次，之後只做查詢；
+    每則文字同時預先建立對應的 TextSendMessage，也可以直接放入 Flex / Quick Reply 等訊息物件。
+    建立後不能再修改，多個執行緒共用同一份也不需要加鎖。
+
+    使用範例:
+        REPLIES.text('help')
+        REPLIES.message('help')
+    """
+    __slots__ = ('_texts', '_messages')
+
+    def __init__(self, texts, messages=None):
+        """
+        Args:
+            texts: {名稱: 回覆文字}
+            messages: {名稱: SendMessage} 沒有列出的文字回覆會自動建立 TextSendMessage
+        """
+        prebuilt = {name: TextSendMessage(text=text) for name, text in texts.items()}
+        prebuilt.update(messages or {})
+        object.__setattr__(self, '_texts', MappingProxyType(dict(texts)))
+        object.__setattr__(self, '_messages', MappingProxyType(prebuilt))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ReplyCatalog 建立後不能修改")
+
+    def __contains__(self, name):
+        return name in self._messages
+
+    def text(self, name) -> str:
+        return self._texts[name]
+
+    def message(self, name) -> SendMessage:
+        return self._messages[name]
+
+
+REPLIES = ReplyCatalog({
+    'help': render_command_help(COMMAND_HELP),
+    'url_shortener_usage': URL_SHORTENER_USAGE,
+    'currency_usage': CURRENCY_USAGE,
+    'stock_usage': STOCK_USAGE,
+    'stock_tracker_usage': STOCK_TRACKER_USAGE,
+    'weather_usage': WEATHER_USAGE,
+    'news_usage': NEWS_USAGE,
+    'todo_usage': TODO_USAGE,
+    'todo_command_usage': TODO_COMMAND_USAGE,
+})
+
@@ -0,0 +1,112 @@
+from collections import namedtuple
+
+
+def tokenize(text):
+    """以空白 (含全形空白) 切開訊息 連續空白不會產生空字串"""
+    return text.split()
+
+
+def _key(token):
+    # 英文指令不分大小寫 (todo / TODO)
+    return token.casefold()
+
+
+class Route(namedtuple('Route', ['path', 'handler', 'bound', 'needs_user'])):
+    """一條指令路徑
+
+    Attributes:
+        path: 正式的指令路徑 例如 ("todo", "新增")
+        handler: view 上的處理方法名稱
+        bound: 固定放在參數前面的值 例如排行名稱
+        needs_user: 處理時是否需要傳入 user_id
+    """
+    __slots__ = ()
+
+    def invoke(self, owner, args, user_id=None):
+        """呼叫 owner 上的處理方法 handler(*bound, args[, user_id])"""
+        handler = getattr(owner, self.handler)
+        if self.needs_user:
+            return handler(*self.bound, args, user_id)
+        return handler(*self.bound, args)
+
+
+class _Node:
+    __slots__ = ('children', 'route')
+
+    def __init__(self):
+        self.children = {}
+        self.route = None
+
+
+class CommandRouter:
+    """以 token 為鍵的前綴樹指令路由
+
+    第一個 token 找到指令，之後的 token 依序比對子指令，取最長的符合路徑，
+    剩下的 token 就是處理方法收到的參數。每層都是 dict 查詢，不受指令數量與宣告順序影響。
+    別名直接指向同一個節點，子指令也一併共用。
+
+    路由在 class 定義時建立一次 之後每則訊息只做查詢。
+
+    使用範例:
+        router = CommandRouter(
+            {"todo": "_handle_todolist", "todo 新增": ("_handle_todolist", "新增")},
+            aliases={"待辦": "todo"},
+            user_routes=("todo",),
+        )
+        route, args = router.resolve("待辦 新增 運動")
+        route.invoke(view, args, user_id)
+    """
+
+    def __init__(self, routes, aliases=None, user_routes=()):
+        """
+        Args:
+            routes: {指令路徑: 處理方法名稱 或 (處理方法名稱, 固定參數...)} 路徑以空白分隔子指令
+            aliases: {別名路徑: 正式路徑} 別名的上一層必須是已存在的路徑 (或為第一層)
+            user_routes: 需要 user_id 的路徑 其下的子指令也一樣需要
+        """
+        self._root = _Node()
+        user_paths = {tuple(_key(token) for token in tokenize(path)) for path in user_routes}
+
+        for path, target in routes.items():
+            tokens = tuple(tokenize(path))
+            handler, *bound = (target,) if isinstance(target, str) else target
+            keys = tuple(_key(token) for token in tokens)
+            needs_user = any(keys[:length] in user_paths for length in range(1, len(keys) + 1))
+            self._node(keys, create=True).route = Route(tokens, handler, tuple(bound), needs_user)
+
+        for alias, target in (aliases or {}).items():
+            alias_keys = tuple(_key(token) for token in tokenize(alias))
+            target_node = self._node(tuple(_key(token) for token in tokenize(target)))
+            parent = self._node(alias_keys[:-1])
+            if target_node is None or parent is None:
+                raise ValueError(f"別名 {alias} 指向不存在的指令 {target}")
+            parent.children[alias_keys[-1]] = target_node
+
+    def _node(self, keys, create=False):
+        node = self._root
+        for key in keys:
+            child = node.children.get(key)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[key] = _Node()
+            node = child
+        return node
+
+    def resolve(self, text):
+        """找出訊息對應的路由
+
+        Returns:
+            tuple: (Route, 參數 list) 找不到指令時為 None
+        """
+        tokens = tokenize(text)
+        node, matched, depth = self._root, None, 0
+        for index, token in enumerate(tokens):
+            node = node.children.get(_key(token))
+            if node is None:
+                break
+            if node.route is not None:
+                matched, depth = node.route, index + 1
+        if matched is None:
+            return None
+        return matched, tokens[depth:]
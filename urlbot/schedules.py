@@ -0,0 +1,68 @@
+from datetime import datetime, time as dt_time, timedelta
+from zoneinfo import ZoneInfo
+from django.conf import settings
+
+TAIPEI = ZoneInfo('Asia/Taipei')
+
+
+def _parse_time(text):
+    hour, minute = text.split(':')
+    return dt_time(int(hour), int(minute))
+
+
+def taipei_now():
+    return datetime.now(TAIPEI)
+
+
+def seconds_until_next(times, weekdays=None, now=None) -> float:
+    """距離下一個排程時間點的秒數 (台北時間)
+
+    Args:
+        times: 每日的時間點 例如 ["14:00", "16:30"]
+        weekdays: 允許的星期 (0=週一) None 表示每天
+        now: 指定目前時間 預設為台北現在時間
+    """
+    now = now or taipei_now()
+    for day_offset in range(8):
+        day = (now + timedelta(days=day_offset)).date()
+        if weekdays is not None and day.weekday() not in weekdays:
+            continue
+        for point in sorted(_parse_time(t) for t in times):
+            candidate = datetime.combine(day, point, tzinfo=TAIPEI)
+            if candidate > now:
+                return (candidate - now).total_seconds()
+    return 24 * 60 * 60
+
+
+def _in_window(now, window, weekdays):
+    if now.weekday() not in weekdays:
+        return False
+    start, end = (_parse_time(t) for t in window)
+    return start <= now.time() < end
+
+
+def twse_ttl(now=None) -> float:
+    """證交所每日資料的快取秒數
+
+    資料在收盤後才更新，一般時段快取到下一個更新時間點；
+    收盤後的發布時段內證交所可能隨時更新 改用較短的快取時間。
+    """
+    config = settings.TWSE_CACHE
+    now = now or taipei_now()
+    weekdays = config['WEEKDAYS']
+    ttl = seconds_until_next(config['REFRESH_TIMES'], weekdays, now)
+    if _in_window(now, config['PUBLISH_WINDOW'], weekdays):
+        return min(ttl, config['WINDOW_TTL'])
+    return min(ttl, config['MAX_TTL'])
+
+
+def cwa_observation_ttl(now=None) -> float:
+    """中央氣象署觀測資料的快取秒數 每小時整點觀測 發布後才過期"""
+    config = settings.CWA_CACHE
+    return min(seconds_until_next(config['OBSERVATION_TIMES'], now=now), config['MAX_TTL'])
+
+
+def cwa_forecast_ttl(now=None) -> float:
+    """中央氣象署 36 小時預報的快取秒數 約每 6 小時發布一次"""
+    config = settings.CWA_CACHE
+    return min(seconds_until_next(config['FORECAST_TIMES'], now=now), config['MAX_TTL'])
@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from .cache import get_dataset_cache
+from .concurrency import get_background_executor
+from .models import ShortLink
+from .singleton import LazySingleton
+
+logger = logging.getLogger(__name__)
+
+BASE62_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_BASE62_INDEX = {char: value for value, char in enumerate(BASE62_ALPHABET)}
+
+# 主鍵上限 (BigAutoField) 超過這個長度的短碼一定不存在
+_MAX_CODE_LENGTH = 11
+
+
+def encode_id(value: int) -> str:
+    """把主鍵編碼成 base62 短碼"""
+    if value < 0:
+        raise ValueError("主鍵不可為負數")
+    if value == 0:
+        return BASE62_ALPHABET[0]
+    chars = []
+    while value:
+        value, remainder = divmod(value, 62)
+        chars.append(BASE62_ALPHABET[remainder])
+    return ''.join(reversed(chars))
+
+
+def decode_code(code: str):
+    """把 base62 短碼解回主鍵 格式不正確時回傳 None"""
+    if not code or len(code) > _MAX_CODE_LENGTH:
+        return None
+    value = 0
+    for char in code:
+        digit = _BASE62_INDEX.get(char)
+        if digit is None:
+            return None
+        value = value * 62 + digit
+    return value
+
+
+def build_short_url(code: str) -> str:
+    """組出對外的短網址 需要設定 URL_SHORTENER['BASE_URL']"""
+    base_url = settings.URL_SHORTENER['BASE_URL']
+    if not base_url:
+        raise ImproperlyConfigured("使用自架短網址需要設定 SHORT_URL_BASE_URL")
+    return f"{base_url.rstrip('/')}/{code}"
+
+
+def _load_target(link_id):
+    """從資料庫讀取轉址目標 找不到時回傳 None (不會被快取)"""
+    return ShortLink.objects.filter(pk=link_id).values_list('long_url', flat=True).first()
+
+
+def resolve_short_link(code: str):
+    """取得短碼對應的 (主鍵, 目標網址) 找不到時回傳 None
+
+    先查 process 內的 LRU 快取 沒有才查資料庫 (以主鍵查詢)。
+    """
+    link_id = decode_code(code)
+    if link_id is None:
+        return None
+    target = get_dataset_cache('redirect').get_or_fetch(
+        link_id,
+        lambda: _load_target(link_id),
+        ttl=settings.URL_SHORTENER['REDIRECT_CACHE_TTL'],
+        cacheable=lambda value: value is not None,
+    )
+    if target is None:
+        return None
+    return link_id, target
+
+
+class HitCounter:
+    """短網址點擊次數的批次計數器
+
+    每次轉址只在記憶體累加，累積到 flush_size 次或距離上次寫入超過 flush_interval 秒時，
+    才在背景執行緒以 F() 一次更新，不會每次轉址都寫資料庫。
+    process 結束時會把尚未寫入的次數寫回。
+
+    Attributes:
+        flush_size: 累積多少次點擊就寫入
+        flush_interval: 最久多少秒寫入一次
+    """
+
+    def __init__(self, flush_size=100, flush_interval=30):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending = Counter()
+        self._pending_total = 0
+        self._last_flush = time.monotonic()
+        self._flushing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        config = settings.URL_SHORTENER
+        return cls(flush_size=config['HIT_FLUSH_SIZE'], flush_interval=config['HIT_FLUSH_INTERVAL'])
+
+    def record(self, link_id):
+        """記錄一次點擊 達到門檻時排入背景寫入"""
+        with self._lock:
+            self._pending[link_id] += 1
+            self._pending_total += 1
+            due = (
+                self._pending_total >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            if not due or self._flushing:
+                return
+            self._flushing = True
+        get_background_executor().submit(self._flush_in_background)
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._pending_total = 0
+            self._last_flush = time.monotonic()
+            return pending
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._flushing = False
+            close_old_connections()
+
+    def flush(self) -> int:
+        """把累積的點擊次數寫入資料庫 返回寫入的點擊數"""
+        pending = self._take_pending()
+        if not pending:
+            return 0
+        try:
+            with transaction.atomic():
+                for link_id, count in pending.items():
+                    ShortLink.objects.filter(pk=link_id).update(hits=F('hits') + count)
+        except Exception:
+            logger.exception("寫入短網址點擊次數失敗")
+            # 放回計數器 下次再寫
+            with self._lock:
+                self._pending.update(pending)
+                self._pending_total += sum(pending.values())
+            return 0
+        return sum(pending.values())
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending_total
+
+
+_hit_counter = LazySingleton(HitCounter.from_settings, close='flush', at_exit=True)
+
+
+def get_hit_counter() -> HitCounter:
+    """取得當前 process 的點擊計數器 第一次呼叫時才建立 (thread-safe)"""
+    return _hit_counter.get()
+
+
+def reset_hit_counter():
+    """寫回並清除點擊計數器 (測試用)"""
+    _hit_counter.reset()
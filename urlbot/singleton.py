@@ -0,0 +1,50 @@
+import atexit
+import threading
+
+
+class LazySingleton:
+    """process 共用的物件 第一次呼叫 get() 時才建立 (thread-safe)
+
+    以 double-checked locking 建立，建立後的呼叫不需要取鎖。
+    reset() 清除已建立的物件 下次 get() 會重新建立 (測試用)。
+
+    Attributes:
+        factory: 建立物件的無參數函式
+        close: 物件的清理方法名稱 (例如 'shutdown') reset() 時呼叫
+        at_exit: 是否在 process 結束時呼叫清理方法
+
+    使用範例:
+        _dispatcher = LazySingleton(EventDispatcher.from_settings, close='shutdown', at_exit=True)
+        _dispatcher.get()
+        _dispatcher.reset()
+    """
+
+    def __init__(self, factory, close=None, at_exit=False):
+        self.factory = factory
+        self.close = close
+        self.at_exit = at_exit
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    instance = self.factory()
+                    if self.at_exit:
+                        atexit.register(getattr(instance, self.close))
+                    self._instance = instance
+                instance = self._instance
+        return instance
+
+    def reset(self):
+        """清除已建立的物件 有設定 close 時先呼叫清理方法"""
+        with self._lock:
+            instance, self._instance = self._instance, None
+        if instance is None or self.close is None:
+            return
+        cleanup = getattr(instance, self.close)
+        if self.at_exit:
+            atexit.unregister(cleanup)
+        cleanup()
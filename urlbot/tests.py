@@ -0,0 +1,1378 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+import aiohttp
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from linebot.exceptions import LineBotApiError
+from linebot.models import Error, MessageEvent, SourceUser, TextMessage, TextSendMessage
+from .async_views import AsyncLineBotCallbackView, AsyncStockAPI
+from .cache import DatasetCache, get_dataset_cache, reset_dataset_caches
+from .digest import MULTICAST_LIMIT, push_stock_digest
+from .dispatcher import EventDispatcher, _batch_executor, get_batch_executor, process_batch
+from .http_client import AsyncHttpClient, AsyncResponse, HttpClient
+from .json_stream import Columns, iter_json_array, read_columns
+from .market_data import MarketDataStore
+from .models import ShortLink, StockWatchlist, Todolist
+from .prefetch import build_schedule, start_prefetch_thread
+from .rendering import LINE_MESSAGES_PER_REPLY, TRUNCATED_NOTICE, as_messages, split_text
+from .replies import REPLIES
+from .router import CommandRouter
+from .schedules import TAIPEI, twse_ttl
+from .shortlink import resolve_short_link
+from .singleton import LazySingleton
+from .views import (
+    CurrencyTransformAPI, LineBotCallbackAPI, LocalURLShortener, NewsAPI, StockAPI, StockTracker, TodoList,
+    WeatherAPI, WeatherIntegratedAPI, WeatherSnapshot, normalize_url,
+)
+
+
+class DatasetCacheAsyncTests(SimpleTestCase):
+
+    def test_concurrent_misses_share_one_fetch(self):
+        cache = DatasetCache('test')
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'value': 1}
+
+        async def scenario():
+            return await asyncio.gather(*(cache.aget_or_fetch('key', fetch, ttl=60) for _ in range(5)))
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'value': 1}] * 5)
+
+    def test_waiters_get_timeout_when_leader_cancelled(self):
+        cache = DatasetCache('test')
+        started = asyncio.Event()
+
+        async def slow_fetch():
+            started.set()
+            await asyncio.sleep(10)
+            return {'value': 1}
+
+        async def scenario():
+            leader = asyncio.create_task(cache.aget_or_fetch('key', slow_fetch, ttl=60))
+            await started.wait()
+            follower = asyncio.create_task(cache.aget_or_fetch('key', slow_fetch, ttl=60))
+            await asyncio.sleep(0)
+            leader.cancel()
+            results = await asyncio.gather(leader, follower, return_exceptions=True)
+            return results
+
+        leader_result, follower_result = asyncio.run(scenario())
+        self.assertIsInstance(leader_result, asyncio.CancelledError)
+        self.assertIsInstance(follower_result, requests.exceptions.Timeout)
+
+
+class DatasetCacheTests(SimpleTestCase):
+
+    def test_concurrent_misses_share_one_fetch(self):
+        cache = DatasetCache('test')
+        calls = []
+        release = threading.Event()
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return {'value': 1}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_fetch('key', fetch, ttl=60)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'value': 1}] * 8)
+
+    def test_error_messages_are_not_cached(self):
+        cache = DatasetCache('test')
+        results = iter(["請求超時", {'value': 1}])
+
+        self.assertEqual(cache.get_or_fetch('key', lambda: next(results), ttl=60), "請求超時")
+        self.assertEqual(cache.get_or_fetch('key', lambda: next(results), ttl=60), {'value': 1})
+        self.assertEqual(cache.get('key'), {'value': 1})
+
+    def test_stale_refresh_runs_outside_the_io_pool(self):
+        cache = DatasetCache('test')
+        cache.set('key', 'old', ttl=0.01, stale_ttl=60)
+        time.sleep(0.02)
+        refreshed = threading.Event()
+        thread_names = []
+
+        def fetch():
+            thread_names.append(threading.current_thread().name)
+            refreshed.set()
+            return {'value': 'new'}
+
+        self.assertEqual(cache.get_or_fetch('key', fetch, ttl=60, cacheable=lambda value: True), 'old')
+        self.assertTrue(refreshed.wait(5))
+        self.assertTrue(thread_names[0].startswith("linebot-background"))
+
+    def test_unrelated_keys_do_not_wait_for_each_other(self):
+        cache = DatasetCache('test')
+        started, release = threading.Event(), threading.Event()
+
+        def slow_fetch():
+            started.set()
+            release.wait(5)
+            return {'value': 'a'}
+
+        thread = threading.Thread(target=cache.get_or_fetch, args=('a', slow_fetch, 60))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        try:
+            # 不論 key 的雜湊值為何 其他 key 都不需要等待 'a' 下載完成
+            for index in range(128):
+                self.assertEqual(cache.get_or_fetch(f'b{index}', lambda: {'value': 'b'}, ttl=60), {'value': 'b'})
+        finally:
+            release.set()
+            thread.join(5)
+        self.assertEqual(cache.get('a'), {'value': 'a'})
+
+    def test_waiters_get_the_leader_exception(self):
+        cache = DatasetCache('test')
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def failing_fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            raise requests.exceptions.ConnectionError("boom")
+
+        errors = []
+
+        def call():
+            try:
+                cache.get_or_fetch('key', failing_fetch, ttl=60)
+            except requests.exceptions.ConnectionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        threads[0].start()
+        self.assertTrue(started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(errors), 4)
+        self.assertIsNone(cache.get('key'))
+
+
+def split_bytes(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+class IterJsonArrayTests(SimpleTestCase):
+
+    body = '\ufeff[ {"Code": "2330", "Name": "台積電"}, 12345 , "a,b]" ,[1, 2], null ]'.encode('utf-8')
+
+    def test_any_chunk_size_gives_the_same_items(self):
+        expected = [{"Code": "2330", "Name": "台積電"}, 12345, "a,b]", [1, 2], None]
+        for size in range(1, len(self.body) + 1):
+            with self.subTest(size=size):
+                self.assertEqual(list(iter_json_array(split_bytes(self.body, size))), expected)
+
+    def test_number_split_across_chunks(self):
+        self.assertEqual(list(iter_json_array([b'[12', b'345', b']'])), [12345])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array([b' [ ', b' ] '])), [])
+
+    def test_malformed_arrays(self):
+        for body in (b'[1 2]', b'[,1]', b'[1,,2]', b'[1,]', b'[1', b'[1,', b'', b'{"a": 1}', b'[{"a": 1]'):
+            for size in (1, 3, len(body) or 1):
+                with self.subTest(body=body, size=size), self.assertRaises(ValueError):
+                    list(iter_json_array(split_bytes(body, size)))
+
+
+class StockAPIRequestTests(SimpleTestCase):
+
+    def test_streamed_response_closed_on_http_error(self):
+        api = StockAPI()
+        response = mock.Mock()
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError("503")
+        with mock.patch('urlbot.views.get_http_client') as get_http_client:
+            get_http_client.return_value.get.return_value = response
+            result = api._download(api.url_STOCK_DAY_ALL, api.daily_fields)
+
+        self.assertTrue(result.startswith("請求錯誤"))
+        response.close.assert_called_once()
+
+
+class StockIndexCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        reset_dataset_caches()
+        self.addCleanup(reset_dataset_caches)
+
+    def fetch_index(self, basic, daily):
+        api = StockAPI()
+        with mock.patch.object(api, '_fetch_datasets', return_value={'BWIBBU_ALL': basic, 'STOCK_DAY_ALL': daily}):
+            return api.get_stock_index()
+
+    def test_empty_datasets_are_not_cached(self):
+        index = self.fetch_index(Columns(StockAPI.basic_fields), Columns(StockAPI.daily_fields))
+
+        self.assertIsInstance(index, str)
+        self.assertIsNone(get_dataset_cache('twse').get('STOCK_INDEX'))
+
+    def test_one_empty_dataset_is_partial(self):
+        daily = read_columns([{'Code': '2330', 'Name': '台積電', 'ClosingPrice': '605', 'Change': '2'}], StockAPI.daily_fields)
+        index = self.fetch_index(Columns(StockAPI.basic_fields), daily)
+
+        self.assertEqual(index.missing, ('BWIBBU_ALL',))
+        self.assertEqual(len(index), 1)
+
+
+def make_store(rows):
+    """以 (代碼, 收盤價, 漲跌) 建立測試用的全市場資料"""
+    daily = read_columns(
+        [{'Code': code, 'Name': code, 'ClosingPrice': str(price), 'Change': str(change)} for code, price, change in rows],
+        ('Code', 'Name', 'ClosingPrice', 'Change'),
+    )
+    return MarketDataStore.from_columns(read_columns([], ('Code',)), daily)
+
+
+class MarketDataStoreTests(SimpleTestCase):
+
+    def test_top_by_sign_excludes_the_other_direction(self):
+        store = make_store([('1101', 105, 5), ('1102', 99, -1), ('1103', 100, 0), ('1104', 98, 2)])
+
+        self.assertEqual([record.code for record in store.top('change_percent', 5, sign=1)], ['1101', '1104'])
+        self.assertEqual([record.code for record in store.top('change_percent', 5, ascending=True, sign=-1)], ['1102'])
+
+    def test_top_without_sign_keeps_all_rows(self):
+        store = make_store([('1101', 105, 5), ('1102', 99, -1)])
+
+        self.assertEqual([record.code for record in store.top('change_percent', 5, ascending=True)], ['1102', '1101'])
+
+
+class NormalizeUrlTests(SimpleTestCase):
+
+    def test_same_page_written_differently(self):
+        self.assertEqual(normalize_url("HTTPS://Example.COM:443"), "https://example.com/")
+        self.assertEqual(normalize_url("http://example.com:80/a?q=1"), "http://example.com/a?q=1")
+
+    def test_fragment_is_kept(self):
+        self.assertEqual(normalize_url("https://example.com/page#b"), "https://example.com/page#b")
+        self.assertNotEqual(normalize_url("https://example.com/page#a"), normalize_url("https://example.com/page#b"))
+
+
+@override_settings(URL_SHORTENER={
+    'BACKEND': 'local', 'BASE_URL': 'https://example.com/s/', 'REDIRECT_CACHE_TTL': 60,
+    'HIT_FLUSH_SIZE': 100, 'HIT_FLUSH_INTERVAL': 30,
+})
+class LocalURLShortenerTests(TestCase):
+
+    def setUp(self):
+        reset_dataset_caches()
+        self.addCleanup(reset_dataset_caches)
+
+    def resolve(self, short_url):
+        return resolve_short_link(short_url.rsplit('/', 1)[-1])[1]
+
+    def test_same_page_shares_one_code(self):
+        shortener = LocalURLShortener()
+        first = shortener.get_shorten_url("https://Example.com/page")
+        second = shortener.get_shorten_url("https://example.com:443/page")
+
+        self.assertEqual(first, second)
+        self.assertEqual(ShortLink.objects.count(), 1)
+
+    def test_each_fragment_redirects_to_its_own_url(self):
+        shortener = LocalURLShortener()
+        first = shortener.get_shorten_url("https://example.com/page#a")
+        second = shortener.get_shorten_url("https://example.com/page#b")
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.resolve(first), "https://example.com/page#a")
+        self.assertEqual(self.resolve(second), "https://example.com/page#b")
+
+
+class WeatherIntegratedAPITests(SimpleTestCase):
+
+    forecast = "臺北市天氣預報\n\n今天白天（06:00-18:00）：\n"
+    current = "氣象站名稱:臺北\n氣溫:20\n"
+
+    def combine(self, forecast, current):
+        return WeatherIntegratedAPI()._combine_weather_info("臺北市", "臺北", forecast, current)
+
+    def test_both_available(self):
+        reply = self.combine(self.forecast, self.current)
+
+        self.assertIn("🔮 天氣預報\n" + self.forecast, reply)
+        self.assertIn(self.current, reply)
+
+    def test_forecast_timeout_is_not_rendered(self):
+        reply = self.combine("請求超時", self.current)
+
+        self.assertNotIn("請求超時", reply)
+        self.assertIn("天氣預報暫時無法取得", reply)
+        self.assertIn(self.current, reply)
+
+    def test_both_failed_gives_one_degraded_reply(self):
+        reply = self.combine("請求錯誤: 503", "請求超時")
+
+        self.assertEqual(reply, "⚠️ 臺北市 的天氣資料暫時無法取得 請稍後再試")
+
+
+class UsageReplyTests(SimpleTestCase):
+
+    def test_todo_usage_comes_from_the_catalogue(self):
+        self.assertIs(TodoList().handle_command("不存在", [], "user"), REPLIES.message('todo_command_usage'))
+        self.assertIs(TodoList().handle_command("新增", [], "user"), REPLIES.message('todo_command_usage'))
+
+    def test_stock_tracker_usage_comes_from_the_catalogue(self):
+        tracker = StockTracker(StockAPI())
+
+        self.assertIs(tracker.handle_command("新增", [], "user"), REPLIES.message('stock_tracker_usage'))
+        self.assertIs(tracker.handle_command("暫停", ["2330"], "user"), REPLIES.message('stock_tracker_usage'))
+
+
+class LazySingletonTests(SimpleTestCase):
+
+    def test_created_once_across_threads(self):
+        created = []
+
+        def factory():
+            time.sleep(0.01)
+            created.append(object())
+            return created[-1]
+
+        singleton = LazySingleton(factory)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(singleton.get())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(created), 1)
+        self.assertTrue(all(result is created[0] for result in results))
+
+    def test_reset_closes_and_recreates(self):
+        singleton = LazySingleton(mock.Mock, close='shutdown')
+        first = singleton.get()
+        singleton.reset()
+
+        first.shutdown.assert_called_once_with()
+        self.assertIsNot(singleton.get(), first)
+
+    def test_reset_before_get_does_nothing(self):
+        factory = mock.Mock()
+        LazySingleton(factory, close='shutdown').reset()
+
+        factory.assert_not_called()
+
+
+class CommandRouterTests(SimpleTestCase):
+
+    router = LineBotCallbackAPI.router
+
+    def resolve(self, text):
+        route, args = self.router.resolve(text)
+        return route.handler, route.bound, args
+
+    def test_command_with_arguments(self):
+        self.assertEqual(self.resolve("股票 2330 2317"), ('_handle_stock', (), ['2330', '2317']))
+
+    def test_longest_path_wins(self):
+        self.assertEqual(self.resolve("股票 漲幅 10"), ('_handle_stock_ranking', ('漲幅',), ['10']))
+        self.assertEqual(self.resolve("股票 追蹤 新增 2330"), ('_handle_stock_tracker', ('新增',), ['2330']))
+
+    def test_aliases_case_and_full_width_space(self):
+        self.assertEqual(self.resolve("待辦 新增 運動"), self.resolve("todo 新增 運動"))
+        self.assertEqual(self.resolve("TODO　列表"), self.resolve("todo 列表"))
+        self.assertEqual(self.resolve("股票 追蹤 移除 2330"), ('_handle_stock_tracker', ('刪除',), ['2330']))
+
+    def test_user_routes(self):
+        self.assertTrue(self.router.resolve("todo 新增 運動")[0].needs_user)
+        self.assertTrue(self.router.resolve("股票 追蹤")[0].needs_user)
+        self.assertFalse(self.router.resolve("股票 2330")[0].needs_user)
+
+    def test_unknown_message(self):
+        self.assertIsNone(self.router.resolve("你好"))
+        self.assertIsNone(self.router.resolve("   "))
+        self.assertIsNone(self.router.resolve("todo新增"))
+
+    def test_invoke_passes_bound_values_and_user(self):
+        owner = mock.Mock()
+        route, args = CommandRouter({"a b": ("handler", "x")}, user_routes=("a",)).resolve("a b 1")
+        route.invoke(owner, args, "user")
+
+        owner.handler.assert_called_once_with("x", ["1"], "user")
+
+    def test_alias_to_missing_route(self):
+        with self.assertRaises(ValueError):
+            CommandRouter({"todo": "handler"}, aliases={"待辦": "不存在"})
+
+
+class RenderingTests(SimpleTestCase):
+
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(split_text("abc\n", limit=10), ["abc\n"])
+
+    def test_split_by_line_within_limit(self):
+        text = "".join(f"line {i}\n" for i in range(50))
+        chunks = split_text(text, limit=40)
+
+        self.assertEqual("".join(chunks), text)
+        self.assertTrue(all(len(chunk) <= 40 for chunk in chunks))
+        self.assertTrue(all(chunk.endswith("\n") for chunk in chunks))
+
+    def test_long_line_is_cut(self):
+        chunks = split_text("x" * 25, limit=10)
+
+        self.assertEqual(chunks, ["x" * 10, "x" * 10, "x" * 5])
+
+    def test_surrogate_pairs_count_as_two_units(self):
+        chunks = split_text("😀" * 6, limit=5)
+
+        self.assertEqual("".join(chunks), "😀" * 6)
+        self.assertTrue(all(len(chunk.encode('utf-16-le')) // 2 <= 5 for chunk in chunks))
+
+    def test_prebuilt_messages_pass_through(self):
+        message = REPLIES.message('help')
+
+        self.assertEqual(as_messages(message), [message])
+
+    def test_text_becomes_messages(self):
+        messages = as_messages("a\nb\n", limit=2)
+
+        self.assertEqual([message.text for message in messages], ["a\n", "b\n"])
+        self.assertTrue(all(isinstance(message, TextSendMessage) for message in messages))
+
+    def test_too_many_chunks_truncated(self):
+        limit = len(TRUNCATED_NOTICE) + 10
+        messages = as_messages("".join(f"{i:08d}\n" for i in range(100)), limit=limit)
+
+        self.assertEqual(len(messages), LINE_MESSAGES_PER_REPLY)
+        self.assertTrue(messages[-1].text.endswith(TRUNCATED_NOTICE))
+        self.assertTrue(all(len(message.text) <= limit for message in messages))
+
+
+class TodoListBulkTests(TestCase):
+
+    def setUp(self):
+        self.todo = TodoList()
+
+    def titles(self, user_id="user"):
+        return dict(Todolist.objects.filter(user_id=user_id).values_list('title', 'status'))
+
+    def test_create_skips_duplicates_and_existing(self):
+        self.todo.handle_command("新增", ["運動"], "user")
+        reply = self.todo.handle_command("新增", ["讀書", "運動", "讀書"], "user")
+
+        self.assertEqual(reply, "成功新增: 讀書\n已存在 略過: 運動\n")
+        self.assertEqual(self.titles(), {"運動": "pending", "讀書": "pending"})
+
+    def test_create_over_limit(self):
+        titles = [str(i) for i in range(TodoList.batch_max + 2)]
+        reply = self.todo.handle_command("新增", titles, "user")
+
+        self.assertEqual(len(self.titles()), TodoList.batch_max)
+        self.assertIn(f"一次最多處理 {TodoList.batch_max} 項 已略過: 20、21", reply)
+
+    def test_delete_reports_missing(self):
+        self.todo.handle_command("新增", ["a", "b", "c"], "user")
+        reply = self.todo.handle_command("刪除", ["a", "x", "c"], "user")
+
+        self.assertEqual(reply, "成功刪除: a、c\n當前事項不存在: x\n")
+        self.assertEqual(self.titles(), {"b": "pending"})
+
+    def test_delete_all_only_touches_the_user(self):
+        self.todo.handle_command("新增", ["a"], "user")
+        self.todo.handle_command("新增", ["a"], "other")
+        self.todo.handle_command("刪除", ["全部"], "user")
+
+        self.assertEqual(self.titles(), {})
+        self.assertEqual(self.titles("other"), {"a": "pending"})
+
+    def test_complete_and_update_many(self):
+        self.todo.handle_command("新增", ["a", "b", "c"], "user")
+        reply = self.todo.handle_command("完成", ["a", "b", "x"], "user")
+
+        self.assertEqual(reply, "已修改為 completed: a、b\n找不到該待辦事項: x\n")
+        reply = self.todo.handle_command("修改", ["a", "c", "completed"], "user")
+
+        self.assertEqual(reply, "已修改為 completed: c\n已是 completed 略過: a\n")
+        self.assertEqual(self.titles(), {"a": "completed", "b": "completed", "c": "completed"})
+
+    def test_update_rejects_invalid_status(self):
+        self.todo.handle_command("新增", ["a"], "user")
+
+        self.assertEqual(self.todo.handle_command("修改", ["a", "done"], "user"), "無效的狀態修改,請使用 completed 或是 pending")
+        self.assertEqual(self.titles(), {"a": "pending"})
+
+
+SHARED_LOCMEM = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-shared'},
+}
+
+
+class PrefetchScheduleTests(SimpleTestCase):
+
+    def simulate(self, job, start, end):
+        """依排程執行工作 回傳 [(執行時間, 快取到期時間)]"""
+        schedule = build_schedule(settings.PREFETCH['JOBS'][job])
+        runs, now = [], start
+        with mock.patch('urlbot.schedules.taipei_now') as taipei_now:
+            while now < end:
+                taipei_now.return_value = now
+                runs.append((now, now + timedelta(seconds=twse_ttl(now))))
+                now += timedelta(seconds=schedule())
+        return runs
+
+    def test_twse_cache_never_goes_cold_across_a_trading_day(self):
+        # 週日 00:00 到週二 00:00 (週一為交易日)
+        runs = self.simulate('twse_stock_index', datetime(2026, 10, 18, tzinfo=TAIPEI), datetime(2026, 10, 20, tzinfo=TAIPEI))
+
+        for (_, expires_at), (next_run, _) in zip(runs, runs[1:]):
+            self.assertLessEqual(next_run, expires_at)
+        publish_runs = [run for run, _ in runs if run.day == 19 and 14 <= run.hour < 18]
+        self.assertGreaterEqual(len(publish_runs), 4 * 60 // 15)
+        self.assertLess(len(runs), 60)
+
+    @override_settings(PREFETCH={'THREAD': True}, DATASET_CACHE={'SHARED_BACKEND': 'shared'})
+    def test_thread_not_started_with_shared_cache(self):
+        with mock.patch('urlbot.prefetch.get_prefetch_scheduler') as get_scheduler:
+            self.assertFalse(start_prefetch_thread())
+        get_scheduler.assert_not_called()
+
+
+@override_settings(CACHES=SHARED_LOCMEM)
+class SharedRefreshTests(SimpleTestCase):
+
+    def test_refresh_waits_for_the_worker_holding_the_shared_lock(self):
+        worker_a, worker_b = DatasetCache('test', shared_alias='shared'), DatasetCache('test', shared_alias='shared')
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_fetch():
+            calls.append('a')
+            started.set()
+            release.wait(5)
+            return {'value': 'a'}
+
+        thread = threading.Thread(target=worker_a.refresh, args=('key', slow_fetch, 60))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        threading.Timer(0.05, release.set).start()
+        result = worker_b.refresh('key', lambda: calls.append('b') or {'value': 'b'}, 60)
+        thread.join(5)
+
+        self.assertEqual(calls, ['a'])
+        self.assertEqual(result, {'value': 'a'})
+
+
+class FileBasedSharedLockTests(SimpleTestCase):
+    """FileBasedCache 的 add() 不是原子操作 跨 process 的鎖改用 O_EXCL 鎖檔"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name},
+        }))
+
+    def test_lock_file_is_exclusive(self):
+        worker_a, worker_b = DatasetCache('test', shared_alias='shared'), DatasetCache('test', shared_alias='shared')
+        token = worker_a._acquire_shared_lock('key')
+        self.assertIsNotNone(token)
+        self.assertIsNone(worker_b._acquire_shared_lock('key'))
+        self.assertTrue(worker_b._shared_lock_held('key'))
+
+        worker_a._release_shared_lock('key', token)
+        self.assertFalse(worker_b._shared_lock_held('key'))
+        self.assertIsNotNone(worker_b._acquire_shared_lock('key'))
+
+    def test_expired_lock_is_taken_over_and_not_released_by_its_old_holder(self):
+        worker_a = DatasetCache('test', shared_alias='shared', lock_timeout=30)
+        worker_b = DatasetCache('test', shared_alias='shared', lock_timeout=30)
+        stale_token = worker_a._acquire_shared_lock('key')
+        path = worker_a._lock_file('key')
+        os.utime(path, (time.time() - 60, time.time() - 60))
+
+        token = worker_b._acquire_shared_lock('key')
+        self.assertIsNotNone(token)
+        worker_a._release_shared_lock('key', stale_token)
+        self.assertTrue(os.path.exists(path))
+        worker_b._release_shared_lock('key', token)
+        self.assertFalse(os.path.exists(path))
+
+    def test_workers_share_one_fetch(self):
+        workers = [DatasetCache('test', shared_alias='shared') for _ in range(6)]
+        calls = []
+        barrier = threading.Barrier(len(workers))
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'value': 1}
+
+        def call(worker):
+            barrier.wait(5)
+            results.append(worker.get_or_fetch('key', fetch, ttl=60))
+
+        results = []
+        threads = [threading.Thread(target=call, args=(worker,)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'value': 1}] * len(workers))
+
+
+@override_settings(CACHES=SHARED_LOCMEM)
+class DatasetCacheSharedAsyncTests(SimpleTestCase):
+
+    def test_shared_layer_io_runs_off_the_event_loop(self):
+        cache = DatasetCache('test', shared_alias='shared')
+        threads = []
+        for name in ('get', 'set'):
+            method = getattr(cache.shared, name)
+            setattr(cache.shared, name, mock.Mock(side_effect=lambda *args, method=method, **kwargs: (
+                threads.append(threading.get_ident()) or method(*args, **kwargs))))
+
+        async def fetch():
+            return {'value': 1}
+
+        async def scenario():
+            return await cache.aget_or_fetch('key', fetch, ttl=60), threading.get_ident()
+
+        result, loop_thread = asyncio.run(scenario())
+        self.assertEqual(result, {'value': 1})
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+        self.assertEqual(cache.shared.get(cache._shared_key('key'))[2], {'value': 1})
+
+
+class AsyncStockAPITests(SimpleTestCase):
+
+    def setUp(self):
+        self.store = make_store([('1101', 105, 5), ('2330', 600, -10)])
+
+    def test_download_parses_off_the_event_loop(self):
+        api = AsyncStockAPI()
+        response = SimpleNamespace(content='[{"Code": "2330", "Name": "台積電", "PEratio": "20"}]'.encode('utf-8'))
+        threads = []
+        parse_columns = api._parse_columns
+
+        def record_thread(*args):
+            threads.append(threading.get_ident())
+            return parse_columns(*args)
+
+        async def scenario():
+            with mock.patch.object(api, '_make_request', mock.AsyncMock(return_value=response)), \
+                    mock.patch.object(api, '_parse_columns', record_thread):
+                return await api._download(api.url_BWIBBU_ALL, ('Code', 'PEratio')), threading.get_ident()
+
+        columns, loop_thread = asyncio.run(scenario())
+        self.assertEqual(columns, {'Code': ['2330'], 'PEratio': ['20']})
+        self.assertNotIn(loop_thread, threads)
+
+    def test_download_returns_parse_errors_as_messages(self):
+        api = AsyncStockAPI()
+        response = SimpleNamespace(content=b'{"not": "an array"}')
+        with mock.patch.object(api, '_make_request', mock.AsyncMock(return_value=response)):
+            result = asyncio.run(api._download(api.url_BWIBBU_ALL, ('Code',)))
+        self.assertTrue(result.startswith("解析資料錯誤"))
+
+    def test_replies_match_the_sync_service(self):
+        sync_api, async_api = StockAPI(), AsyncStockAPI()
+        with mock.patch.object(sync_api, 'get_stock_index', return_value=self.store), \
+                mock.patch.object(async_api, 'get_stock_index', mock.AsyncMock(return_value=self.store)):
+            for code in ('2330', '9999'):
+                with self.subTest(code=code):
+                    self.assertEqual(asyncio.run(async_api.get_stock_full_info(code)), sync_api.get_stock_full_info(code))
+            self.assertEqual(asyncio.run(async_api.get_MI_INDEX20()), sync_api.get_MI_INDEX20())
+
+    def test_daily_ranking_falls_back_to_MI_INDEX20_without_trading_data(self):
+        api = AsyncStockAPI()
+        dataset = [{
+            'Rank': '1', 'Name': '台積電', 'Code': '2330', 'TradeVolume': '1000', 'Transaction': '10',
+            'ClosingPrice': '600', 'Dir': '+', 'Change': '5', 'HighestPrice': '601', 'LowestPrice': '590',
+        }]
+        with mock.patch.object(api, 'get_stock_index', mock.AsyncMock(return_value="請求超時")), \
+                mock.patch.object(api, 'get_dataset', mock.AsyncMock(return_value=dataset)) as get_dataset:
+            result = asyncio.run(api.get_MI_INDEX20())
+
+        get_dataset.assert_awaited_once_with(api.url_MI_INDEX20)
+        self.assertEqual(result, api._format_MI_INDEX20(dataset))
+
+
+class AsyncLineBotCallbackViewTests(TestCase):
+
+    def setUp(self):
+        self.store = make_store([('1101', 105, 5), ('2330', 600, -10)])
+        stock = AsyncStockAPI()
+        self.get_stock_index = self.enterContext(
+            mock.patch.object(stock, 'get_stock_index', mock.AsyncMock(return_value=self.store)))
+        self.registry = SimpleNamespace(
+            line_bot_api=mock.Mock(reply_message=mock.AsyncMock()), parser=mock.Mock(),
+            shortener=None, currency_transform=None, news=None, weather=None,
+            stock=stock, todolist=TodoList(), stock_tracker=StockTracker(stock),
+        )
+        self.enterContext(mock.patch('urlbot.async_views.get_async_registry', return_value=self.registry))
+
+    def post(self, *texts):
+        """送出一批訊息事件 回傳 {reply_token: 回覆的訊息}"""
+        self.registry.parser.parse.return_value = [
+            MessageEvent(reply_token=f"token{i}", source=SourceUser(user_id="user"), message=TextMessage(text=text))
+            for i, text in enumerate(texts)
+        ]
+        self.registry.line_bot_api.reply_message.reset_mock()
+        request = RequestFactory().post('/callback', data='{}', content_type='application/json', HTTP_X_LINE_SIGNATURE='signature')
+        response = async_to_sync(AsyncLineBotCallbackView.as_view())(request)
+        self.assertEqual(response.status_code, 200)
+        return {call.args[0]: call.args[1] for call in self.registry.line_bot_api.reply_message.await_args_list}
+
+    def test_stock_tracker_add_and_list(self):
+        self.assertEqual(self.post("股票 追蹤 新增 1101 9999"), {"token0": as_messages("找不到股票代碼: 9999")})
+        self.assertEqual(self.post("股票 追蹤 新增 1101"), {"token0": as_messages("成功追蹤 1101")})
+        self.assertEqual(self.post("股票 追蹤"), {"token0": as_messages(StockAPI().format_stocks_summary(self.store, ["1101"]))})
+
+    def test_usage_and_remove_do_not_download_the_index(self):
+        replies = self.post("股票 追蹤 暫停 1101", "股票 追蹤 刪除 1101")
+
+        self.assertEqual(replies, {
+            "token0": as_messages(REPLIES.message('stock_tracker_usage')),
+            "token1": as_messages("追蹤清單中沒有這些股票"),
+        })
+        self.get_stock_index.assert_not_awaited()
+
+    def test_every_event_in_a_batch_gets_its_reply(self):
+        replies = self.post("股票 2330", "股票 成交量 1", "不存在的指令")
+
+        self.assertEqual(replies, {
+            "token0": as_messages(StockAPI()._format_stock_full_info(self.store, "2330")),
+            "token1": as_messages(StockAPI()._format_ranking(self.store, "成交量", 1)),
+            "token2": as_messages(REPLIES.message('help')),
+        })
+
+
+class HttpClientCoalesceTests(SimpleTestCase):
+    url = "https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_ALL"
+
+    def setUp(self):
+        self.client = HttpClient(retries=0)
+        self.addCleanup(self.client.close)
+        self.calls = []
+        self.started, self.release = threading.Event(), threading.Event()
+
+    def blocking_request(self, error=None):
+        """在 release 之前不回應的上游 回傳記錄每次呼叫的 side_effect"""
+        def request(method, url, **kwargs):
+            self.calls.append((method, kwargs.get('params')))
+            self.started.set()
+            self.release.wait(5)
+            if error is not None:
+                raise error
+            return mock.Mock(status_code=200, params=kwargs.get('params'))
+        return request
+
+    def run_concurrently(self, *calls):
+        """第一個呼叫進入上游後再啟動其他呼叫 回傳每個呼叫的結果或例外"""
+        results = [None] * len(calls)
+
+        def run(index, call):
+            try:
+                results[index] = call()
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(index, call)) for index, call in enumerate(calls)]
+        threads[0].start()
+        self.assertTrue(self.started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_identical_gets_share_one_upstream_call(self):
+        with mock.patch('requests.Session.request', side_effect=self.blocking_request()):
+            results = self.run_concurrently(*[lambda: self.client.get(self.url)] * 5)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(self.client.stats()['openapi.twse.com.tw']['coalesced'], 4)
+
+    def test_waiters_get_the_leader_exception(self):
+        error = requests.exceptions.ConnectionError("boom")
+        with mock.patch('requests.Session.request', side_effect=self.blocking_request(error)):
+            results = self.run_concurrently(*[lambda: self.client.get(self.url)] * 3)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(results, [error] * 3)
+
+    def test_stream_and_post_are_not_coalesced(self):
+        calls = {
+            'stream': lambda: self.client.get(self.url, stream=True),
+            'post': lambda: self.client.post(self.url),
+        }
+        for name, call in calls.items():
+            with self.subTest(name):
+                self.calls.clear()
+                self.started.clear()
+                self.release.clear()
+                with mock.patch('requests.Session.request', side_effect=self.blocking_request()):
+                    results = self.run_concurrently(call, call)
+
+                self.assertEqual(len(self.calls), 2)
+                self.assertIsNot(results[0], results[1])
+
+    def test_different_params_are_not_merged(self):
+        with mock.patch('requests.Session.request', side_effect=self.blocking_request()):
+            results = self.run_concurrently(
+                lambda: self.client.get(self.url, params={'q': 'a'}),
+                lambda: self.client.get(self.url, params={'q': 'b'}),
+            )
+
+        self.assertEqual(sorted(params['q'] for _, params in self.calls), ['a', 'b'])
+        self.assertEqual([result.params for result in results], [{'q': 'a'}, {'q': 'b'}])
+
+
+class AsyncHttpClientCoalesceTests(SimpleTestCase):
+    url = "https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_ALL"
+
+    def setUp(self):
+        self.client = AsyncHttpClient(retries=0)
+        self.calls = []
+
+    def run_concurrently(self, *calls, error=None):
+        """以 gather 同時執行 上游回應前所有呼叫都已開始等待"""
+        async def send(method, url, timeout, **kwargs):
+            self.calls.append((method, kwargs.get('params')))
+            await asyncio.sleep(0.01)
+            if error is not None:
+                raise error
+            return AsyncResponse(url, 200, {}, json.dumps(kwargs.get('params')).encode())
+
+        async def scenario():
+            with mock.patch.object(self.client, '_send', send):
+                return await asyncio.gather(*(call() for call in calls), return_exceptions=True)
+
+        return asyncio.run(scenario())
+
+    def test_identical_gets_share_one_upstream_call(self):
+        results = self.run_concurrently(*[lambda: self.client.get(self.url)] * 5)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(self.client.stats()['openapi.twse.com.tw']['coalesced'], 4)
+
+    def test_waiters_get_the_leader_exception(self):
+        results = self.run_concurrently(*[lambda: self.client.get(self.url)] * 3, error=aiohttp.ClientConnectionError("boom"))
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertIsInstance(results[0], requests.exceptions.ConnectionError)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_stream_and_post_are_not_coalesced(self):
+        calls = {
+            'stream': lambda: self.client.get(self.url, stream=True),
+            'post': lambda: self.client.post(self.url),
+        }
+        for name, call in calls.items():
+            with self.subTest(name):
+                self.calls.clear()
+                results = self.run_concurrently(call, call)
+
+                self.assertEqual(len(self.calls), 2)
+                self.assertIsNot(results[0], results[1])
+
+    def test_different_params_are_not_merged(self):
+        results = self.run_concurrently(
+            lambda: self.client.get(self.url, params={'q': 'a'}),
+            lambda: self.client.get(self.url, params={'q': 'b'}),
+        )
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual([result.json() for result in results], [{'q': 'a'}, {'q': 'b'}])
+
+
+class EventDispatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.handled = []
+        self.lock = threading.Lock()
+
+    def handle(self, name):
+        with self.lock:
+            self.handled.append((name, threading.current_thread().name))
+
+    def blocking(self, name):
+        self.release.wait(5)
+        self.handle(name)
+
+    def saturated(self, **kwargs):
+        """一個背景執行緒卡在工作中 佇列 (上限 1) 也已排滿的處理池"""
+        dispatcher = EventDispatcher(workers=1, queue_size=1, **kwargs)
+        self.addCleanup(dispatcher.shutdown, 5)
+        self.addCleanup(self.release.set)
+        started = threading.Event()
+        dispatcher.submit(lambda: (started.set(), self.blocking('running')))
+        self.assertTrue(started.wait(5))
+        dispatcher.submit(self.blocking, 'queued')
+        return dispatcher
+
+    def thread_of(self, name):
+        return dict(self.handled)[name]
+
+    def test_inline_policy_runs_in_the_caller_thread(self):
+        dispatcher = self.saturated(overflow_policy='inline')
+
+        self.assertTrue(dispatcher.submit(self.handle, 'overflow'))
+        self.assertEqual(self.thread_of('overflow'), threading.current_thread().name)
+
+    def test_drop_policy_discards_the_event(self):
+        dispatcher = self.saturated(overflow_policy='drop')
+
+        with self.assertLogs('urlbot.dispatcher', 'WARNING'):
+            self.assertFalse(dispatcher.submit(self.handle, 'overflow'))
+        self.release.set()
+        dispatcher.shutdown(5)
+        self.assertEqual(sorted(name for name, _ in self.handled), ['queued', 'running'])
+
+    def test_block_policy_waits_for_a_free_slot(self):
+        dispatcher = self.saturated(overflow_policy='block', put_timeout=5)
+        threading.Timer(0.05, self.release.set).start()
+
+        self.assertTrue(dispatcher.submit(self.handle, 'overflow'))
+        dispatcher.shutdown(5)
+        self.assertTrue(self.thread_of('overflow').startswith("linebot-worker"))
+
+    def test_block_policy_falls_back_to_inline_after_put_timeout(self):
+        dispatcher = self.saturated(overflow_policy='block', put_timeout=0.05)
+
+        self.assertTrue(dispatcher.submit(self.handle, 'overflow'))
+        self.assertEqual(self.thread_of('overflow'), threading.current_thread().name)
+
+    def test_shutdown_drains_the_queue(self):
+        dispatcher = EventDispatcher(workers=2, queue_size=100)
+        for index in range(20):
+            dispatcher.submit(self.blocking, index)
+        self.release.set()
+        dispatcher.shutdown(5)
+
+        self.assertEqual(sorted(name for name, _ in self.handled), list(range(20)))
+        self.assertTrue(all(thread.startswith("linebot-worker") for _, thread in self.handled))
+
+    def test_submit_after_shutdown_runs_inline_without_restarting_workers(self):
+        dispatcher = EventDispatcher(workers=2)
+        dispatcher.start()
+        dispatcher.shutdown(5)
+        dispatcher.start()
+
+        self.assertTrue(dispatcher.submit(self.handle, 'late'))
+        self.assertEqual(self.thread_of('late'), threading.current_thread().name)
+        self.assertEqual(dispatcher._threads, [])
+
+    def test_no_event_is_lost_when_shutdown_races_submit(self):
+        dispatcher = EventDispatcher(workers=2, queue_size=1000)
+        self.release.set()
+
+        def submit_many(prefix):
+            for index in range(200):
+                dispatcher.submit(self.handle, (prefix, index))
+
+        threads = [threading.Thread(target=submit_many, args=(prefix,)) for prefix in range(4)]
+        for thread in threads:
+            thread.start()
+        dispatcher.shutdown(5)
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(self.handled), 800)
+        self.assertEqual(dispatcher._threads, [])
+
+
+@override_settings(LINEBOT_EVENT_CONCURRENCY=2, LINEBOT_WEBHOOK_MODE='sync')
+class ProcessBatchTests(SimpleTestCase):
+
+    def setUp(self):
+        # 以測試的並行上限重新建立執行緒池
+        _batch_executor.reset()
+        self.addCleanup(_batch_executor.reset)
+        self.addCleanup(lambda: get_batch_executor().shutdown(wait=True))
+
+    def test_one_failing_event_does_not_stop_the_others(self):
+        handled = []
+
+        def handle(item):
+            if item == 2:
+                raise ValueError("boom")
+            handled.append(item)
+
+        with self.assertLogs('urlbot.dispatcher', 'ERROR'):
+            process_batch(handle, list(range(5)))
+
+        self.assertEqual(sorted(handled), [0, 1, 3, 4])
+
+    def test_concurrency_is_capped(self):
+        lock = threading.Lock()
+        active, peak = [0], [0]
+
+        def handle(item):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+        process_batch(handle, list(range(8)))
+
+        self.assertEqual(peak[0], 2)
+
+    def test_webhook_replies_to_every_event_that_did_not_fail(self):
+        registry = SimpleNamespace(
+            line_bot_api=mock.Mock(), parser=mock.Mock(), shortener=None, currency_transform=None,
+            news=None, stock=None, weather=None, todolist=None, stock_tracker=None,
+        )
+        registry.parser.parse.return_value = [
+            MessageEvent(reply_token=f"token{i}", source=SourceUser(user_id="user"), message=TextMessage(text=text))
+            for i, text in enumerate(["a", "boom", "c"])
+        ]
+
+        def handle_message(view, event):
+            if event.message.text == "boom":
+                raise RuntimeError("boom")
+            return event.message.text
+
+        request = RequestFactory().post('/callback', data='{}', content_type='application/json', HTTP_X_LINE_SIGNATURE='signature')
+        with mock.patch('urlbot.views.get_registry', return_value=registry), \
+                mock.patch.object(LineBotCallbackAPI, '_handle_message', handle_message), \
+                self.assertLogs('urlbot.dispatcher', 'ERROR'):
+            response = LineBotCallbackAPI.as_view()(request)
+
+        self.assertEqual(response.status_code, 200)
+        replies = {call.args[0]: call.args[1] for call in registry.line_bot_api.reply_message.call_args_list}
+        self.assertEqual(replies, {"token0": as_messages("a"), "token2": as_messages("c")})
+
+
+TRACKED_CODES = [str(code) for code in range(1101, 1113)]
+
+
+class StockTrackerAddTests(TestCase):
+
+    def setUp(self):
+        self.stock = StockAPI()
+        self.tracker = StockTracker(self.stock)
+        self.index = make_store([(code, 100, 1) for code in TRACKED_CODES])
+
+    def tracked(self, user_id="user"):
+        return sorted(self.tracker.get_codes(user_id))
+
+    def test_unknown_codes_are_rejected(self):
+        self.assertEqual(self.tracker.add("user", ["1101", "9999", "8888"], self.index), "找不到股票代碼: 9999 8888")
+        self.assertEqual(self.tracked(), [])
+
+    def test_codes_are_not_checked_when_the_index_is_unavailable(self):
+        self.assertEqual(self.tracker.add("user", ["9999"], "請求超時"), "成功追蹤 9999")
+
+    def test_per_user_cap(self):
+        limit = self.stock.batch_max
+        self.assertEqual(self.tracker.add("user", TRACKED_CODES[:limit], self.index), f"成功追蹤 {' '.join(TRACKED_CODES[:limit])}")
+
+        self.assertEqual(
+            self.tracker.add("user", TRACKED_CODES[limit:], self.index), f"最多追蹤 {limit} 檔股票 目前已追蹤 {limit} 檔",
+        )
+        self.assertEqual(self.tracked(), sorted(TRACKED_CODES[:limit]))
+        # 上限以使用者計算 其他使用者不受影響
+        self.assertEqual(self.tracker.add("other", TRACKED_CODES[limit:], self.index), f"成功追蹤 {' '.join(TRACKED_CODES[limit:])}")
+
+    def test_already_tracked_codes_do_not_count_twice(self):
+        limit = self.stock.batch_max
+        self.tracker.add("user", TRACKED_CODES[:limit], self.index)
+
+        self.assertEqual(self.tracker.add("user", ["1101", "1101"], self.index), "股票已在追蹤清單中")
+        self.assertEqual(len(self.tracked()), limit)
+
+    def test_handle_command_uses_the_public_index(self):
+        with mock.patch.object(self.stock, 'get_stock_index', return_value=self.index) as get_stock_index:
+            self.assertEqual(self.tracker.handle_command("新增", ["1101"], "user"), "成功追蹤 1101")
+            self.assertEqual(self.tracker.handle_command(None, [], "user"), self.stock.format_stocks_summary(self.index, ["1101"]))
+        self.assertEqual(get_stock_index.call_count, 2)
+
+
+class PushStockDigestTests(TestCase):
+
+    def setUp(self):
+        self.stock = StockAPI()
+        self.index = make_store([("1101", 40, 1), ("2330", 600, -10)])
+        self.enterContext(mock.patch.object(self.stock, 'get_stock_index', return_value=self.index))
+        self.line_bot_api = mock.Mock()
+
+        # 1201 人只追蹤 1101 1 人追蹤 1101 與 2330
+        self.crowd = [f"user{i:04d}" for i in range(2 * MULTICAST_LIMIT + 201)]
+        StockWatchlist.objects.bulk_create([StockWatchlist(user_id=user_id, stock_code="1101") for user_id in self.crowd])
+        StockWatchlist.objects.create(user_id="investor", stock_code="2330")
+
+    def multicasts(self):
+        return [(call.args[0], call.args[1]) for call in self.line_bot_api.multicast.call_args_list]
+
+    def test_users_with_the_same_codes_share_one_message_in_batches_of_500(self):
+        stats = push_stock_digest(self.line_bot_api, self.stock)
+
+        self.assertEqual(stats, {'users': len(self.crowd) + 1, 'messages': 2, 'requests': 4, 'failed': 0})
+        crowd_calls = [(users, messages) for users, messages in self.multicasts() if users != ["investor"]]
+        self.assertEqual([len(users) for users, _ in crowd_calls], [MULTICAST_LIMIT, MULTICAST_LIMIT, 201])
+        self.assertEqual([user for users, _ in crowd_calls for user in users], self.crowd)
+        expected = as_messages("今日收盤追蹤摘要\n" + self.stock.format_stocks_summary(self.index, ["1101"]))
+        self.assertTrue(all(messages == expected for _, messages in crowd_calls))
+        self.line_bot_api.multicast.assert_any_call(
+            ["investor"], as_messages("今日收盤追蹤摘要\n" + self.stock.format_stocks_summary(self.index, ["2330"])),
+        )
+
+    def test_dry_run_counts_without_sending(self):
+        stats = push_stock_digest(self.line_bot_api, self.stock, dry_run=True)
+
+        self.assertEqual(stats, {'users': len(self.crowd) + 1, 'messages': 2, 'requests': 4, 'failed': 0})
+        self.line_bot_api.multicast.assert_not_called()
+
+    def test_failed_batches_are_counted_and_the_rest_still_sent(self):
+        def multicast(user_ids, messages):
+            if user_ids[0] == self.crowd[0]:
+                raise LineBotApiError(500, {}, error=Error(message="boom"))
+
+        self.line_bot_api.multicast.side_effect = multicast
+
+        with self.assertLogs('urlbot.digest', 'ERROR'):
+            stats = push_stock_digest(self.line_bot_api, self.stock)
+
+        self.assertEqual(self.line_bot_api.multicast.call_count, 4)
+        self.assertEqual(stats['failed'], MULTICAST_LIMIT)
+
+    def test_index_error_skips_the_push(self):
+        self.stock.get_stock_index.return_value = "請求超時"
+
+        self.assertEqual(push_stock_digest(self.line_bot_api, self.stock), {'error': "請求超時"})
+        self.line_bot_api.multicast.assert_not_called()
+
+
+def rate_response(**rates):
+    """以 {幣別代碼: 對美金匯率} 建立 rter.info 格式的回應"""
+    return mock.Mock(json=mock.Mock(return_value={f"USD{code}": {'Exrate': rate} for code, rate in rates.items()}))
+
+
+class CurrencyTransformAPITests(SimpleTestCase):
+
+    def setUp(self):
+        self.api = CurrencyTransformAPI()
+        reset_dataset_caches()
+        self.addCleanup(reset_dataset_caches)
+
+    def test_cross_rates_between_every_supported_currency(self):
+        matrix = self.api._handle_response(rate_response(USD=1, TWD=32, JPY=160, CNY=8, VND=25000, GBP=0.8, KRW=1600))
+
+        self.assertEqual(len(matrix), len(self.api.text) ** 2)
+        self.assertEqual(matrix[('USD', 'TWD')], 32.0)
+        self.assertEqual(matrix[('TWD', 'JPY')], 5.0)
+        self.assertEqual(matrix[('TWD', 'USD')], round(1 / 32, 4))
+        self.assertEqual(matrix[('GBP', 'KRW')], 2000.0)
+        self.assertTrue(all(matrix[(code, code)] == 1.0 for code in self.api.text.values()))
+        self.assertEqual(self.api._lookup_rate(matrix, "台幣", "日幣"), 5.0)
+
+    def test_missing_usd_entry_only_affects_that_currency(self):
+        matrix = self.api._handle_response(rate_response(TWD=32, JPY=160))
+
+        self.assertNotIn(('KRW', 'TWD'), matrix)
+        self.assertEqual(self.api._lookup_rate(matrix, "韓元", "台幣"), "暫時無法取得 韓元 兌 台幣 的匯率")
+        self.assertEqual(self.api._lookup_rate(matrix, "美金", "日幣"), 160.0)
+
+    def test_zero_rate_is_an_invalid_response(self):
+        result = self.api._handle_response(rate_response(TWD=32, VND=0))
+
+        self.assertIsInstance(result, str)
+        self.assertTrue(result.startswith("無效響應格式"))
+        self.assertEqual(self.api._lookup_rate(result, "台幣", "越南盾"), result)
+
+    def test_malformed_entry_is_an_invalid_response(self):
+        response = mock.Mock(json=mock.Mock(return_value={'USDTWD': {'UTC': '2026-10-18 00:00:00'}}))
+
+        self.assertTrue(self.api._handle_response(response).startswith("無效響應格式"))
+
+    def test_request_errors_pass_through(self):
+        self.assertEqual(self.api._handle_response("請求超時"), "請求超時")
+
+    def test_invalid_response_is_not_cached(self):
+        responses = iter([rate_response(TWD=32, VND=0), rate_response(TWD=32, JPY=160)])
+
+        with mock.patch.object(self.api, '_make_request', side_effect=lambda: next(responses)):
+            self.assertTrue(self.api.get_result("台幣", "日幣").startswith("無效響應格式"))
+            self.assertEqual(self.api.get_result("台幣", "日幣"), 5.0)
+
+
+def news_response(*titles):
+    return mock.Mock(json=mock.Mock(return_value={
+        'articles': [{'source': {'name': "來源"}, 'title': title, 'url': f"https://example.com/{index}"} for index, title in enumerate(titles)],
+    }))
+
+
+class NewsAPITests(SimpleTestCase):
+
+    def setUp(self):
+        self.api = NewsAPI()
+        reset_dataset_caches()
+        self.addCleanup(reset_dataset_caches)
+
+    def test_query_key_normalisation(self):
+        variants = ["AI 新聞", "ai 新聞", "ＡＩ　新聞", "  Ai   新聞 ", "ａｉ\t新聞"]
+
+        self.assertEqual({self.api._query_key(keyword) for keyword in variants}, {"ai 新聞"})
+
+    def test_equivalent_keywords_share_one_request(self):
+        with mock.patch.object(self.api, '_make_request', return_value=news_response("標題")) as make_request:
+            replies = {self.api.get_new_article(keyword) for keyword in ["AI 新聞", "ＡＩ　新聞", " ai  新聞"]}
+
+        make_request.assert_called_once_with("ai 新聞")
+        self.assertEqual(len(replies), 1)
+        self.assertIn("標題:標題", replies.pop())
+
+    @override_settings(NEWS_CACHE={'TTL': 0.05, 'STALE_TTL': 60})
+    def test_stale_articles_are_served_while_refreshing(self):
+        cache = get_dataset_cache('news')
+        responses = iter([news_response("舊標題"), news_response("新標題")])
+
+        with mock.patch.object(self.api, '_make_request', side_effect=lambda query: next(responses)) as request:
+            self.assertIn("舊標題", self.api.get_new_article("AI"))
+            time.sleep(0.06)
+
+            self.assertIn("舊標題", self.api.get_new_article("ai"))
+            self.assertTrue(self.wait_for(lambda: cache.get("ai") is not None))
+            self.assertIn("新標題", self.api.get_new_article("AI"))
+
+        self.assertEqual([call.args for call in request.call_args_list], [("ai",), ("ai",)])
+        self.assertEqual(cache.stats()['stale_hits'], 1)
+
+    @override_settings(NEWS_CACHE={'TTL': 0.05, 'STALE_TTL': 60})
+    def test_failed_refresh_keeps_the_stale_articles(self):
+        cache = get_dataset_cache('news')
+        responses = iter([news_response("舊標題"), "請求超時"])
+
+        with mock.patch.object(self.api, '_make_request', side_effect=lambda query: next(responses)):
+            self.api.get_new_article("AI")
+            time.sleep(0.06)
+            self.assertIn("舊標題", self.api.get_new_article("AI"))
+            self.assertTrue(self.wait_for(lambda: cache.stats()['refresh_errors'] == 1))
+
+        self.assertEqual(cache._lookup("ai")[0][0].title, "舊標題")
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+
+def station(name, county=None):
+    """中央氣象署 O-A0003-001 格式的觀測站資料"""
+    item = {
+        'StationName': name,
+        'ObsTime': {'DateTime': "2026-10-18T14:00:00+08:00"},
+        'WeatherElement': {
+            'Weather': "晴", 'UVIndex': 3, 'AirTemperature': 25.1, 'Now': {'Precipitation': 0.0},
+            'DailyExtreme': {
+                'DailyHigh': {'TemperatureInfo': {'AirTemperature': 28.0}},
+                'DailyLow': {'TemperatureInfo': {'AirTemperature': 21.5}},
+            },
+        },
+    }
+    if county is not None:
+        item['GeoInfo'] = {'CountyName': county}
+    return item
+
+
+OBSERVATIONS = {'records': {'Station': [
+    station("臺北", "臺北市"), station("信義", "臺北市"), station("板橋", "新北市"), station("東引", "測試縣"),
+    station("無縣市資料"),
+]}}
+
+
+class WeatherSnapshotTests(SimpleTestCase):
+
+    def setUp(self):
+        self.api = WeatherAPI()
+
+    def test_indexes_by_station_and_county(self):
+        snapshot = self.api._build_snapshot(OBSERVATIONS)
+
+        self.assertEqual(list(snapshot.stations), ["臺北", "信義", "板橋", "東引", "無縣市資料"])
+        self.assertEqual(snapshot.counties, {"臺北市": ["臺北", "信義"], "新北市": ["板橋"], "測試縣": ["東引"]})
+        self.assertIn("氣象站名稱:信義", self.api._format_current_weather(snapshot, "信義"))
+
+    def test_empty_and_failed_responses(self):
+        self.assertEqual(self.api._build_snapshot({}), WeatherSnapshot(stations={}, counties={}))
+        self.assertEqual(self.api._build_snapshot("請求超時"), "請求超時")
+
+    def test_county_stations_are_empty_when_the_snapshot_fails(self):
+        with mock.patch.object(self.api, '_get_snapshot', return_value="請求超時"):
+            self.assertEqual(self.api.get_county_stations("臺北市"), [])
+        with mock.patch.object(self.api, '_get_snapshot', return_value=self.api._build_snapshot(OBSERVATIONS)):
+            self.assertEqual(self.api.get_county_stations("臺北市"), ["臺北", "信義"])
+
+
+class WeatherCountyFallbackTests(SimpleTestCase):
+
+    def setUp(self):
+        self.api = WeatherIntegratedAPI()
+        self.snapshot = self.api.current_weather_api._build_snapshot(OBSERVATIONS)
+        self.get_snapshot = self.enterContext(
+            mock.patch.object(self.api.current_weather_api, '_get_snapshot', return_value=self.snapshot))
+
+    def test_mapped_county_uses_its_station(self):
+        station_name, current = self.api._get_current_weather("臺北市")
+
+        self.assertEqual(station_name, self.api.station_mapping["臺北市"])
+        self.assertTrue(current.startswith("氣象站名稱:臺北\n"))
+
+    def test_unmapped_county_falls_back_to_its_first_station(self):
+        self.assertNotIn("測試縣", self.api.station_mapping)
+
+        station_name, current = self.api._get_current_weather("測試縣")
+
+        self.assertEqual(station_name, "東引")
+        self.assertTrue(current.startswith(self.api.current_weather_prefix + "東引"))
+
+    def test_unknown_county_has_no_station(self):
+        self.assertEqual(self.api._get_current_weather("不存在縣"), (None, None))
+
+    def test_failed_snapshot_has_no_fallback_station(self):
+        self.get_snapshot.return_value = "請求超時"
+
+        self.assertEqual(self.api._get_current_weather("測試縣"), (None, None))
@@ -1,6 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.LINEBOT_ASYNC_WEBHOOK:
+    from .async_views import AsyncLineBotCallbackView as CallbackView
+else:
+    CallbackView = views.LineBotCallbackAPI
+
 urlpatterns=[
-    path('callback',views.LineBotCallbackAPI.as_view()),
+    path('callback',CallbackView.as_view()),
+    path('s/<str:code>',views.ShortLinkRedirectView.as_view(),name='short_link'),
 ]
\ No newline at end of file
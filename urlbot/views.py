@@ -1,18 +1,39 @@
+import logging
 import requests
+import unicodedata
+from collections import namedtuple
+from functools import partial
+from urllib.parse import urlsplit, urlunsplit
 from django.core.serializers import serialize
 from django.core.validators import URLValidator
-from django.core.exceptions import ValidationError
-from linebot.models import TextSendMessage, MessageEvent
+from django.db import transaction
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.http import Http404, HttpResponseRedirect
+from django.views import View
+from linebot.models import MessageEvent
 from rest_framework.response import Response
 from rest_framework  import status
 from rest_framework.views import APIView
-from linebot import LineBotApi, WebhookParser
 from django.conf import settings
 from rest_framework import status
 from rest_framework.viewsets import ModelViewSet
-from .models import Todolist
+from .models import ShortLink, ShortUrl, StockWatchlist, Todolist
 from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from .serializers import TodoListSerializer
+from .registry import get_registry
+from .http_client import get_http_client
+from .dispatcher import get_dispatcher, process_batch
+from .cache import _is_cacheable, get_dataset_cache
+from .schedules import cwa_forecast_ttl, cwa_observation_ttl, twse_ttl
+from .concurrency import run_parallel
+from .json_stream import Columns, iter_json_array, read_columns
+from .market_data import MarketDataStore
+from .shortlink import get_hit_counter, resolve_short_link
+from .router import CommandRouter
+from .replies import PARTIAL_DATA_NOTICE, REPLIES, WEATHER_NOT_FOUND_HINT
+from .rendering import ReplyBuilder, Template, as_messages
+
+logger = logging.getLogger(__name__)
 
 class LineBotCallbackAPI(APIView):
     """LINE Bot API 處理類
@@ -30,28 +51,61 @@ class LineBotCallbackAPI(APIView):
             stock: 股票查詢服務實例
             weather_forecast: 天氣預報服務實例
             todolist: 待辦事項管理實例
-            command_handlers: 命令處理器映射字典
+            stock_tracker: 股票追蹤清單實例
+            routes: 指令路徑與處理方法名稱的映射字典
+            command_aliases: 指令別名
+            user_routes: 處理時需要傳入 user_id 的指令路徑
+            router: 由上面三項建立的指令路由 每個 process 只建立一次
+
+        服務實例由 registry.get_registry() 統一管理 每個 worker 只建立一次。
     """
-    def __init__(self):
-        """將每個指令實例化"""
-        self.line_bot_api = LineBotApi(settings.LINE_CHANNEL_ACCESS_TOKEN)
-        self.parser = WebhookParser(settings.LINE_CHANNEL_SECRET)
-        self.shortener = URLShortener()
-        self.currency_transform = CurrencyTransformAPI()
-        self.news = NewsAPI()
-        self.stock = StockAPI()
-        self.weather = WeatherIntegratedAPI()
-        self.todolist=TodoList()
-
-        #將使用者輸入的指令映射到此
-        self.command_handlers = {
-            "縮網址": self._handle_url_shortener,
-            "匯率": self._handle_currency,
-            "股票": self._handle_stock,
-            "天氣": self._handle_weather,
-            "新聞": self._handle_news,
-            "todo": self._handle_todolist
-        }
+    #指令路徑對應到處理方法名稱 (處理方法, 固定參數...) 的固定參數會放在使用者參數前面
+    routes = {
+        "縮網址": "_handle_url_shortener",
+        "匯率": "_handle_currency",
+        "股票": "_handle_stock",
+        "股票 外資持股": "_handle_foreign_holdings",
+        "股票 每日成交": "_handle_daily_trading",
+        "股票 追蹤": ("_handle_stock_tracker", None),
+        "股票 追蹤 新增": ("_handle_stock_tracker", "新增"),
+        "股票 追蹤 刪除": ("_handle_stock_tracker", "刪除"),
+        "股票 成交量": ("_handle_stock_ranking", "成交量"),
+        "股票 成交值": ("_handle_stock_ranking", "成交值"),
+        "股票 漲幅": ("_handle_stock_ranking", "漲幅"),
+        "股票 跌幅": ("_handle_stock_ranking", "跌幅"),
+        "天氣": "_handle_weather",
+        "新聞": "_handle_news",
+        "todo": ("_handle_todolist", None),
+        "todo 列表": ("_handle_todolist", "列表"),
+        "todo 新增": ("_handle_todolist", "新增"),
+        "todo 刪除": ("_handle_todolist", "刪除"),
+        "todo 修改": ("_handle_todolist", "修改"),
+        "todo 完成": ("_handle_todolist", "完成"),
+    }
+    command_aliases = {
+        "短網址": "縮網址",
+        "待辦": "todo",
+        "todo 清單": "todo 列表",
+        "股票 追蹤 移除": "股票 追蹤 刪除",
+    }
+    # todo 與股票追蹤需要 透過user_id 將資料保存到資料庫
+    user_routes = ("todo", "股票 追蹤")
+    router = CommandRouter(routes, command_aliases, user_routes)
+
+    def __init__(self, **kwargs):
+        """從註冊表取得共用的服務實例 as_view() 每次請求都會建立新的 view 所以這裡不做任何實例化"""
+        super().__init__(**kwargs)
+        registry = get_registry()
+        self.line_bot_api = registry.line_bot_api
+        self.parser = registry.parser
+        self.shortener = registry.shortener
+        self.currency_transform = registry.currency_transform
+        self.news = registry.news
+        self.stock = registry.stock
+        self.weather = registry.weather
+        self.todolist = registry.todolist
+        self.stock_tracker = registry.stock_tracker
+
     def get(self,request,*args,**kwargs):
         """測試API是否成功"""
         return Response(
@@ -75,16 +129,28 @@ class LineBotCallbackAPI(APIView):
         except LineBotApiError:
             return Response({'error': 'LineBotApi error'},status=status.HTTP_400_BAD_REQUEST)
 
-        for event in events:
-            if isinstance(event, MessageEvent):
-                response_text = self._handle_message(event)
-                self.line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text=response_text)
-                )
+        message_events = [event for event in events if isinstance(event, MessageEvent)]
+
+        # 背景模式: 事件交給背景處理池 立即回覆 LINE 200
+        if settings.LINEBOT_WEBHOOK_MODE == 'background':
+            dispatcher = get_dispatcher()
+            for event in message_events:
+                dispatcher.submit(self._process_event, event)
+            return Response({'result': 'ok'}, status=status.HTTP_200_OK)
+
+        # 同一批次的多個事件並行處理 各自完成後立即回覆
+        process_batch(self._process_event, message_events)
 
         return Response({'result': 'ok'}, status=status.HTTP_200_OK)
 
+    def _process_event(self, event):
+        """處理單一訊息事件並回覆使用者"""
+        response = self._handle_message(event)
+        try:
+            self.line_bot_api.reply_message(event.reply_token, as_messages(response))
+        except LineBotApiError as error:
+            logger.error("回覆訊息失敗: %s", error)
+
     def _handle_message(self, event):
         """處理用戶發送的消息
 
@@ -95,119 +161,105 @@ class LineBotCallbackAPI(APIView):
             event: LINE 消息事件對象，包含用戶發送的消息內容
 
         Returns:
-            str: 處理結果的回覆消息
+            str | SendMessage: 處理結果的回覆消息 固定回覆為預先建立的訊息物件
         """
-        #訊息預處理
-        user_message = event.message.text.strip()
-        input_parts = user_message.split(" ")
+        match = self.router.resolve(event.message.text)
 
-        # 尋找對應的指令處理器
-        command=next((cmd for cmd in self.command_handlers if user_message.startswith(cmd)),None)
-
-        #找不到指令
-        if not command:
-            return support_command_message()
+        #找不到指令 回覆預先建立的指令說明
+        if match is None:
+            return REPLIES.message('help')
 
+        route, args = match
         try:
-            handler = self.command_handlers[command]
-            # todo 指令需要 透過user_id 將資料保存到資料庫
-            if command == "todo":
-                return handler(input_parts,event.source.user_id)
-            return handler(input_parts)
+            return route.invoke(self, args, event.source.user_id)
         except Exception as error:
             return error_message(error)
 
-    def _handle_url_shortener(self, input_parts):
+    def _handle_url_shortener(self, args):
         """處理縮網址指令"""
-        if len(input_parts) < 2:
-            return ("請輸入正確的縮網址格式\n"
-                    "   說明: 將長網址轉換為短網址\n"
-                    "   格式: 縮網址 [URL]\n"
-                    "   範例: 縮網址 https://www.google.com.tw/"
-                )
+        if not args:
+            return REPLIES.message('url_shortener_usage')
 
-        response = self.shortener.get_shorten_url(input_parts[1])
+        response = self.shortener.get_shorten_url(args[0])
         return response if isinstance(response, str) else f"對應的縮網址：{response}"
 
-    def _handle_currency(self,input):
+    def _handle_currency(self, args):
         """處理匯率指令"""
-        if len(input) < 3:
-            return (
-            "說明: 查詢即時匯率轉換\n",
-            "格式: 匯率 [原幣別] [目標幣別]\n"
-            "範例: 匯率 美金 台幣"
-            )
-        currency1, currency2 = input[1],input[2]
+        if len(args) < 2:
+            return REPLIES.message('currency_usage')
+        currency1, currency2 = args[0], args[1]
         response = self.currency_transform.get_result(currency1, currency2)
         return response if isinstance(response,str) else f"當前 1 {currency1} 可以兌換 {response} {currency2}"
 
-    def _handle_stock(self,input_part):
-        """處理股票指令"""
-        if len(input_part) < 2:  # 只輸入指令 沒有股票代碼
-            return (
-                "說明: 查詢股票即時資訊\n"
-                "格式: 股票 [股票代碼]\n"
-                "範例: 股票 2330\n"
-                )
-
-        if input_part[1] == "外資持股":
-            return  self.stock.get_foreign_holdings_info()
+    def _handle_stock(self, args):
+        """處理股票指令 子指令以外的參數為股票代碼"""
+        if not args:  # 只輸入指令 沒有股票代碼
+            return REPLIES.message('stock_usage')
 
-        elif input_part[1] == "每日成交":
-            return self.stock.get_MI_INDEX20()
+        #多檔股票摘要
+        if len(args) > 1:
+            return self.stock.get_stocks_summary(args)
 
         #個股資訊
-        else:
-            return self.stock.get_stock_full_info(input_part[1])
+        return self.stock.get_stock_full_info(args[0])
 
-    def _handle_weather(self, input):
-        """處理天氣指令"""
-        if len(input) < 2:
-            return (
-                "請輸入要查詢的縣市名稱\n"
-                "範例：天氣 臺北市\n"
-                "支援查詢的縣市：\n"
-                "北部：臺北市、新北市、基隆市、桃園市、新竹市、新竹縣\n"
-                "中部：臺中市、南投縣、彰化縣\n"
-                "南部：嘉義市、嘉義縣、臺南市、高雄市、屏東縣\n"
-                "東部：宜蘭縣、花蓮縣、臺東縣\n"
-                "外島：澎湖縣、金門縣、連江縣"
-            )
+    def _handle_foreign_holdings(self, args):
+        return self.stock.get_foreign_holdings_info()
+
+    def _handle_daily_trading(self, args):
+        return self.stock.get_MI_INDEX20()
+
+    def _handle_stock_ranking(self, name, args):
+        """排行 可指定名次數量"""
+        n = int(args[0]) if args and args[0].isdigit() else 5
+        return self.stock.get_ranking(name, n)
 
-        location_name = input[1].strip()
+    def _handle_stock_tracker(self, command, args, user_id):
+        """追蹤清單 需要 user_id"""
+        return self.stock_tracker.handle_command(command, args, user_id)
 
-        return self.weather.get_weather_info(location_name)
+    def _handle_weather(self, args):
+        """處理天氣指令"""
+        if not args:
+            return REPLIES.message('weather_usage')
+
+        return self.weather.get_weather_info(args[0])
 
-    def _handle_news(self,input):
+    def _handle_news(self, args):
         """處理新聞指令"""
-        if len(input)<2:
-            return (
-            "說明: 搜尋相關新聞\n"
-            "格式: 新聞 [關鍵字]\n"
-            "範例: 新聞 財金\n"
-            )
-        keyword=input[1]
-        return self.news.get_new_article(keyword)
+        if not args:
+            return REPLIES.message('news_usage')
+        return self.news.get_new_article(args[0])
 
-    def _handle_todolist(self, input, user_id):
+    def _handle_todolist(self, command, args, user_id):
         """處理待辦事項指令"""
-        if len(input)<2:
-            return (
-                "請輸入正確的待辦事項指令\n"
-                "支援的指令：\n"
-                "todo 列表\n"
-                "todo 新增 [事項名稱]\n"
-                "todo 刪除 [事項名稱]\n"
-                "todo 修改 [事項名稱] [狀態]"
-            )
+        if command is None:
+            return REPLIES.message('todo_usage')
+
+        return self.todolist.handle_command(command, args, user_id)
 
-        return self.todolist.handle_command(input, user_id)
+def normalize_url(url):
+    """正規化網址 寫法不同但指向同一頁的網址對應到同一個短網址
+
+    協定與主機名稱轉小寫、移除預設埠號、空路徑補上 /
+    # 錨點會改變頁面停留的位置 保留原樣 不同錨點各自對應一個短網址
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    userinfo, _, host = parts.netloc.rpartition('@')
+    host = host.lower()
+    default_port = {'http': ':80', 'https': ':443'}.get(scheme)
+    if default_port and host.endswith(default_port):
+        host = host[:-len(default_port)]
+    netloc = f"{userinfo}@{host}" if userinfo else host
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, parts.fragment))
 
 class URLShortener:
     """網址縮短服務
 
         使用 Bitly API 將長網址轉換為短網址的服務類。
         支援 URL 格式驗證和錯誤處理。
+        縮短結果保存在資料庫 (ShortUrl) 並以 LRU 快取，相同網址重複縮短時不會再呼叫 bitly。
 
         Attributes:
             api_token: Bitly API 認證令牌
@@ -218,6 +270,8 @@ class URLShortener:
             shortener = URLShortener()
             short_url = shortener.get_shorten_url("https://www.example.com")
         """
+    cache_name = 'shorturl'
+
     def __init__(self):
         """設置API驗證與EndPoint訊息"""
         self.api_token = settings.SHORTEN_URL_API_TOKEN
@@ -237,11 +291,10 @@ class URLShortener:
     def _make_request(self, url):
         """處理發送請求 返回一個respose 物件"""
         try:
-            response = requests.post(
+            response = get_http_client().post(
                 self.api_url,
                 headers=self.headers,
-                json={'long_url': url},
-                timeout=5
+                json={'long_url': url}
             )
             response.raise_for_status() #檢查status code
             return response
@@ -270,6 +323,24 @@ class URLShortener:
         except (KeyError, ValueError) as e:
             return f"無效的響應格式: {str(e)}"
 
+    def _get_or_create_short_url(self, long_url, normalized_url, url_hash):
+        """先查資料庫 沒有才呼叫 bitly 並保存結果 返回 ShortUrl 或錯誤訊息"""
+        short_url = ShortUrl.objects.filter(url_hash=url_hash).first()
+        if short_url is not None:
+            return short_url
+
+        response = self._make_request(long_url)
+        if isinstance(response,str):
+            return response
+
+        link = self._handle_response(response)
+        if self._validate_url(link) is not True: #回傳的不是網址代表解析失敗
+            return link
+
+        return ShortUrl.objects.get_or_create(
+            url_hash=url_hash, defaults={'long_url': normalized_url, 'short_url': link},
+        )[0]
+
     def get_shorten_url(self, long_url: str) -> str:
         """縮短指定的 URL
 
@@ -288,17 +359,65 @@ class URLShortener:
             if validation_result is not True:
                 return validation_result
 
-            #發送請求
-            response = self._make_request(long_url)
-            if isinstance(response,str): #如果return 是字串代表報錯
-                return response
-
-            #處理響應
-            return self._handle_response(response)
+            #依正規化後的網址查快取與資料庫 都沒有才發送請求
+            normalized_url = normalize_url(long_url)
+            url_hash = ShortUrl.hash_url(normalized_url)
+            result = get_dataset_cache(self.cache_name).get_or_fetch(
+                url_hash,
+                partial(self._get_or_create_short_url, long_url, normalized_url, url_hash),
+                ttl=settings.SHORT_URL_CACHE['TTL'],
+            )
+            return result if isinstance(result,str) else result.short_url
         #未知錯誤
         except Exception as e:
             return f"未預期的錯誤: {str(e)}"
 
+class LocalURLShortener(URLShortener):
+    """自架網址縮短服務 (URL_SHORTENER['BACKEND'] = 'local')
+
+    不呼叫 bitly，以 ShortLink 的主鍵 base62 編碼作為短碼，
+    由本站的 /s/<短碼> 轉址 (ShortLinkRedirectView)。
+    """
+    cache_name = 'shortlink'
+
+    def __init__(self):
+        super().__init__()
+        if not settings.URL_SHORTENER['BASE_URL']:
+            raise ImproperlyConfigured("使用自架短網址需要設定 SHORT_URL_BASE_URL")
+
+    def _get_or_create_short_url(self, long_url, normalized_url, url_hash):
+        """相同網址共用同一個短碼 返回 ShortLink
+
+        轉址目標存計算 url_hash 的正規化網址 同一個 key 只會轉到同一個頁面
+        """
+        return ShortLink.objects.get_or_create(url_hash=url_hash, defaults={'long_url': normalized_url})[0]
+
+
+def get_url_shortener_class(backend=None):
+    """依 URL_SHORTENER['BACKEND'] 取得縮網址服務類 (bitly / local)"""
+    backend = backend or settings.URL_SHORTENER['BACKEND']
+    shorteners = {'bitly': URLShortener, 'local': LocalURLShortener}
+    if backend not in shorteners:
+        raise ImproperlyConfigured(f"不支援的縮網址後端: {backend}")
+    return shorteners[backend]
+
+
+class ShortLinkRedirectView(View):
+    """自架短網址的轉址 /s/<短碼>
+
+    目標網址由 process 內的 LRU 快取提供 沒有才查資料庫，
+    點擊次數只在記憶體累加 由 HitCounter 批次寫入。
+    """
+
+    def get(self, request, code):
+        link = resolve_short_link(code)
+        if link is None:
+            raise Http404("找不到短網址")
+        link_id, target = link
+        get_hit_counter().record(link_id)
+        return HttpResponseRedirect(target)
+
+
 class CurrencyTransformAPI:
     """匯率轉換服務
 
@@ -341,7 +460,7 @@ class CurrencyTransformAPI:
     def _make_request(self):
         """返回一個requests.Response 物件"""
         try:
-            responses = requests.get(self.url,timeout=5)
+            responses = get_http_client().get(self.url)
             return responses
 
         except requests.exceptions.ConnectionError:
@@ -359,16 +478,47 @@ class CurrencyTransformAPI:
             }
             return f"代碼錯誤-{status_code}-{error_mapping.get(status_code)}-{e}"
 
-    def _handle_response(self,response,currency1,currency2):
+    def _handle_response(self,response):
+        """由完整匯率表預先算出所有支援貨幣之間的交叉匯率 {(原幣別代碼, 目標幣別代碼): 匯率}"""
+        if isinstance(response, str):
+            return response
+
         try:
             data=response.json()
-            usd_to_currency1_rate = float(data.get(f"USD{self.text[currency1]}")['Exrate'])
-            usd_to_currency2_rate = float(data.get(f"USD{self.text[currency2]}")['Exrate'])
-            return round(usd_to_currency2_rate / usd_to_currency1_rate, 4)
+            usd_rates = {'USD': 1.0}
+            for code in self.text.values():
+                entry = data.get(f"USD{code}")
+                if entry is not None:
+                    usd_rates[code] = float(entry['Exrate'])
+
+            return {
+                (code1, code2): round(rate2 / rate1, 4)
+                for code1, rate1 in usd_rates.items()
+                for code2, rate2 in usd_rates.items()
+            }
 
-        except (KeyError,ValueError) as e:
+        except (KeyError,ValueError,ZeroDivisionError) as e:
             return  (f"無效響應格式{str(e)}")
 
+    def _get_rate_matrix(self, refresh=False):
+        """取得交叉匯率表 過期後先回傳舊表並在背景更新 連續查詢只會向上游請求一次 refresh=True 時強制重新下載"""
+        config = settings.CURRENCY_CACHE
+        cache = get_dataset_cache('currency')
+        lookup = cache.refresh if refresh else cache.get_or_fetch
+        return lookup(
+            'capi', lambda: self._handle_response(self._make_request()),
+            ttl=config['TTL'], stale_ttl=config['STALE_TTL'],
+        )
+
+    def _lookup_rate(self,matrix,currency1,currency2):
+        if isinstance(matrix, str):
+            return matrix
+
+        rate = matrix.get((self.text[currency1], self.text[currency2]))
+        if rate is None:
+            return f"暫時無法取得 {currency1} 兌 {currency2} 的匯率"
+        return rate
+
     def get_result(self,currency1,currency2):
         try:
             #檢查使用者輸入
@@ -376,18 +526,16 @@ class CurrencyTransformAPI:
             if validate_result is not True:
                 return  validate_result
 
-            #驗證請求
-            response=self._make_request()
-            if isinstance(response,str):
-                return response
-
-            #處理響應
-            return self._handle_response(response,currency1,currency2)
+            #查表
+            return self._lookup_rate(self._get_rate_matrix(),currency1,currency2)
 
         #未知錯誤
         except Exception as e:
             return  f"未預期錯誤{str(e)}"
 
+#觀測資料快照 stations: {觀測站名稱: 觀測資料} counties: {縣市: [觀測站名稱]}
+WeatherSnapshot = namedtuple('WeatherSnapshot', ['stations', 'counties'])
+
 class WeatherAPI:
     """
     中央氣象署即時天氣觀測服務
@@ -400,6 +548,7 @@ class WeatherAPI:
             - 各氣象站觀測數據
             - 自動處理 API 請求錯誤
             - 支援多個觀測點資料
+            - 全國資料快取到下一次整點更新 並以觀測站與縣市建立索引
 
         資料內容：
             - 觀測站基本資訊
@@ -418,7 +567,7 @@ class WeatherAPI:
 
     def _make_request(self):
         try:
-            response = requests.get(self.url, params=self.params, timeout=5)
+            response = get_http_client().get(self.url, params=self.params)
             response.raise_for_status()
             return response
 
@@ -440,34 +589,67 @@ class WeatherAPI:
         except Exception as e:
             return f"解析資料錯誤{str(e)}"
 
+    def _get_snapshot(self, refresh=False):
+        """取得全國觀測資料快照 觀測每小時更新一次 期間所有使用者共用同一份下載 refresh=True 時強制重新下載"""
+        cache = get_dataset_cache('cwa')
+        lookup = cache.refresh if refresh else cache.get_or_fetch
+        return lookup('O-A0003-001', self._fetch_snapshot, ttl=cwa_observation_ttl)
+
+    def _fetch_snapshot(self):
+        return self._build_snapshot(self._handle_response(self._make_request()))
+
+    def _build_snapshot(self,data):
+        """建立觀測站名稱與縣市的索引"""
+        if isinstance(data,str): #Request/Response報錯
+            return data
+
+        stations = {}
+        counties = {}
+        for item in data.get('records', {}).get('Station', []):
+            station_name = item.get('StationName')
+            stations[station_name] = item
+            county = (item.get('GeoInfo') or {}).get('CountyName')
+            if county:
+                counties.setdefault(county, []).append(station_name)
+        return WeatherSnapshot(stations=stations, counties=counties)
+
     def get_current_weather(self,location_name):
-        """ 驗證request與response 是否正確 再return user對應要找的資料"""
-        response = self._make_request()
-        if isinstance(response, str): #Request報錯
-            return response
+        """ 從快照索引找出使用者要查詢的觀測站"""
         try:
-            data = self._handle_response(response)
-
-            if isinstance(data,str): #Response報錯
-                return data
-
-            response_data=""    #init
-
-            data=data.get('records', {}).get('Station', [])
-            for item in data:
-                if item.get('StationName')==location_name:
-                    daily_extreme=item.get('WeatherElement').get('DailyExtreme')   #拿取當天溫度最高最低data
-                    response_data=(
-                        f"氣象站名稱:{item.get('StationName','N/A')}\n"
-                        f"觀測時間:{item.get('ObsTime').get('DateTime','N/A')}\n"
-                        f"天氣:{item.get('WeatherElement').get('Weather','N/A')}\n"
-                        f"目前降雨量:{item.get('WeatherElement').get('Now').get('Precipitation','N/A')}毫米\n"
-                        f"紫外線指數:{item.get('WeatherElement').get('UVIndex','N/A')}\n"
-                        f"氣溫:{item.get('WeatherElement').get('AirTemperature','N/A')}\n"
-                        f"當日最高溫:{daily_extreme.get('DailyHigh').get('TemperatureInfo').get('AirTemperature')}度\n"
-                        f"當日最低溫:{daily_extreme.get('DailyLow').get('TemperatureInfo').get('AirTemperature')}度\n"
-                    )
-            return response_data if response_data else f"找不到{location_name}的觀測站資料"
+            snapshot = self._get_snapshot()
+            if isinstance(snapshot,str): #Request/Response報錯
+                return snapshot
+
+            return self._format_current_weather(snapshot,location_name)
+
+        except Exception as e:
+            return f"非預期錯誤{str(e)}"
+
+    def get_county_stations(self,county):
+        """回傳縣市內的觀測站名稱 資料取得失敗時為空列表"""
+        snapshot = self._get_snapshot()
+        if isinstance(snapshot,str):
+            return []
+        return snapshot.counties.get(county, [])
+
+    def _format_current_weather(self,snapshot,location_name):
+        """整理指定觀測站的回覆文字"""
+        try:
+            item = snapshot.stations.get(location_name)
+            if not item:
+                return f"找不到{location_name}的觀測站資料"
+
+            daily_extreme=item.get('WeatherElement').get('DailyExtreme')   #拿取當天溫度最高最低data
+            return (
+                f"氣象站名稱:{item.get('StationName','N/A')}\n"
+                f"觀測時間:{item.get('ObsTime').get('DateTime','N/A')}\n"
+                f"天氣:{item.get('WeatherElement').get('Weather','N/A')}\n"
+                f"目前降雨量:{item.get('WeatherElement').get('Now').get('Precipitation','N/A')}毫米\n"
+                f"紫外線指數:{item.get('WeatherElement').get('UVIndex','N/A')}\n"
+                f"氣溫:{item.get('WeatherElement').get('AirTemperature','N/A')}\n"
+                f"當日最高溫:{daily_extreme.get('DailyHigh').get('TemperatureInfo').get('AirTemperature')}度\n"
+                f"當日最低溫:{daily_extreme.get('DailyLow').get('TemperatureInfo').get('AirTemperature')}度\n"
+            )
 
         except Exception as e:
             return f"非預期錯誤{str(e)}"
@@ -484,6 +666,8 @@ class WeatherForecastAPI:
         - 溫度範圍
         - 舒適度
 
+    預報資料快取到下一次發布時間 並以縣市名稱建立索引。
+
     時段劃分：
         - 今天白天
         - 今晚明晨
@@ -494,6 +678,17 @@ class WeatherForecastAPI:
         forecast = weather.get_weather_forecast("臺北市")
     """
 
+    #預報回覆的開頭 其他回傳字串都是錯誤訊息
+    heading_template = Template("{location_name}天氣預報\n")
+    #單一時段的預報回覆範本
+    period_template = Template(
+        "\n{period}（{start}-{end}）：\n"
+        "天氣狀況：{wx}\n"
+        "降雨機率：{pop}%\n"
+        "溫度範圍：{min_t}°C - {max_t}°C\n"
+        "舒適度：{ci}\n"
+    )
+
     def __init__(self):
         self.url = "https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-C0032-001"
         self.params = {'Authorization': settings.WEATHER_API_TOKEN}
@@ -501,7 +696,7 @@ class WeatherForecastAPI:
     def _make_request(self):
         """發送請求"""
         try:
-            response = requests.get(self.url, params=self.params, timeout=5)
+            response = get_http_client().get(self.url, params=self.params)
             response.raise_for_status()
             return response
 
@@ -516,83 +711,100 @@ class WeatherForecastAPI:
         periods = ["今天白天", "今晚明晨", "明天白天"]
         return periods[time_idx]
 
-    def _handle_response(self,response,location_name):
-        """處理 API 回應資料"""
+    def _handle_response(self,response):
+        """處理 API 回應資料 建立 {縣市名稱: {天氣要素: 前三個時段}} 索引"""
         if isinstance(response, str):
             return response
 
         try:
             data = response.json()
-            locations = data.get('records', {}).get('location', [])
-
-            # 如果指定地區，只返回該地區資料
-            if location_name:
-                locations = [loc for loc in locations if loc['locationName'] == location_name]
-                if not locations:
-                    return f"找不到 {location_name} 的天氣預報"
-
-            weather_info = []
-            for location in locations:
-                location_name = location['locationName']
-                weather_elements = location['weatherElement']
-
+            index = {}
+            for location in data.get('records', {}).get('location', []):
                 # 建立易於存取的天氣要素字典
-                elements_dict = {elem['elementName']: elem['time'] for elem in weather_elements}
-
-                location_text = f"{location_name}天氣預報\n"
-
-                #處理每個時間區段
-                for time_idx in range(3):
-                    period_text = self._get_weather_period_text(time_idx)
-                    location_text += f"\n{period_text}（{elements_dict['Wx'][time_idx]['startTime'][11:16]}-{elements_dict['Wx'][time_idx]['endTime'][11:16]}）：\n"
-
-                    # 天氣現象
-                    wx = elements_dict['Wx'][time_idx]['parameter']['parameterName']
-                    location_text += f"天氣狀況：{wx}\n"
+                index[location['locationName']] = {
+                    elem['elementName']: elem['time'][:3] for elem in location['weatherElement']
+                }
+            return index
 
-                    # 降雨機率
-                    pop = elements_dict['PoP'][time_idx]['parameter']['parameterName']
-                    location_text += f"降雨機率：{pop}%\n"
-
-                    # 溫度範圍
-                    min_t = elements_dict['MinT'][time_idx]['parameter']['parameterName']
-                    max_t = elements_dict['MaxT'][time_idx]['parameter']['parameterName']
-                    location_text += f"溫度範圍：{min_t}°C - {max_t}°C\n"
-
-                    # 舒適度
-                    ci = elements_dict['CI'][time_idx]['parameter']['parameterName']
-                    location_text += f"舒適度：{ci}\n"
+        except Exception as e:
+            return f"解析資料錯誤: {str(e)}"
 
-                weather_info.append(location_text)
+    def _get_forecast_index(self, refresh=False):
+        """取得預報索引 預報約每 6 小時發布一次 期間所有使用者共用同一份下載 refresh=True 時強制重新下載"""
+        cache = get_dataset_cache('cwa')
+        lookup = cache.refresh if refresh else cache.get_or_fetch
+        return lookup(
+            'F-C0032-001', lambda: self._handle_response(self._make_request()), ttl=cwa_forecast_ttl,
+        )
 
-            return "\n".join(weather_info)
+    def _format_forecast(self,location_name,elements_dict):
+        """整理單一縣市的預報回覆文字"""
+        try:
+            builder = ReplyBuilder(self.heading_template(location_name=location_name))
+
+            def value(element, time_idx):
+                return elements_dict[element][time_idx]['parameter']['parameterName']
+
+            #處理每個時間區段
+            for time_idx in range(3):
+                builder.add(self.period_template(
+                    period=self._get_weather_period_text(time_idx),
+                    start=elements_dict['Wx'][time_idx]['startTime'][11:16],
+                    end=elements_dict['Wx'][time_idx]['endTime'][11:16],
+                    wx=value('Wx', time_idx),     # 天氣現象
+                    pop=value('PoP', time_idx),   # 降雨機率
+                    min_t=value('MinT', time_idx),
+                    max_t=value('MaxT', time_idx),
+                    ci=value('CI', time_idx),     # 舒適度
+                ))
+
+            return builder.build()
 
         except Exception as e:
             return f"解析資料錯誤: {str(e)}"
 
+    def _lookup_forecast(self,index,location_name):
+        if isinstance(index, str):
+            return index
+
+        elements_dict = index.get(location_name)
+        if elements_dict is None:
+            return f"找不到 {location_name} 的天氣預報"
+        return self._format_forecast(location_name, elements_dict)
+
     def get_weather_forecast(self, location_name):
         """獲取天氣預報資訊"""
         if not location_name:
             return "請輸入要查詢的縣市地點"
-        response = self._make_request()
-        if isinstance(response, str):
-            return response
 
         try:
-            return self._handle_response(response,location_name)
+            return self._lookup_forecast(self._get_forecast_index(), location_name)
         except Exception as e:
             return f"非預期錯誤: {str(e)}"
 
+def _is_complete_dataset(data):
+    """證交所維護期間會回傳空陣列 空的資料集與下載失敗相同 不快取也不算預先更新成功"""
+    return _is_cacheable(data) and len(data) > 0
+
+def _is_complete_index(index):
+    """只有完整的索引才以正常的 TTL 快取"""
+    return isinstance(index, MarketDataStore) and not index.partial and len(index) > 0
+
 class StockAPI:
     """股票資訊查詢服務
 
        提供台灣股市相關資訊查詢功能。
        數據來源：臺灣證券交易所 OpenAPI
 
+       資料集以 twse 快取保存 依交易時段決定快取時間 (見 schedules.twse_ttl)。
+       個股查詢使用欄位式的 MarketDataStore (urlbot/market_data.py) 只在資料更新時重建。
+
        支援功能：
            - 外資持股前五名統計
            - 每日成交量前五名
+           - 成交量、成交值、漲幅、跌幅排行 (由全市場資料計算)
            - 個股完整資訊查詢
+           - 多檔股票摘要查詢 (同一份快取一次查完)
 
        提供的資訊：
            - 基本報價資訊（股價、漲跌幅）
@@ -603,17 +815,86 @@ class StockAPI:
            api = StockAPI()
            stock_info = api.get_stock_full_info("2330")
        """
+    #個股索引只需要的欄位 串流解析時其餘欄位直接丟棄
+    basic_fields = ('Code', 'Name', 'PEratio', 'PBratio', 'DividendYield')
+    daily_fields = (
+        'Code', 'Name', 'ClosingPrice', 'Change', 'HighestPrice', 'LowestPrice', 'TradeVolume', 'TradeValue', 'Transaction',
+    )
+
+    #排行子指令 {名稱: (欄位, 是否由小到大, 正負號篩選, 標題)} 由快取的全市場資料計算 不需要額外請求
+    rankings = {
+        '成交量': ('trade_volume', False, 0, "集中市場每日成交量前{n}名證券"),
+        '成交值': ('trade_value', False, 0, "集中市場每日成交金額前{n}名證券"),
+        '漲幅': ('change_percent', False, 1, "集中市場今日漲幅前{n}名證券"),
+        '跌幅': ('change_percent', True, -1, "集中市場今日跌幅前{n}名證券"),
+    }
+    ranking_max = 20
+    batch_max = 10 #多檔查詢一次最多的股票數
+
+    #回覆範本 import 時建立一次
+    foreign_holding_template = Template(
+        "名次: {rank}\n"
+        "股票: {name}\n"
+        "代號為: {code}\n"
+        "總股數為: {share_number}\n"
+        "可投資股數: {available_share:,}股\n"
+        "已投資股數: {shares_held:,}股\n"
+        "可投資比例: {available_percent}%\n"
+        "已投資比例: {held_percent}%\n"
+        "上限比例: {upper_limit}%\n"
+        "---------------------------\n"
+    )
+    ranking_template = Template(
+        "名次: {rank}\n"
+        "股票: {name}({code})\n"
+        "收盤價: {closing_price}\n"
+        "漲跌: {change}{change_percent}\n"
+        "成交量: {trade_volume}股\n"
+        "成交筆數: {transaction}筆\n"
+        "成交金額: {trade_value}元\n"
+        "-------------------------------\n"
+    )
+    MI_INDEX20_template = Template(
+        "名次: {rank}\n"
+        "股票: {name}({code})\n"
+        "成交量: {trade_volume:,}張\n"
+        "成交筆數: {transaction:,}筆\n"
+        "收盤價: {closing_price}\n"
+        "漲跌: {direction}{change}\n"
+        "最高: {highest_price} / 最低: {lowest_price}\n"
+        "-------------------------------\n"
+    )
+    summary_template = Template("{name}({code}) {closing_price}元 漲跌 {change}{change_percent} 量 {trade_volume}股")
+    stock_record_template = Template(
+        "{name}({code}) 股票資訊\n"
+        "\n價格資訊\n"
+        "收盤價: {closing_price}元\n"
+        "漲跌: {change}元\n"
+        "最高/最低: {highest_price}/{lowest_price}\n"
+        "\n技術指標\n"
+        "本益比: {pe_ratio}\n"
+        "股價淨值比: {pb_ratio}\n"
+        "殖利率: {dividend_yield}\n"
+        "交易量\n"
+        "成交量: {trade_volume}股\n"
+        "成交金額: {trade_value}元\n"
+    )
+
     def __init__(self):
         self.url_fund_MI_QFIIS_sort_20 = "https://openapi.twse.com.tw/v1/fund/MI_QFIIS_sort_20"  # 集中市場外資及陸資持股前5名統計表
         self.url_MI_INDEX20="https://openapi.twse.com.tw/v1/exchangeReport/MI_INDEX20" #集中市場每日成交量前5名證券
         self.url_BWIBBU_ALL="https://openapi.twse.com.tw/v1/exchangeReport/BWIBBU_ALL" #個股基本資料(含收盤價、本益比、股價淨值比)
         self.url_STOCK_DAY_ALL= "https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_ALL"# 個股日成交資訊
 
-    def _make_request(self,url):
-        """檢查request請求"""
+    def _make_request(self,url,stream=False):
+        """檢查request請求 stream=True 時不先讀取回應內容"""
         try:
-            response=requests.get(url,timeout=5)
-            response.raise_for_status()
+            response=get_http_client().get(url, stream=stream)
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError:
+                response.close()  # stream=True 時回應還沒讀完 關閉才會把連線還給連線池
+                raise
             return response
 
         except requests.exceptions.Timeout:
@@ -633,105 +914,281 @@ class StockAPI:
         except Exception as e: #response報錯
             return f"解析資料錯誤:{str(e)}"
 
+    def _dataset_key(self, url):
+        """以 endpoint 名稱作為快取 key 例如 STOCK_DAY_ALL"""
+        return url.rsplit('/', 1)[-1]
+
+    def get_dataset(self, url, refresh=False):
+        """取得證交所資料集 資料每個交易日只更新一次 優先使用快取 refresh=True 時強制重新下載"""
+        cache = get_dataset_cache('twse')
+        lookup = cache.refresh if refresh else cache.get_or_fetch
+        return lookup(
+            self._dataset_key(url),
+            lambda: self._handle_response(self._make_request(url)),
+            ttl=twse_ttl,
+            cacheable=_is_complete_dataset,
+        )
+
     def get_foreign_holdings_info(self):
         """獲取外資持股前5名資訊"""
-        response=self._make_request(self.url_fund_MI_QFIIS_sort_20)
-        data=self._handle_response(response)
-        text="當前外資持股前五名為\n"
+        data=self.get_dataset(self.url_fund_MI_QFIIS_sort_20)
+        return self._format_foreign_holdings(data)
 
+    def _format_foreign_holdings(self,data):
+        """整理外資持股前5名回覆文字"""
         if isinstance(data,str):
             return data
 
+        builder = ReplyBuilder("當前外資持股前五名為\n")
         for i in data[:5]:
-            text+=(
-            f"名次: {i.get('Rank')}\n"
-            f"股票: {i.get('Name')}\n"
-            f"代號為: {i.get('Code')}\n"
-            f"總股數為: {int(i.get('ShareNumber'))}\n"
-            f"可投資股數: {int(i['AvailableShare']):,}股\n"
-            f"已投資股數: {int(i['SharesHeld']):,}股\n"
-            f"可投資比例: {i['AvailableInvestPer']}%\n"
-            f"已投資比例: {i['SharesHeldPer']}%\n"
-            f"上限比例: {i['Upperlimit']}%\n"
-            f"---------------------------\n"
-            )
-        return text
+            builder.add(self.foreign_holding_template(
+                rank=i.get('Rank'),
+                name=i.get('Name'),
+                code=i.get('Code'),
+                share_number=int(i.get('ShareNumber')),
+                available_share=int(i['AvailableShare']),
+                shares_held=int(i['SharesHeld']),
+                available_percent=i['AvailableInvestPer'],
+                held_percent=i['SharesHeldPer'],
+                upper_limit=i['Upperlimit'],
+            ))
+        return builder.build()
 
     def get_MI_INDEX20(self):
-        """集中市場每日成交量前五名證券"""
-        response=self._make_request(self.url_MI_INDEX20)
-        data=self._handle_response(response)
-
+        """集中市場每日成交量前五名證券 由快取的全市場資料計算 沒有交易資料時才向證交所查詢排行"""
+        index = self.get_stock_index()
+        if not self._has_daily_data(index):
+            return self._format_MI_INDEX20(self.get_dataset(self.url_MI_INDEX20))
+        return self._format_ranking(index, '成交量', 5)
+
+    def _has_daily_data(self, index):
+        """索引含有交易資料時 成交量排行可以直接由索引計算"""
+        return not isinstance(index, str) and 'STOCK_DAY_ALL' not in index.missing
+
+    def get_ranking(self, name, n=5):
+        """依排行名稱 (成交量/成交值/漲幅/跌幅) 取得前 n 名"""
+        return self._format_ranking(self.get_stock_index(), name, n)
+
+    def _format_ranking(self, index, name, n):
+        """整理排行回覆文字"""
+        if isinstance(index, str):
+            return "資料獲取失敗\n"
+        if 'STOCK_DAY_ALL' in index.missing:
+            return "交易資料暫時無法取得 請稍後再試\n"
+
+        n = max(1, min(n, self.ranking_max))
+        field, ascending, sign, title = self.rankings[name]
+        records = index.top(field, n, ascending=ascending, sign=sign)
+        if not records:
+            return f"今日沒有符合{name}排行的證券\n"
+        # 上漲或下跌的個股不足 n 檔時只列出符合的部分
+        builder = ReplyBuilder(title.format(n=len(records)), "\n")
+        for rank, record in enumerate(records, start=1):
+            builder.add(self.ranking_template(
+                rank=rank,
+                name=record.name,
+                code=record.code,
+                closing_price=self._format_number(record.closing_price),
+                change=self._format_number(record.change),
+                change_percent=self._format_change_percent(record),
+                trade_volume=self._format_number(record.trade_volume, ',.0f'),
+                transaction=self._format_number(record.transaction, ',.0f'),
+                trade_value=self._format_number(record.trade_value, ',.0f'),
+            ))
+        return builder.build()
+
+    def _format_MI_INDEX20(self,data):
+        """整理每日成交量前五名回覆文字"""
         if isinstance(data,str):
-            return response
+            return data
 
         try:
-            text="集中市場每日成交量前五名證券\n"
+            builder = ReplyBuilder("集中市場每日成交量前五名證券\n")
             for i in data[:5]:
-                text += (
-                    f"名次: {i['Rank']}\n"
-                    f"股票: {i['Name']}({i['Code']})\n"
-                    f"成交量: {int(i['TradeVolume']):,}張\n"
-                    f"成交筆數: {int(i['Transaction']):,}筆\n"
-                    f"收盤價: {i['ClosingPrice']}\n"
-                    f"漲跌: {i['Dir']}{i['Change']}\n"
-                    f"最高: {i['HighestPrice']} / 最低: {i['LowestPrice']}\n"
-                    "-------------------------------\n"
-                )
-            return text
+                builder.add(self.MI_INDEX20_template(
+                    rank=i['Rank'],
+                    name=i['Name'],
+                    code=i['Code'],
+                    trade_volume=int(i['TradeVolume']),
+                    transaction=int(i['Transaction']),
+                    closing_price=i['ClosingPrice'],
+                    direction=i['Dir'],
+                    change=i['Change'],
+                    highest_price=i['HighestPrice'],
+                    lowest_price=i['LowestPrice'],
+                ))
+            return builder.build()
 
         except Exception as e:
             return f"資料處理錯誤: {str(e)}"
 
     def get_stock_full_info(self, stock_code):
-        """獲取完整的股票資訊"""
-        # 取得基本資料
-        basic_response = self._make_request(self.url_BWIBBU_ALL)
-        basic_data = self._handle_response(basic_response)
+        """獲取完整的股票資訊 以股票代碼索引直接查詢"""
+        return self._format_stock_full_info(self.get_stock_index(), stock_code)
 
-        # 取得交易資料
-        daily_response = self._make_request(self.url_STOCK_DAY_ALL)
-        daily_data = self._handle_response(daily_response)
+    def _format_stock_full_info(self, index, stock_code):
+        if isinstance(index, str):
+            return "資料獲取失敗\n"
 
-        if isinstance(basic_data, str) or isinstance(daily_data, str):
+        record = index.get(stock_code)
+        if record is None:
+            return f"找不到股票代碼 {stock_code} 的資訊"
+
+        text = self._format_stock_record(record)
+        if index.partial:
+            text += PARTIAL_DATA_NOTICE + "\n"
+        return text
+
+    def get_stocks_summary(self, stock_codes):
+        """多檔股票摘要 所有代碼都從同一份快取的索引查詢 回覆一則精簡訊息"""
+        return self.format_stocks_summary(self.get_stock_index(), stock_codes)
+
+    def format_stocks_summary(self, index, stock_codes):
+        """以已取得的索引整理多檔股票摘要 追蹤清單與收盤推播共用同一份索引 index 為錯誤訊息時回傳失敗提示"""
+        if isinstance(index, str):
             return "資料獲取失敗\n"
 
+        stock_codes = list(dict.fromkeys(stock_codes)) #去除重複 保留順序
+        skipped = stock_codes[self.batch_max:]
+        builder, not_found = ReplyBuilder(), []
+        for code in stock_codes[:self.batch_max]:
+            record = index.get(code)
+            if record is None:
+                not_found.append(code)
+                continue
+
+            builder.add_line(self.summary_template(
+                name=record.name,
+                code=record.code,
+                closing_price=self._format_number(record.closing_price),
+                change=self._format_number(record.change),
+                change_percent=self._format_change_percent(record),
+                trade_volume=self._format_number(record.trade_volume, ',.0f'),
+            ))
+
+        if not_found:
+            builder.add_line(f"找不到股票代碼: {' '.join(not_found)}")
+        if skipped:
+            builder.add_line(f"一次最多查詢 {self.batch_max} 檔 已略過: {' '.join(skipped)}")
+        if index.partial:
+            builder.add_line(PARTIAL_DATA_NOTICE)
+        return builder.build()
+
+    def _download(self, url, fields):
+        """串流下載單一資料集 邊讀邊解析 只保留 fields 欄位 失敗時回傳錯誤訊息
+
+        全市場資料上萬筆 不會一次把整份 JSON 轉成 list[dict]，每筆解析完只留下需要的欄位。
+        """
+        response = self._make_request(url, stream=True)
+        if isinstance(response, str):
+            return response
+
         try:
-            #處理基本訊息
-            basic_info = None
-            for item in basic_data:
-                if item['Code'] == stock_code:
-                    basic_info = item
-                    break
-
-            # 處理交易資料
-            daily_info = None
-            for item in daily_data:
-                if item['Code'] == stock_code:
-                    daily_info = item
-                    break
-
-            if not basic_info or not daily_info:
-                return f"找不到股票代碼 {stock_code} 的資訊"
+            chunks = response.iter_content(chunk_size=settings.TWSE_CACHE['STREAM_CHUNK_SIZE'])
+            return read_columns(iter_json_array(chunks), fields)
 
-            return (
-                f"{basic_info['Name']}({stock_code}) 股票資訊\n"
-                f"\n價格資訊\n"
-                f"收盤價: {daily_info['ClosingPrice']}元\n"
-                f"漲跌: {daily_info['Change']}元\n"
-                f"最高/最低: {daily_info['HighestPrice']}/{daily_info['LowestPrice']}\n"
-                f"\n技術指標\n"
-                f"本益比: {basic_info['PEratio']}\n"
-                f"股價淨值比: {basic_info['PBratio']}\n"
-                f"殖利率: {basic_info['DividendYield']}%\n"
-                f"交易量\n"
-                f"成交量: {int(daily_info['TradeVolume']):,}股\n"
-                f"成交金額: {int(daily_info['TradeValue']):,}元\n"
-                )
+        except requests.exceptions.RequestException as e: #讀取途中斷線或逾時
+            return f"請求錯誤:{str(e)}"
+
+        except (ValueError, AttributeError) as e: #格式錯誤
+            return f"解析資料錯誤:{str(e)}"
+
+        finally:
+            response.close()
+
+    def _fetch_datasets(self, datasets):
+        """同時下載多個證交所資料集 共用 FETCH_DEADLINE 截止時間
+
+        總延遲為最慢的那一個 而不是全部相加；逾時的資料集以 "請求超時" 表示。
+
+        Args:
+            datasets: {資料集名稱: (url, 欄位)}
+
+        Returns:
+            dict: {資料集名稱: Columns 或錯誤訊息}
+        """
+        return run_parallel(
+            {name: partial(self._download, url, fields) for name, (url, fields) in datasets.items()},
+            timeout=settings.TWSE_CACHE['FETCH_DEADLINE'],
+        )
+
+    def get_stock_index(self, refresh=False):
+        """取得以股票代碼為 key 的索引 (MarketDataStore 失敗時為錯誤訊息) 資料更新時才重建 refresh=True 時強制重新下載"""
+        cache = get_dataset_cache('twse')
+        lookup = cache.refresh if refresh else cache.get_or_fetch
+        return lookup(
+            'STOCK_INDEX', self._fetch_stock_index, ttl=twse_ttl, cacheable=_is_complete_index,
+        )
+
+    def _fetch_stock_index(self):
+        datasets = self._fetch_datasets({
+            'BWIBBU_ALL': (self.url_BWIBBU_ALL, self.basic_fields),
+            'STOCK_DAY_ALL': (self.url_STOCK_DAY_ALL, self.daily_fields),
+        })
+        return self._store_partial_index(self._build_stock_index(datasets['BWIBBU_ALL'], datasets['STOCK_DAY_ALL']))
+
+    def _store_partial_index(self, index):
+        """只拿到部分資料時短暫快取 讓之後的查詢盡快重新下載"""
+        if isinstance(index, MarketDataStore) and index.partial:
+            get_dataset_cache('twse').set('STOCK_INDEX', index, settings.TWSE_CACHE['PARTIAL_TTL'])
+        return index
+
+    def _build_stock_index(self, basic_data, daily_data):
+        """把基本資料與交易資料 (Columns) 合併成 MarketDataStore
+
+        其中一個資料集失敗時仍以另一個建立索引 缺少的欄位為 None。
+        """
+        # 證交所維護期間會回傳空陣列 當成下載失敗 只拿到部分資料時以 PARTIAL_TTL 短暫快取
+        if not isinstance(basic_data, str) and not basic_data.rows:
+            basic_data = "證交所資料暫時無法取得"
+        if not isinstance(daily_data, str) and not daily_data.rows:
+            daily_data = "證交所資料暫時無法取得"
+        if isinstance(basic_data, str) and isinstance(daily_data, str):
+            return daily_data
+
+        missing = []
+        if isinstance(basic_data, str):
+            basic_data, missing = Columns(self.basic_fields), ['BWIBBU_ALL']
+        if isinstance(daily_data, str):
+            # 沒有交易資料時以基本資料的代碼建立索引
+            daily_data, missing = Columns(['Code'], rows=basic_data.rows), ['STOCK_DAY_ALL']
+            daily_data['Code'].extend(basic_data['Code'])
+
+        try:
+            return MarketDataStore.from_columns(basic_data, daily_data, missing)
+
+        except (KeyError, TypeError) as e:
+            return f"資料處理錯誤: {str(e)}"
+
+    def _format_number(self, value, spec='.2f'):
+        return 'N/A' if value is None else f"{value:{spec}}"
+
+    def _format_change_percent(self, record):
+        return f" ({record.change_percent:+.2f}%)" if record.change_percent is not None else ""
+
+    def _format_stock_record(self, record):
+        """整理個股資訊回覆文字"""
+        try:
+            return self.stock_record_template(
+                name=record.name,
+                code=record.code,
+                closing_price=self._format_number(record.closing_price),
+                change=self._format_number(record.change),
+                highest_price=self._format_number(record.highest_price),
+                lowest_price=self._format_number(record.lowest_price),
+                pe_ratio=self._format_number(record.pe_ratio),
+                pb_ratio=self._format_number(record.pb_ratio),
+                dividend_yield=self._format_number(record.dividend_yield) + ('%' if record.dividend_yield is not None else ''),
+                trade_volume=self._format_number(record.trade_volume, ',.0f'),
+                trade_value=self._format_number(record.trade_value, ',.0f'),
+            )
 
         except Exception as e:
             return f"資料處理錯誤: {str(e)}"
 
+#新聞搜尋結果 只保留回覆會用到的欄位
+NewsArticle = namedtuple('NewsArticle', ['source', 'author', 'title', 'url', 'image', 'date'])
+
 class NewsAPI:
     """
     新聞搜尋服務
@@ -751,6 +1208,7 @@ class NewsAPI:
             - 支援中文搜尋
             - 每次返回最新的三則新聞
             - 自動處理缺失資訊
+            - 依正規化後的關鍵字快取結果 過期後先回傳舊結果並在背景更新 (settings.NEWS_CACHE)
 
         使用範例:
             api = NewsAPI()
@@ -763,13 +1221,13 @@ class NewsAPI:
     def _make_request(self,query)-> requests.Response:
         """ 返回一個response物件"""
         try:
-            # 查詢參數
-            self.params = {
+            # 查詢參數 (服務實例由所有請求共用 不能存在 self 上)
+            params = {
                 'q': query,
                 'language': 'zh',
                 'apiKey': self.api_key
             }
-            response=requests.get(self.url,params=self.params,timeout=5)
+            response=get_http_client().get(self.url,params=params)
             response.raise_for_status()
             return response
 
@@ -779,48 +1237,63 @@ class NewsAPI:
         except requests.RequestException as e:
             return f"請求錯誤{str(e)}"
 
+    def _query_key(self,keyword):
+        """正規化關鍵字 全形半形統一、忽略大小寫與多餘空白 讓相同查詢共用快取"""
+        return " ".join(unicodedata.normalize('NFKC', keyword).casefold().split())
+
     def _handle_response(self,response):
-        """處理資料格式"""
+        """處理資料格式 只保留前三則新聞"""
         if isinstance(response,str):
             return response
         try:
             article_list = response.json().get('articles', [])
-            if not article_list:
-                return "找不到相關的內文 請重新嘗試新的關鍵字"
-
-            result_data = []
-            for data in article_list[:3]: #取前三則新聞
-                source = data['source'].get('name','未知來源')
-                author = data.get('author', '未知作者')
-                title = data.get('title', '未知標題')
-                url = data.get('url', '未知網址')
-                image = data.get('urlToImage', '未知圖片')
-                date = data.get('publishedAt', '未知日期')
-
-                news_item = (
-                    f"來源名稱:{source}\n"
-                    f"作者:{author}\n"
-                    f"標題:{title}\n"
-                    f"文章網址:{url}\n"
-                    f"文章圖片:{image}\n"
-                    f"發布日期:{date}\n"
-                    "--------------------------------------------------------"
+            return [
+                NewsArticle(
+                    source=data['source'].get('name','未知來源'),
+                    author=data.get('author', '未知作者'),
+                    title=data.get('title', '未知標題'),
+                    url=data.get('url', '未知網址'),
+                    image=data.get('urlToImage', '未知圖片'),
+                    date=data.get('publishedAt', '未知日期'),
                 )
-                result_data.append(news_item)
-            return "\n".join(result_data)
+                for data in article_list[:3] #取前三則新聞
+            ]
 
         except Exception as e:
             return f"資料錯誤 {str(e)}"
 
+    def _format_articles(self,articles):
+        if isinstance(articles,str):
+            return articles
+        if not articles:
+            return "找不到相關的內文 請重新嘗試新的關鍵字"
+
+        result_data = []
+        for article in articles:
+            news_item = (
+                f"來源名稱:{article.source}\n"
+                f"作者:{article.author}\n"
+                f"標題:{article.title}\n"
+                f"文章網址:{article.url}\n"
+                f"文章圖片:{article.image}\n"
+                f"發布日期:{article.date}\n"
+                "--------------------------------------------------------"
+            )
+            result_data.append(news_item)
+        return "\n".join(result_data)
+
+    def _get_articles(self,query):
+        """取得新聞 熱門關鍵字在快取期間只會向 newsapi 請求一次"""
+        config = settings.NEWS_CACHE
+        return get_dataset_cache('news').get_or_fetch(
+            query, lambda: self._handle_response(self._make_request(query)),
+            ttl=config['TTL'], stale_ttl=config['STALE_TTL'],
+        )
+
     def get_new_article(self,keyword):
         """給外部call 主funtion 負責檢查request跟response是否有錯誤"""
-        response=self._make_request(keyword)
-        data=self._handle_response(response)
-
-        if isinstance(data,str):
-            return data
         try:
-            return data
+            return self._format_articles(self._get_articles(self._query_key(keyword)))
 
         except Exception as e: #未預期錯誤
             return f"發生錯誤 {str(e)}"
@@ -836,6 +1309,7 @@ class TodoList:
         - 刪除待辦事項
         - 更新待辦事項狀態
         - 查看待辦清單
+        新增、刪除、修改可以一次指定多個事項 以一次批次查詢處理並回報各事項的結果
 
     待辦事項狀態：
         - completed: 已完成
@@ -843,58 +1317,75 @@ class TodoList:
 
     使用範例:
         todo = TodoList()
-        todo.create_todo(["todo", "新增", "運動"], "user123")
-        todo.retrieve_todo(["todo", "列表"], "user123")
+        todo.handle_command("新增", ["運動", "讀書"], "user123")
+        todo.handle_command("完成", ["運動"], "user123")
+        todo.handle_command("列表", [], "user123")
     """
 
+    batch_max = 20 #一次最多處理的事項數量
+
     def __init__(self):
         self.commands = {
             "新增": self.create_todo,
             "刪除": self.delete_todo,
             "修改": self.update_todo,
+            "完成": self.complete_todo,
             "列表": self.retrieve_todo
         }
 
-    def handle_command(self, input_parts, user_id) -> str:
-        """處理待辦事項指令"""
-
-        command = input_parts[1]
+    def handle_command(self, command, args, user_id):
+        """處理待辦事項指令 args 為子指令之後的參數 指令不正確時回傳預先建立的使用說明訊息"""
 
-        if (command!="列表" and len(input_parts)<3) or command not in self.commands:
-            return   (
-                "說明: 待辦事項管理\n"
-                "子指令\n"
-                "列表: 查看所有待辦事項\n"
-                "新增: 新增待辦事項 (todo 新增 [事項名稱])\n"
-                "刪除: 刪除待辦事項 (todo 刪除 [事項名稱])\n"
-                "修改: 更改待辦狀態 (todo 修改 [事項名稱] completed/pending)\n"
-                )
+        if (command!="列表" and not args) or command not in self.commands:
+            return REPLIES.message('todo_command_usage')
         handler = self.commands[command]
-        return handler(input_parts, user_id)
-
-    def create_todo(self,input,user_id):
-        """新增待辦事項"""
-        data={
-            'title':input[2],
-            'user_id':user_id
-        }
-
-        serializer=TodoListSerializer(data=data)
-        todo=Todolist.objects.filter(user_id=user_id,title=input[2]).first()
-        if todo:
-            return f"{todo.title}已存在 無法重複新增"
-
-        if serializer.is_valid():
-            todo=serializer.save()
-            return f"成功新增{todo.title}"
+        return handler(args, user_id)
+
+    def _split_titles(self, titles):
+        """去除重複 保留順序 超過 batch_max 的部分略過"""
+        titles = list(dict.fromkeys(titles))
+        return titles[:self.batch_max], titles[self.batch_max:]
+
+    def _report(self, over_limit, *sections):
+        """整理批次操作的結果 sections 為 (標題, 事項名稱) 沒有事項的段落不顯示"""
+        builder = ReplyBuilder()
+        for label, titles in sections:
+            if titles:
+                builder.add_line(f"{label}: {'、'.join(titles)}")
+        if over_limit:
+            builder.add_line(f"一次最多處理 {self.batch_max} 項 已略過: {'、'.join(over_limit)}")
+        return builder.build()
+
+    def create_todo(self,args,user_id):
+        """新增待辦事項 可一次新增多項 已存在的事項略過
+
+        在同一個 transaction 內以一次查詢找出已存在的名稱 再以一次 bulk_create 新增其餘事項。
+        """
+        titles, over_limit = self._split_titles(args)
+        valid, invalid = [], []
+        for title in titles:
+            serializer = TodoListSerializer(data={'title': title, 'user_id': user_id})
+            (valid if serializer.is_valid() else invalid).append(title)
+
+        with transaction.atomic():
+            existing = set(
+                Todolist.objects.filter(user_id=user_id, title__in=valid).values_list('title', flat=True)
+            )
+            created = [title for title in valid if title not in existing]
+            Todolist.objects.bulk_create([Todolist(user_id=user_id, title=title) for title in created])
 
-        return "新增失敗"
+        return self._report(
+            over_limit,
+            ("成功新增", created),
+            ("已存在 略過", [title for title in valid if title in existing]),
+            ("新增失敗 名稱無效", invalid),
+        )
 
-    def delete_todo(self,input,user_id):
-        """刪除todo物件"""
+    def delete_todo(self,args,user_id):
+        """刪除todo物件 可一次刪除多項"""
 
         #一次刪除全部
-        if input[2]=="全部":
+        if args[0]=="全部":
             todo=Todolist.objects.filter(user_id=user_id)
 
             if todo:
@@ -903,41 +1394,51 @@ class TodoList:
 
             return "當前代辦事項已經為空 不需要刪除!"
 
-        todo = Todolist.objects.filter(user_id=user_id, title=input[2]).first()
-
-        if not todo:
-            return "當前事項不存在"
-
-        todo.delete()
-        response_text = f"成功刪除{todo.title}"
-        return response_text
-
-    def update_todo(self,input,user_id):
-        """更新代辦事項的狀態"""
-        if len(input)<4:
+        titles, over_limit = self._split_titles(args)
+        with transaction.atomic():
+            todos = Todolist.objects.filter(user_id=user_id, title__in=titles)
+            existing = set(todos.values_list('title', flat=True))
+            todos.delete()
+
+        return self._report(
+            over_limit,
+            ("成功刪除", [title for title in titles if title in existing]),
+            ("當前事項不存在", [title for title in titles if title not in existing]),
+        )
+
+    def update_todo(self,args,user_id):
+        """更新代辦事項的狀態 最後一個參數為狀態 前面可以有多個事項"""
+        if len(args)<2:
             return "請輸入要修改的狀態 請使用completed 或是 pending"
 
-        todo = Todolist.objects.filter(user_id=user_id, title=input[2]).first()
-
-        if not todo:
-            return "找不到該待辦事項"
-
-        title = input[2]
-        new_status = input[3]
+        new_status = args[-1]
         if new_status not in ['completed','pending']:
             return "無效的狀態修改,請使用 completed 或是 pending"
 
-        if todo.status==new_status:
-            return f"{title}已是{new_status}狀態了"
+        return self._set_status(args[:-1], new_status, user_id)
+
+    def complete_todo(self,args,user_id):
+        """把多個事項標記為完成"""
+        return self._set_status(args, 'completed', user_id)
 
-        todo.status = new_status
-        todo.save()
-        serializer = TodoListSerializer(todo)
-        response_text = f"已成功把{serializer.data['title']}修改為 {serializer.data['status']}狀態了!"
+    def _set_status(self, titles, new_status, user_id):
+        """以一次 update 修改多個事項的狀態 已是該狀態或不存在的事項分別回報"""
+        titles, over_limit = self._split_titles(titles)
+        with transaction.atomic():
+            current = dict(
+                Todolist.objects.filter(user_id=user_id, title__in=titles).values_list('title', 'status')
+            )
+            changed = [title for title in titles if title in current and current[title] != new_status]
+            Todolist.objects.filter(user_id=user_id, title__in=changed).update(status=new_status)
 
-        return response_text
+        return self._report(
+            over_limit,
+            (f"已修改為 {new_status}", changed),
+            (f"已是 {new_status} 略過", [title for title in titles if current.get(title) == new_status]),
+            ("找不到該待辦事項", [title for title in titles if title not in current]),
+        )
 
-    def retrieve_todo(self,input,user_id):
+    def retrieve_todo(self,args,user_id):
         """查看使用者已儲存的代辦事項"""
 
         todos = Todolist.objects.filter(user_id=user_id)
@@ -946,16 +1447,92 @@ class TodoList:
         if not serializer.data:
             return "目前沒有待辦事項"
 
-        response_text = "您的待辦清單如下\n"
+        builder = ReplyBuilder("您的待辦清單如下\n")
 
         for i, todo in enumerate(serializer.data, 1):
             status = "✅" if todo['status'] == "completed" else "⭕"
-            response_text += f"{i}. {status} {todo['title']}\n"
+            builder.add_line(f"{i}. {status} {todo['title']}")
+
+        return builder.build()
 
-        return response_text
+class StockTracker:
+    """股票追蹤清單
+
+    使用者保存要追蹤的股票 (StockWatchlist)，以「股票 追蹤」查看摘要，
+    收盤後由 push_stock_digest 指令統一推播。
+    所有使用者共用同一份快取的全市場資料 不會因為使用者數量增加對外請求。
+
+    使用範例:
+        tracker = StockTracker(StockAPI())
+        tracker.handle_command("新增", ["2330"], "user123")
+        tracker.handle_command(None, [], "user123")
+    """
+    def __init__(self, stock_api):
+        self.stock_api = stock_api
+
+    def handle_command(self, command, codes, user_id):
+        """處理追蹤指令 command 為子指令 (新增/刪除 沒有子指令時為 None) codes 為股票代碼"""
+        index = self.stock_api.get_stock_index() if self.needs_index(command, codes) else None
+        return self.handle_command_with_index(command, codes, user_id, index)
+
+    def needs_index(self, command, codes):
+        """查看追蹤清單與新增追蹤需要股票索引 其他指令不需要下載行情"""
+        return (command is None and not codes) or (command == "新增" and bool(codes))
+
+    def handle_command_with_index(self, command, codes, user_id, index):
+        """以取得的股票索引處理追蹤指令 同步與非同步 view 共用 index 只在 needs_index() 為 True 時使用"""
+        if command is None and not codes:
+            codes = self.get_codes(user_id)
+            if not codes:
+                return "目前沒有追蹤的股票\n"
+            return self.stock_api.format_stocks_summary(index, codes)
+
+        if command not in ("新增", "刪除") or not codes:
+            return REPLIES.message('stock_tracker_usage')
+        if command == "新增":
+            return self.add(user_id, codes, index)
+        return self.remove(user_id, codes)
+
+    def get_codes(self, user_id):
+        return list(StockWatchlist.objects.filter(user_id=user_id).values_list('stock_code', flat=True))
+
+    def add(self, user_id, codes, index):
+        """新增追蹤 有索引時先確認代碼存在 每人最多追蹤 StockAPI.batch_max 檔"""
+        existing = set(self.get_codes(user_id))
+        codes = [code for code in dict.fromkeys(codes) if code not in existing]
+        if not isinstance(index, str):
+            unknown = [code for code in codes if code not in index]
+            if unknown:
+                return f"找不到股票代碼: {' '.join(unknown)}"
+
+        limit = self.stock_api.batch_max
+        if len(existing) + len(codes) > limit:
+            return f"最多追蹤 {limit} 檔股票 目前已追蹤 {len(existing)} 檔"
+        if not codes:
+            return "股票已在追蹤清單中"
+
+        StockWatchlist.objects.bulk_create(
+            [StockWatchlist(user_id=user_id, stock_code=code) for code in codes], ignore_conflicts=True,
+        )
+        return f"成功追蹤 {' '.join(codes)}"
+
+    def remove(self, user_id, codes):
+        watchlist = StockWatchlist.objects.filter(user_id=user_id)
+        if codes != ["全部"]:
+            watchlist = watchlist.filter(stock_code__in=codes)
+
+        deleted, _ = watchlist.delete()
+        if not deleted:
+            return "追蹤清單中沒有這些股票"
+        return f"已取消追蹤 {deleted} 檔股票"
 
 class WeatherIntegratedAPI:
-    """整合天氣查詢服務"""
+    """整合天氣查詢服務
+
+    同時查詢天氣預報與即時觀測，即時觀測未在截止時間內完成時只回覆預報。
+    """
+    #即時觀測回覆的開頭 (WeatherAPI._format_current_weather) 其他回傳字串都是錯誤訊息
+    current_weather_prefix = "氣象站名稱:"
 
     def __init__(self):
         self.current_weather_api = WeatherAPI()
@@ -1001,127 +1578,62 @@ class WeatherIntegratedAPI:
         if not location_name:
             return "請輸入要查詢的縣市名稱\n範例：天氣 臺北市"
 
-        # 先取得天氣預報（以縣市名稱查詢）
-        forecast = self.forecast_api.get_weather_forecast(location_name)
-
-        # 找到對應的觀測站名稱
-        station_name = self.station_mapping.get(location_name)
-        current_weather = None
-        if station_name:
-            current_weather = self.current_weather_api.get_current_weather(station_name)
-
-        # 組合輸出訊息
-        message = f"🌈 {location_name} 天氣資訊\n"
-        message += "=" * 30 + "\n\n"
-
-        if "找不到" in forecast:
-            return (
-                f"❌ 找不到 {location_name} 的天氣資訊\n"
-                "請輸入完整的縣市名稱，例如：\n"
-                "- 臺北市（而不是 臺北）\n"
-                "- 嘉義市 或 嘉義縣\n"
-                "支援查詢的縣市：\n"
-                "北部：臺北市、新北市、基隆市、桃園市、新竹市、新竹縣\n"
-                "中部：臺中市、南投縣、彰化縣\n"
-                "南部：嘉義市、嘉義縣、臺南市、高雄市、屏東縣\n"
-                "東部：宜蘭縣、花蓮縣、臺東縣\n"
-                "外島：澎湖縣、金門縣、連江縣"
-            )
-
-        # 優先顯示預報資訊
-        if forecast and "找不到" not in forecast:
-            message += "🔮 天氣預報\n"
-            message += forecast + "\n"
-
-        # 如果有觀測站資料，則顯示即時觀測
-        if current_weather and "找不到" not in current_weather:
-            message += "\n📍 即時觀測"
-            if station_name != location_name:
-                message += f"（{station_name}觀測站）"
-            message += "\n"
-            message += current_weather
-
-        return message
-
-def support_command_message():
-    """顯示所有支援的指令說明
+        # 預報與即時觀測同時查詢 共用同一個截止時間
+        results = run_parallel(
+            {
+                'forecast': partial(self.forecast_api.get_weather_forecast, location_name),
+                'current': partial(self._get_current_weather, location_name),
+            },
+            timeout=settings.CWA_CACHE['FETCH_DEADLINE'],
+        )
 
-    整理並展示所有可用的指令格式與使用範例，協助用戶正確使用服務。
+        # 即時觀測逾時或失敗時 只回覆預報
+        station_name, current_weather = results['current'] if isinstance(results['current'], tuple) else (None, None)
+        return self._combine_weather_info(location_name, station_name, results['forecast'], current_weather)
 
-    Returns:
-        str: 格式化的指令說明文字
+    def _get_current_weather(self, location_name):
+        """找到對應的觀測站並查詢即時觀測 對照表沒有時改用該縣市的第一個觀測站
 
-    使用範例:
-        當用戶輸入未知指令時顯示此訊息
-    """
-    commands = {
-        "縮網址": {
-            "說明": "將長網址轉換為短網址",
-            "格式": "縮網址 [URL]",
-            "範例": "縮網址 https://www.google.com.tw/",
-        },
-        "匯率": {
-            "說明": "查詢即時匯率轉換",
-            "格式": "匯率 [原幣別] [目標幣別]",
-            "範例": "匯率 美金 台幣",
-        },
-        "股票": {
-            "說明": "查詢股票即時資訊",
-            "格式": "股票 [股票代碼]",
-            "範例": "股票 2330",
-        },
-        "天氣": {
-            "說明": "查詢36小時天氣預報",
-            "格式": "天氣 [縣市名]",
-            "範例": "天氣 嘉義",
-        },
-        "新聞": {
-            "說明": "搜尋相關新聞",
-            "格式": "新聞 [關鍵字]",
-            "範例": "新聞 財金",
-        },
-        "todo": {
-            "說明": "待辦事項管理",
-            "子指令": {
-                "列表": "查看所有待辦事項",
-                "新增": "新增待辦事項 (todo 新增 [事項名稱])",
-                "刪除": "刪除待辦事項 (todo 刪除 [事項名稱])",
-                "修改": "更改待辦狀態 (todo 修改 [事項名稱] completed/pending)",
-            },
-            "範例": [
-                "todo 列表",
-                "todo 新增 運動",
-                "todo 刪除 運動",
-                "todo 修改 運動 completed",
-            ],
-        },
-    }
+        Returns:
+            tuple: (觀測站名稱, 觀測資訊) 找不到觀測站時皆為 None
+        """
+        station_name = self.station_mapping.get(location_name) or next(
+            iter(self.current_weather_api.get_county_stations(location_name)), None)
+        if not station_name:
+            return None, None
+        return station_name, self.current_weather_api.get_current_weather(station_name)
 
-    # 組織輸出格式
-    message = "📝 指令使用說明\n" + "=" * 30 + "\n\n"
+    def _combine_weather_info(self, location_name, station_name, forecast, current_weather):
+        """組合預報與即時觀測成一則回覆
 
-    for cmd, info in commands.items():
-        message += f"🔸 {cmd}\n"
-        message += f"  說明：{info['說明']}\n"
+        預報或即時觀測回傳的是錯誤訊息 (請求超時、請求錯誤等) 時不放進回覆，
+        兩者都無法取得時只回覆一則暫時無法取得的訊息。
+        """
+        if "找不到" in forecast:
+            return f"❌ 找不到 {location_name} 的天氣資訊\n" + WEATHER_NOT_FOUND_HINT
 
-        if "格式" in info:
-            message += f"  格式：{info['格式']}\n"
+        has_forecast = forecast.startswith(self.forecast_api.heading_template(location_name=location_name))
+        has_current = bool(current_weather) and current_weather.startswith(self.current_weather_prefix)
+        if not has_forecast and not has_current:
+            return f"⚠️ {location_name} 的天氣資料暫時無法取得 請稍後再試"
 
-        if "子指令" in info:
-            message += "  子指令：\n"
-            for subcmd, desc in info['子指令'].items():
-                message += f"    - {subcmd}: {desc}\n"
+        # 組合輸出訊息
+        builder = ReplyBuilder(f"🌈 {location_name} 天氣資訊\n", "=" * 30, "\n\n")
 
-        message += "  範例：\n"
-        if isinstance(info.get('範例'), list):
-            for example in info['範例']:
-                message += f"    {example}\n"
+        # 優先顯示預報資訊
+        if has_forecast:
+            builder.add("🔮 天氣預報\n", forecast, "\n")
         else:
-            message += f"    {info['範例']}\n"
+            builder.add("⚠️ 天氣預報暫時無法取得\n")
 
-        message += "\n"
+        # 如果有觀測站資料，則顯示即時觀測
+        if has_current:
+            builder.add("\n📍 即時觀測")
+            if station_name != location_name:
+                builder.add(f"（{station_name}觀測站）")
+            builder.add("\n", current_weather)
 
-    return message
+        return builder.build()
 
 def error_message(message):
     """格式化錯誤訊息